@@ -1,497 +1,110 @@
 """
 КНДР-парсер — Конкурентный анализ структуры страниц
 Деплой: Streamlit Community Cloud
-Загрузка страниц: ScrapingBee API (JS рендеринг, обход Cloudflare)
+Загрузка страниц: напрямую, при необходимости — ScrapingBee API (JS рендеринг, обход Cloudflare)
+
+Здесь только интерфейс: Streamlit перезапускает этот файл при каждом действии
+пользователя, а загрузка, разбор, группировка и отчёты живут в engine.py и
+импортируются один раз на процесс.
 """
 
-import io
-import re
-import json
-import string
-import asyncio
-import concurrent.futures
+import os
+import time
+from pathlib import Path
 from urllib.parse import urlparse
-from collections import defaultdict
 
-import httpx
 import streamlit as st
-import pandas as pd
-from bs4 import BeautifulSoup
-import openpyxl
-from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
 
-# ═══════════════════════════════════════════════════════════════════════════════
-#  СЛОВАРЬ СИНОНИМОВ (русский + английский)
-# ═══════════════════════════════════════════════════════════════════════════════
-SYNONYM_GROUPS = {
-    "🦸 Герой / Hero": [
-        # RU
-        "герой", "главный", "первый экран", "обложка", "баннер", "слайдер", "слайд",
-        "добро пожаловать", "мы помогаем", "мы создаём", "мы делаем",
-        # EN
-        "hero", "welcome", "banner", "slider", "above the fold", "headline",
-        "we help", "we create", "we build", "get started",
-    ],
-    "⭐ Преимущества": [
-        "преимущество", "выгода", "польза", "плюс", "достоинство", "особенность",
-        "почему мы", "почему нас", "зачем", "чем мы лучше", "наши преимущества",
-        "why us", "why choose", "benefits", "advantages", "features", "what makes",
-    ],
-    "🛠️ Услуги / Продукты": [
-        "услуга", "сервис", "решение", "продукт", "предложение", "направление",
-        "что мы делаем", "что мы предлагаем", "наши услуги", "наши продукты",
-        "services", "products", "solutions", "offerings", "what we do",
-    ],
-    "💰 Цены / Тарифы": [
-        "цена", "стоимость", "тариф", "прайс", "расценка", "сколько стоит",
-        "пакет", "тарифный план", "оплата", "стоить",
-        "price", "pricing", "plans", "packages", "cost", "rates", "tariff",
-    ],
-    "💬 Отзывы": [
-        "отзыв", "мнение", "оценка", "рецензия", "рекомендация", "что говорят",
-        "наши клиенты", "нам доверяют",
-        "testimonials", "reviews", "feedback", "what our clients say", "what people say",
-    ],
-    "❓ FAQ": [
-        "faq", "вопрос", "ответ", "частый вопрос", "часто задают",
-        "frequently asked", "questions", "q&a", "answers",
-    ],
-    "👥 Команда": [
-        "команда", "сотрудник", "специалист", "эксперт", "мастер", "профессионал",
-        "наша команда", "познакомьтесь",
-        "team", "our team", "meet", "staff", "experts", "specialists",
-    ],
-    "🏢 О компании": [
-        "компания", "организация", "студия", "агентство", "кто мы", "о нас",
-        "история", "миссия", "ценности", "о компании",
-        "about", "about us", "our story", "mission", "vision", "who we are",
-    ],
-    "📞 Контакты": [
-        "контакт", "связь", "адрес", "телефон", "написать", "позвонить",
-        "обратная связь", "свяжитесь", "форма связи",
-        "contact", "contacts", "get in touch", "reach us", "write to us",
-    ],
-    "🗂️ Портфолио / Кейсы": [
-        "портфолио", "кейс", "проект", "наши работы", "пример работ",
-        "portfolio", "case studies", "our work", "projects", "examples",
-    ],
-    "🤝 Партнёры / Клиенты": [
-        "партнёр", "партнер", "клиент", "логотип", "бренд", "нам доверяют",
-        "с нами работают", "наши клиенты",
-        "partners", "clients", "trusted by", "brands", "our clients",
-    ],
-    "🛡️ Гарантии": [
-        "гарантия", "гарантировать", "обязательство", "уверенность", "надёжность",
-        "guarantee", "guarantees", "warranty", "commitment", "reliability",
-    ],
-    "📋 Процесс / Этапы": [
-        "процесс", "этап", "шаг", "как мы работаем", "порядок работы",
-        "схема", "как это работает",
-        "process", "how it works", "steps", "our process", "workflow",
-    ],
-    "📊 Статистика / Цифры": [
-        "статистика", "цифра", "факт", "достижение", "результат", "показатель",
-        "нас выбрали", "доверяют",
-        "stats", "statistics", "numbers", "achievements", "results", "facts",
-    ],
-    "📝 Блог / Статьи": [
-        "блог", "статья", "новость", "публикация", "пост", "материал",
-        "blog", "articles", "news", "posts", "latest", "insights",
-    ],
-    "🎥 Видео": [
-        "видео", "ролик", "презентация", "демо", "смотреть",
-        "video", "watch", "demo", "presentation",
-    ],
-    "📩 CTA / Заявка": [
-        "заявка", "записаться", "получить", "заказать", "попробовать",
-        "начать", "купить", "оставить заявку", "бесплатно",
-        "cta", "call to action", "sign up", "get started", "try free",
-        "book", "order", "buy", "request",
-    ],
-}
-
-
-def build_keyword_index() -> dict[str, str]:
-    """Словарь keyword → group name"""
-    idx = {}
-    for group, keywords in SYNONYM_GROUPS.items():
-        for kw in keywords:
-            idx[kw.lower()] = group
-    return idx
-
-
-KEYWORD_INDEX = build_keyword_index()
-
-
-def normalize(text: str) -> str:
-    """Нормализация: lower + удаление пунктуации"""
-    text = text.lower()
-    text = re.sub(r"[^\w\s]", " ", text, flags=re.UNICODE)
-    return re.sub(r"\s+", " ", text).strip()
-
-
-def assign_group(heading: str) -> str:
-    """Определяет семантическую группу заголовка по ключевым словам"""
-    norm = normalize(heading)
-
-    # Сначала ищем многословные фразы (длиннее — точнее)
-    sorted_kws = sorted(KEYWORD_INDEX.keys(), key=len, reverse=True)
-    for kw in sorted_kws:
-        if kw in norm:
-            return KEYWORD_INDEX[kw]
-
-    # Fallback: первые значимые слова
-    words = [w for w in norm.split() if len(w) > 3]
-    return " ".join(words[:3]) if words else heading[:25]
+from engine import (
+    CACHE_TTL,
+    CHANGE_LABELS,
+    CRAWL_MAX_DEPTH,
+    CRAWL_MAX_PAGES,
+    EXPORT_FORMATS,
+    FETCH_STRATEGIES,
+    MAX_HTML_CHARS,
+    METRIC_SOURCES,
+    PARSE_POOL_MIN_BYTES,
+    SNAPSHOTS_PATH,
+    STAGE_LABELS,
+    STREAM_MIN_CHARS,
+    SYNONYM_FINGERPRINT,
+    SYNONYM_GROUPS,
+    BlockMemo,
+    HtmlCache,
+    PageParser,
+    RenderProfiles,
+    ReportExports,
+    RunStats,
+    SnapshotStore,
+    blocks_frame,
+    crawl_site,
+    dedupe_urls,
+    fetch_all,
+    group_page_counts,
+    missing_groups,
+    missing_section_groups,
+    presence_matrix,
+    recommendation,
+    refine_groups,
+    section_blocks,
+    site_labels,
+)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-#  ЗАГРУЗКА СТРАНИЦ (ScrapingBee)
+#  ОБЩИЕ ДЛЯ СЕССИЙ ОБЪЕКТЫ (один раз на процесс)
 # ═══════════════════════════════════════════════════════════════════════════════
-def fetch_via_scrapingbee(url: str, api_key: str, timeout: int = 30) -> tuple[str | None, str | None]:
-    """Загружает страницу через ScrapingBee API с JS-рендерингом"""
-    endpoint = "https://app.scrapingbee.com/api/v1/"
-    params = {
-        "api_key": api_key,
-        "url": url,
-        "render_js": "true",
-        "wait": "2000",           # ждём 2 сек после JS
-        "wait_for": "body",
-        "block_ads": "true",
-        "block_resources": "false",
-        "return_page_source": "true",
-    }
-    try:
-        with httpx.Client(timeout=timeout + 10) as client:
-            r = client.get(endpoint, params=params)
-        if r.status_code == 200:
-            return r.text, None
-        elif r.status_code == 401:
-            return None, "❌ Неверный API-ключ ScrapingBee"
-        elif r.status_code == 422:
-            return None, f"❌ Сайт заблокировал парсинг (код 422)"
-        elif r.status_code == 500:
-            return None, "❌ ScrapingBee: внутренняя ошибка сервера"
-        else:
-            return None, f"❌ HTTP {r.status_code}: {r.text[:200]}"
-    except httpx.TimeoutException:
-        return None, f"❌ Таймаут ({timeout} сек)"
-    except Exception as e:
-        return None, f"❌ {str(e)[:150]}"
+@st.cache_resource(show_spinner=False)
+def default_render_profiles() -> RenderProfiles:
+    """Профили рендера на процесс (один файл — один владелец)"""
+    return RenderProfiles()
+
+
+@st.cache_resource(show_spinner=False)
+def default_block_memo() -> BlockMemo:
+    """Память блоков на процесс, общая для сессий Streamlit"""
+    return BlockMemo()
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def snapshot_diff(path: str, old_run: int, new_run: int, url: str | None):
+    """Сохранённые запуски не меняются — изменения между парой считаются один раз"""
+    return SnapshotStore(Path(path)).diff(old_run, new_run, None if url is None else [url])
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
-#  ПАРСИНГ HTML → БЛОКИ
+#  STREAMLIT UI
 # ═══════════════════════════════════════════════════════════════════════════════
-def extract_blocks(html: str, mode: str) -> list[dict]:
+def reusable_pages(saved: dict[str, dict], urls: list[str], params: dict, ttl: int = CACHE_TTL) -> dict[str, dict]:
     """
-    Возвращает список блоков с метаданными.
-    mode: 'main' | 'inner'
+    Результаты прошлых запусков сессии, которые можно не пересчитывать:
+    те же параметры, без ошибки и не старше ttl. Просроченные удаляются из saved.
     """
-    soup = BeautifulSoup(html, "lxml")
-
-    # Убираем мусор
-    for tag in soup(["script", "style", "noscript", "svg", "meta", "link"]):
-        tag.decompose()
-
-    body = soup.find("body") or soup
-
-    if mode == "inner":
-        for rem in body.find_all(["header", "footer", "nav"]):
-            rem.decompose()
-
-    search_root = body
-    heading_tags = ["h1", "h2", "h3", "h4", "h5", "h6"]
-    blocks = []
-    seen_ids = set()
-
-    for heading in search_root.find_all(heading_tags):
-        heading_text = heading.get_text(strip=True)
-        if not heading_text or len(heading_text) < 2:
-            continue
-
-        # Ближайший родительский section/div/article
-        block_el = None
-        current = heading.parent
-        for _ in range(8):
-            if current is None or current.name in ("body", "html", "[document]"):
-                block_el = heading.parent
-                break
-            if current.name in ("section", "div", "article", "main", "aside"):
-                block_el = current
-                break
-            current = current.parent
-        if block_el is None:
-            block_el = heading.parent
-
-        el_id = id(block_el)
-        if el_id in seen_ids:
-            continue
-        seen_ids.add(el_id)
-
-        text = block_el.get_text(separator=" ", strip=True)
-
-        # Кнопки: <button> + <a> с текстом
-        buttons = block_el.find_all("button")
-        links_cta = [
-            a for a in block_el.find_all("a")
-            if a.get_text(strip=True) and len(a.get_text(strip=True)) < 60
-        ]
-        forms = block_el.find_all("form")
-        lists = block_el.find_all(["ul", "ol"])
-        iframes = block_el.find_all("iframe")
-        videos = block_el.find_all("video")
-        tables = block_el.find_all("table")
-        images = block_el.find_all("img")
-
-        # FAQ Schema.org
-        faq_schema = False
-        for script in block_el.find_all("script", type="application/ld+json"):
-            try:
-                data = json.loads(script.string or "")
-                items = [data] if isinstance(data, dict) else (data if isinstance(data, list) else [])
-                for item in items:
-                    if isinstance(item, dict) and item.get("@type") == "FAQPage":
-                        faq_schema = True
-            except Exception:
-                pass
-
-        blocks.append({
-            "heading": heading_text,
-            "level": int(heading.name[1]),
-            "text_len": len(text),
-            "buttons": len(buttons) + len(links_cta),
-            "has_form": bool(forms),
-            "has_list": bool(lists),
-            "has_iframe": bool(iframes),
-            "has_video": bool(videos),
-            "has_table": bool(tables),
-            "images": len(images),
-            "has_faq_schema": faq_schema,
-            "group": assign_group(heading_text),
-        })
-
-    return blocks
+    now = time.time()
+    for url in [u for u, e in saved.items() if now - e["fetched_at"] > ttl]:
+        del saved[url]
+    return {
+        url: saved[url]
+        for url in dict.fromkeys(urls)
+        if url in saved and saved[url]["params"] == params and not saved[url]["error"]
+    }
 
 
-# ═══════════════════════════════════════════════════════════════════════════════
-#  EXCEL
-# ═══════════════════════════════════════════════════════════════════════════════
-def make_excel(
-    target_url: str,
-    competitor_urls: list[str],
-    all_results: dict[str, list[dict]],
-) -> bytes:
-
-    # Группируем блоки по group
-    all_groups: dict[str, dict[str, list[dict]]] = {}
-    for url, blocks in all_results.items():
-        all_groups[url] = defaultdict(list)
-        for b in blocks:
-            all_groups[url][b["group"]].append(b)
-
-    # Все уникальные группы, отсортированные
-    unique_groups: list[str] = []
-    seen = set()
-    # Сначала в порядке из словаря (те что нашли)
-    for g in SYNONYM_GROUPS.keys():
-        for url in all_results:
-            if g in all_groups.get(url, {}):
-                if g not in seen:
-                    unique_groups.append(g)
-                    seen.add(g)
-    # Затем неизвестные группы
-    for url in all_results:
-        for g in all_groups.get(url, {}):
-            if g not in seen:
-                unique_groups.append(g)
-                seen.add(g)
-
-    all_urls = competitor_urls + [target_url]
-    short = {u: urlparse(u).netloc or u for u in all_urls}
-
-    wb = openpyxl.Workbook()
-
-    # ─── Стили ────────────────────────────────────────────────────────────────
-    H_FILL   = PatternFill("solid", fgColor="1F3864")   # тёмно-синий заголовок
-    TGT_FILL = PatternFill("solid", fgColor="D9EAD3")   # зелёный — анализируемый есть
-    MISS_FILL= PatternFill("solid", fgColor="FCE4D6")   # красный — блок отсутствует
-    OBL_FILL = PatternFill("solid", fgColor="C6EFCE")   # обязательно
-    WISH_FILL= PatternFill("solid", fgColor="FFEB9C")   # желательно
-    OPT_FILL = PatternFill("solid", fgColor="F2F2F2")   # по желанию
-    ALT_FILL = PatternFill("solid", fgColor="EBF3FB")   # чередование строк (конкуренты)
-    WHITE    = PatternFill("solid", fgColor="FFFFFF")
-
-    H_FONT   = Font(bold=True, color="FFFFFF", size=10)
-    BOLD     = Font(bold=True, size=10)
-    NORM     = Font(size=10)
-    CENTER   = Alignment(horizontal="center", vertical="center", wrap_text=True)
-    LEFT     = Alignment(horizontal="left",   vertical="center", wrap_text=True)
-    RIGHT    = Alignment(horizontal="right",  vertical="center")
-
-    def border():
-        s = Side(style="thin", color="D0D0D0")
-        return Border(left=s, right=s, top=s, bottom=s)
-
-    def set_header_row(ws, headers: list, row=1):
-        for ci, h in enumerate(headers, 1):
-            c = ws.cell(row=row, column=ci, value=h)
-            c.fill = H_FILL; c.font = H_FONT
-            c.alignment = CENTER; c.border = border()
-
-    # ═══════════════════════════════════════════════════════════════════════════
-    #  ЛИСТ 1 — Сравнение блоков
-    # ═══════════════════════════════════════════════════════════════════════════
-    ws1 = wb.active
-    ws1.title = "Сравнение блоков"
-
-    comp_names = [short[u] for u in competitor_urls]
-    cols = ["Блок"] + comp_names + [f"★ {short[target_url]}"] + ["Частота", "Рекомендация"]
-    set_header_row(ws1, cols)
-
-    for ri, group in enumerate(unique_groups, 2):
-        freq = 0
-        row_vals = [group]
-
-        for cu in competitor_urls:
-            gdata = all_groups.get(cu, {}).get(group)
-            if gdata:
-                freq += 1
-                row_vals.append(f"✓  {gdata[0]['heading'][:45]}")
-            else:
-                row_vals.append("—")
-
-        tgt_data = all_groups.get(target_url, {}).get(group)
-        target_has = bool(tgt_data)
-        if target_has:
-            row_vals.append(f"✓  {tgt_data[0]['heading'][:45]}")
-        else:
-            row_vals.append("Отсутствует ✗")
-
-        row_vals.append(freq)
-
-        if freq >= 3:
-            rec, rec_fill = "🔴 Обязательно", OBL_FILL
-        elif freq == 2:
-            rec, rec_fill = "🟡 Желательно", WISH_FILL
-        else:
-            rec, rec_fill = "⚪ По желанию", OPT_FILL
-        row_vals.append(rec)
-
-        row_bg = ALT_FILL if ri % 2 == 0 else WHITE
-
-        for ci, val in enumerate(row_vals, 1):
-            c = ws1.cell(row=ri, column=ci, value=val)
-            c.border = border()
-            c.alignment = LEFT if ci <= len(cols) - 2 else CENTER
-            c.font = NORM
-
-            if ci == 1:  # название группы
-                c.font = BOLD
-                c.fill = row_bg
-            elif ci == len(cols) - 1:  # Частота
-                c.alignment = CENTER
-                c.fill = row_bg
-            elif ci == len(cols):  # Рекомендация
-                c.fill = rec_fill
-                c.font = BOLD
-                c.alignment = CENTER
-            elif ci == len(cols) - 2:  # Колонка анализируемого
-                c.fill = MISS_FILL if not target_has else TGT_FILL
-            else:
-                c.fill = row_bg
-
-    # Ширина
-    col_widths = [28] + [24] * len(competitor_urls) + [26, 10, 18]
-    for i, w in enumerate(col_widths, 1):
-        ws1.column_dimensions[get_column_letter(i)].width = w
-    ws1.row_dimensions[1].height = 32
-    ws1.freeze_panes = "B2"
-    ws1.sheet_view.showGridLines = True
-
-    # ═══════════════════════════════════════════════════════════════════════════
-    #  ЛИСТ 2 — Все заголовки
-    # ═══════════════════════════════════════════════════════════════════════════
-    ws2 = wb.create_sheet("Заголовки H1–H6")
-    h2_cols = ["Сайт", "Уровень", "Заголовок", "Группа", "Длина текста",
-               "CTA-кнопки", "Форма", "Список", "Изображения", "FAQ-схема"]
-    set_header_row(ws2, h2_cols)
-
-    ri2 = 2
-    for url in all_urls:
-        is_tgt = url == target_url
-        for b in all_results.get(url, []):
-            row = [
-                short[url],
-                f"H{b['level']}",
-                b["heading"],
-                b["group"],
-                b["text_len"],
-                b["buttons"],
-                "Да" if b["has_form"] else "Нет",
-                "Да" if b["has_list"] else "Нет",
-                b["images"],
-                "Да" if b["has_faq_schema"] else "Нет",
-            ]
-            row_bg = PatternFill("solid", fgColor="EBF3FB") if is_tgt else (ALT_FILL if ri2 % 2 == 0 else WHITE)
-            for ci, val in enumerate(row, 1):
-                c = ws2.cell(row=ri2, column=ci, value=val)
-                c.border = border()
-                c.font = BOLD if is_tgt else NORM
-                c.fill = row_bg
-                c.alignment = CENTER if ci in (2, 5, 6, 8, 9, 10) else LEFT
-            ri2 += 1
-
-    for i, w in enumerate([28, 9, 48, 26, 14, 12, 8, 8, 13, 12], 1):
-        ws2.column_dimensions[get_column_letter(i)].width = w
-    ws2.row_dimensions[1].height = 32
-    ws2.freeze_panes = "A2"
-
-    # ═══════════════════════════════════════════════════════════════════════════
-    #  ЛИСТ 3 — Сводная статистика
-    # ═══════════════════════════════════════════════════════════════════════════
-    ws3 = wb.create_sheet("Сводная статистика")
-    s_cols = ["Сайт", "Роль", "Блоков найдено", "CTA-кнопок", "Форм",
-              "Списков", "Изображений", "Объём текста (симв.)", "FAQ-схем"]
-    set_header_row(ws3, s_cols)
-
-    for ri3, url in enumerate(all_urls, 2):
-        blocks = all_results.get(url, [])
-        is_tgt = url == target_url
-        role = "★ Анализируемый" if is_tgt else "Конкурент"
-        row = [
-            short[url], role,
-            len(blocks),
-            sum(b["buttons"]   for b in blocks),
-            sum(1 for b in blocks if b["has_form"]),
-            sum(1 for b in blocks if b["has_list"]),
-            sum(b["images"]    for b in blocks),
-            sum(b["text_len"]  for b in blocks),
-            sum(1 for b in blocks if b["has_faq_schema"]),
-        ]
-        fill = PatternFill("solid", fgColor="D9EAD3") if is_tgt else (ALT_FILL if ri3 % 2 == 0 else WHITE)
-        for ci, val in enumerate(row, 1):
-            c = ws3.cell(row=ri3, column=ci, value=val)
-            c.border = border()
-            c.font = BOLD if is_tgt else NORM
-            c.fill = fill
-            c.alignment = CENTER if ci > 2 else LEFT
-
-    for i, w in enumerate([30, 18, 16, 14, 10, 10, 14, 22, 13], 1):
-        ws3.column_dimensions[get_column_letter(i)].width = w
-    ws3.row_dimensions[1].height = 32
-    ws3.freeze_panes = "A2"
-
-    buf = io.BytesIO()
-    wb.save(buf)
-    buf.seek(0)
-    return buf.read()
+def export_button(container, report: ReportExports, fmt: str, label: str, prepare_label: str, help: str | None = None):
+    """
+    Кнопка выгрузки: пока файла нет — «Подготовить» (собирает его в обработчике
+    нажатия), затем — скачивание готовых байтов из ReportExports
+    """
+    _, ext, mime = EXPORT_FORMATS[fmt]
+    if fmt in report.files:
+        container.download_button(label, report.files[fmt], file_name=f"кндр_анализ.{ext}", mime=mime,
+                                  key=f"export_{fmt}", help=help, use_container_width=True)
+    else:
+        container.button(prepare_label, on_click=report.get, args=(fmt,),
+                         key=f"prepare_{fmt}", help=help, use_container_width=True)
 
 
-# ═══════════════════════════════════════════════════════════════════════════════
-#  STREAMLIT UI
-# ═══════════════════════════════════════════════════════════════════════════════
 def main():
     st.set_page_config(
         page_title="КНДР-парсер",
@@ -550,13 +163,87 @@ def main():
         )
         mode_key = "main" if "Главная" in mode else "inner"
 
+        scope = st.radio(
+            "Что сравниваем",
+            ["🔗 Отдельные страницы", "🗂️ Разделы сайтов"],
+            help="Разделы: для каждого URL обходятся страницы его раздела — по sitemap.xml, "
+                 "а если его нет, по ссылкам внутри раздела. Сравнивается, на какой доле "
+                 "страниц раздела встречается каждый блок.",
+        )
+        crawl = "Разделы" in scope
+        if crawl:
+            crawl_pages = st.slider("Страниц на раздел", 5, 200, CRAWL_MAX_PAGES, step=5)
+            crawl_depth = st.slider(
+                "Глубина по ссылкам", 1, 5, CRAWL_MAX_DEPTH,
+                help="Сколько переходов от стартовой страницы, если страниц раздела нет в sitemap.xml",
+            )
+            use_sitemap = st.checkbox("Брать страницы из sitemap.xml", value=True)
+
+        engine = st.radio(
+            "Парсер HTML",
+            ["lxml", "bs4", "stream"],
+            horizontal=True,
+            help="lxml — быстрее в разы; bs4 (BeautifulSoup) — эталонный; stream — lxml по частям, "
+                 "без дерева всей страницы в памяти. Результат одинаковый. Страницы длиннее "
+                 f"{STREAM_MIN_CHARS // 1024 // 1024} млн символов всегда разбираются потоково.",
+        )
+        max_chars = st.slider(
+            "Макс. размер страницы (млн символов)", 1, 50, MAX_HTML_CHARS // 1024 // 1024,
+            help="HTML длиннее обрезается перед разбором — чтобы огромная страница не съела всю память.",
+        ) * 1024 * 1024
+
+        render_label = st.radio(
+            "JS-рендер (ScrapingBee)",
+            list(FETCH_STRATEGIES.values()),
+            horizontal=True,
+            help="«Только если нужен»: сначала обычный запрос к сайту, и лишь страницы-оболочки "
+                 "(нет заголовков, мало текста, пустой контейнер SPA) или недоступные напрямую "
+                 "рендерятся через ScrapingBee. Быстрее и экономит кредиты.",
+        )
+        strategy = next(k for k, v in FETCH_STRATEGIES.items() if v == render_label)
+
         timeout = st.slider("Таймаут на страницу (сек)", 15, 60, 30, step=5)
+        concurrency = st.slider(
+            "Параллельных загрузок", 1, 10, 5,
+            help="Сколько страниц ScrapingBee рендерит одновременно",
+        )
+        cpu_count = os.cpu_count() or 1
+        parse_workers = 1
+        if cpu_count > 1:
+            parse_workers = st.slider(
+                "Процессов для парсинга", 1, cpu_count, cpu_count,
+                help="Разбор HTML идёт параллельно в нескольких процессах. "
+                     f"Страницы общим объёмом меньше {PARSE_POOL_MIN_BYTES // 1024 // 1024} МБ "
+                     "разбираются в основном процессе.",
+            )
+        fuzzy = st.checkbox(
+            "🧲 Объединять похожие заголовки",
+            value=True,
+            help="Заголовки, которых нет в словаре, сравниваются по буквенным n-граммам: "
+                 "похожие на группу словаря попадают в неё, похожие друг на друга — в общую группу.",
+        )
+        templates = st.checkbox(
+            "≈ Отмечать копии шаблона",
+            help="Блоки конкурента, почти совпадающие с блоками другого конкурента (общий шаблон, "
+                 "копия сайта), отмечаются в отчёте «≈» и не увеличивают частоту группы.",
+        )
+        force_refresh = st.checkbox(
+            "🔄 Обновить без кэша",
+            help=f"Загруженные страницы хранятся в кэше {CACHE_TTL // 3600} ч. "
+                 "Включите, чтобы заново загрузить все страницы через ScrapingBee.",
+        )
+        keep_history = st.checkbox(
+            "💾 Сохранять историю запусков",
+            value=True,
+            help=f"Блоки каждой страницы записываются в {SNAPSHOTS_PATH.name} — чтобы видеть, "
+                 "что изменилось у конкурентов с прошлого запуска.",
+        )
 
         st.divider()
         st.markdown("**Как работает:**")
         st.markdown("""
-1. ScrapingBee загружает с JS-рендером
-2. BeautifulSoup ищет блоки с H1–H6
+1. Страница загружается напрямую; ScrapingBee с JS-рендером — если без него нет контента
+2. lxml / BeautifulSoup ищет блоки с H1–H6
 3. Заголовки сопоставляются со словарём (~70 групп RU+EN)
 4. Excel: сравнение · заголовки · статистика
 """)
@@ -577,7 +264,9 @@ def main():
 
     with col2:
         st.subheader("🏆 Конкуренты")
-        st.caption("От 4 до 10 URL, каждый с новой строки")
+        min_competitors = 1 if crawl else 4
+        st.caption(f"От {min_competitors} до 10 URL, каждый с новой строки"
+                   + (" — стартовые страницы разделов" if crawl else ""))
         competitors_raw = st.text_area(
             "URL конкурентов",
             placeholder=(
@@ -595,13 +284,18 @@ def main():
         u.strip() for u in competitors_raw.strip().splitlines()
         if u.strip() and u.strip().startswith("http")
     ]
+    # Один адрес в разных написаниях (http/https, www., «/» в конце) и анализируемая
+    # страница среди конкурентов загружаются и показываются в отчёте один раз
+    competitor_urls, repeated_urls = dedupe_urls(competitor_urls, exclude=[target_url])
+    if repeated_urls:
+        st.info("♻️ Повторы не учитываются: " + ", ".join(repeated_urls))
 
     # Валидация
     errors = []
     if target_url and not target_url.startswith("http"):
         errors.append("URL анализируемого сайта должен начинаться с http:// или https://")
-    if competitor_urls and len(competitor_urls) < 4:
-        errors.append(f"Нужно минимум 4 конкурента — сейчас введено: {len(competitor_urls)}")
+    if competitor_urls and len(competitor_urls) < min_competitors:
+        errors.append(f"Нужно минимум {min_competitors} конкурента — сейчас введено: {len(competitor_urls)}")
     if competitor_urls and len(competitor_urls) > 10:
         errors.append(f"Максимум 10 конкурентов — сейчас введено: {len(competitor_urls)}")
 
@@ -629,9 +323,91 @@ def main():
         with col_info:
             st.info("⬆️ Заполните URL анализируемого сайта и конкурентов")
 
+    # ── Обход разделов ────────────────────────────────────────────────────────
+    if run_btn and crawl:
+        import numpy as np
+        import pandas as pd   # numpy, pandas и openpyxl загружаются только к первому анализу
+
+        roots = list(dict.fromkeys(competitor_urls + [target_url]))
+        sections: dict[str, dict[str, list[dict]]] = {}
+        labels = site_labels(roots)
+
+        progress_bar = st.progress(0.0)
+        log_area     = st.container()
+
+        stats = RunStats()
+        cache = HtmlCache()
+        memo = default_block_memo()
+
+        for i, root in enumerate(roots):
+            found = [0]
+
+            def on_page(url: str, blocks: list[dict], err: str | None, i=i, root=root, found=found):
+                found[0] += 1
+                progress_bar.progress(
+                    min((i + found[0] / crawl_pages) / len(roots), 1.0),
+                    text=f"⏳ {labels[root]}: страниц {found[0]} — {urlparse(url).path or '/'}",
+                )
+
+            by_sitemap = stats.counters["crawl_sitemap"]
+            with stats.stage("crawl"):
+                pages, page_errors = crawl_site(
+                    root, api_key, mode_key, crawl_pages, crawl_depth, use_sitemap, engine, parse_workers,
+                    timeout, concurrency, cache, force_refresh, stats, strategy=strategy,
+                    profiles=default_render_profiles(), memo=memo, on_page=on_page, max_chars=max_chars,
+                )
+            sections[root] = {url: blocks for url, blocks in pages.items() if url not in page_errors}
+            source = "sitemap.xml" if stats.counters["crawl_sitemap"] > by_sitemap else "ссылкам"
+            msg = f"{labels[root]}: страниц по {source} — **{len(sections[root])}**"
+            if page_errors:
+                msg += f", не загрузились — {len(page_errors)}"
+            if sections[root]:
+                log_area.success(f"✅ {msg}")
+            else:
+                log_area.warning(f"⚠️ {msg}")
+
+        if fuzzy:
+            with stats.stage("fuzzy"):
+                refined = refine_groups({url: b for pages in sections.values() for url, b in pages.items()})
+            sections = {root: {url: refined[url] for url in pages} for root, pages in sections.items()}
+        all_results = {root: section_blocks(pages) for root, pages in sections.items()}
+        if keep_history:
+            history_params = {"strategy": strategy, "synonyms": SYNONYM_FINGERPRINT, "max_chars": max_chars,
+                              "fuzzy": fuzzy, "crawl": [crawl_pages, crawl_depth, use_sitemap]}
+            with stats.stage("history"):
+                run_id = SnapshotStore().save_run(target_url, competitor_urls, mode_key, all_results, stats,
+                                                  history_params, sections)
+            log_area.info(f"🕓 Запуск №{run_id} сохранён в историю")
+
+        st.divider()
+        st.subheader("📋 Доля страниц раздела с блоком")
+        counts = group_page_counts(sections)
+        share = (counts * 100 // np.maximum([len(sections[r]) for r in counts.columns], 1)).astype("int64")
+        share.columns = [("★ " if root == target_url else "") + labels[root] for root in counts.columns]
+        order = counts.sum(axis=1).sort_values(ascending=False, kind="stable").index
+        st.dataframe(share.loc[order].astype(str) + "%", use_container_width=True)
+
+        missing_freq = missing_section_groups(target_url, competitor_urls, sections)
+        if missing_freq:
+            st.subheader("🔴 Блоки, которых нет в вашем разделе")
+            st.dataframe(
+                pd.DataFrame(
+                    [(g, f, recommendation(f)) for g, f in missing_freq.most_common()],
+                    columns=["Группа блока", "Разделов у конкурентов", "Рекомендация"],
+                ),
+                use_container_width=True, hide_index=True,
+            )
+
+        # Файлы отчёта собираются по кнопке «Подготовить» под формой
+        st.session_state["report"] = ReportExports(target_url, competitor_urls, all_results, stats, sections, templates)
+        progress_bar.progress(1.0, text="✅ Готово!")
+
     # ── Анализ ────────────────────────────────────────────────────────────────
-    if run_btn:
-        all_urls = competitor_urls + [target_url]
+    if run_btn and not crawl:
+        import pandas as pd
+
+        # Повторы уже убраны (dedupe_urls) — каждая страница загружается и считается в прогрессе один раз
+        all_urls = list(dict.fromkeys(competitor_urls + [target_url]))
         all_results: dict[str, list[dict]] = {}
         errors_log: dict[str, str] = {}
 
@@ -639,86 +415,268 @@ def main():
         status_text  = st.empty()
         log_area     = st.container()
 
-        total = len(all_urls)
+        stats = RunStats()
+        cache = HtmlCache()
 
-        for idx, url in enumerate(all_urls):
-            role = "анализируемый" if url == target_url else f"конкурент {idx + 1}/{len(competitor_urls)}"
-            netloc = urlparse(url).netloc
-            progress_bar.progress(idx / total, text=f"⏳ Загружаю {role}: {netloc}")
-            status_text.info(f"Загружаю: **{url}**")
+        # Страницы, уже посчитанные в этой сессии с теми же настройками, не
+        # загружаются и не разбираются заново — только новые, изменённые и просроченные
+        run_params = {"mode": mode_key, "strategy": strategy, "synonyms": SYNONYM_FINGERPRINT, "max_chars": max_chars}
+        saved = st.session_state.setdefault("page_results", {})
+        reused = {} if force_refresh else reusable_pages(saved, all_urls, run_params)
+        for url, entry in reused.items():
+            all_results[url] = entry["blocks"]
+            stats.record_reused(url, entry["page"])
+        fetch_urls = [url for url in all_urls if url not in reused]
+        if reused:
+            log_area.info(f"♻️ Из прошлого запуска: **{len(reused)}**, заново: **{len(fetch_urls)}**")
+
+        total = max(len(fetch_urls), 1)
+        done = 0
 
-            html, err = fetch_via_scrapingbee(url, api_key, timeout)
+        progress_bar.progress(0.0, text=f"⏳ Загружаю {len(fetch_urls)} страниц (по {concurrency} параллельно)")
+        status_text.info(f"Загружаю {len(fetch_urls)} страниц...")
 
+        # ── Результаты по мере готовности ───────────────────────────────────
+        st.divider()
+        st.subheader("📋 Краткие результаты")
+        cards_area = st.empty()
+        compare_area = st.expander("🧩 Группы блоков по сайтам").empty()
+        missing_area = st.empty()
+        completed: list[str] = []   # в порядке готовности
+        labels = site_labels(all_urls)
+
+        def render_live():
+            # Похожие заголовки объединяются по всем готовым страницам сразу,
+            # поэтому группы пересчитываются при каждом обновлении
+            shown = {url: all_results[url] for url in completed}
+            if fuzzy:
+                shown = refine_groups(shown)
+
+            with cards_area.container():
+                cols = st.columns(min(len(all_urls), 6))
+                for i, url in enumerate(completed):
+                    blocks = shown[url]
+                    netloc = urlparse(url).netloc
+                    label  = f"★ {netloc}" if url == target_url else netloc
+                    with cols[i % len(cols)]:
+                        if url in errors_log:
+                            st.metric(label, "Ошибка", delta="⚠️", delta_color="off")
+                        else:
+                            groups_found = len(set(b["group"] for b in blocks))
+                            st.metric(label, f"{len(blocks)} блоков", f"{groups_found} групп")
+
+            with compare_area.container():
+                sites = [url for url in completed if url not in errors_log]
+                if sites:
+                    frame = blocks_frame({url: shown[url] for url in sites})
+                    presence = presence_matrix(frame, sites).notna()
+                    presence.columns = [("★ " if url == target_url else "") + labels[url] for url in sites]
+                    order = presence.sum(axis=1).sort_values(ascending=False, kind="stable").index
+                    st.caption(f"Готово сайтов: {len(completed)} из {len(all_urls)}")
+                    st.dataframe(presence.loc[order], use_container_width=True)
+
+            with missing_area.container():
+                if target_url not in shown:
+                    st.caption("⏳ Список недостающих блоков появится, когда загрузится анализируемый сайт")
+                    return
+                missing_freq = missing_groups(target_url, competitor_urls, shown)
+                if missing_freq:
+                    st.subheader("🔴 Блоки, которых нет на вашем сайте")
+                    miss_df = pd.DataFrame(
+                        [(g, f, recommendation(f)) for g, f in missing_freq.most_common()],
+                        columns=["Группа блока", "Частота у конкурентов", "Рекомендация"]
+                    )
+                    st.dataframe(miss_df, use_container_width=True, hide_index=True)
+
+        def page_ready(url: str, blocks: list[dict], err: str | None = None):
+            all_results[url] = blocks
+            completed.append(url)
             if err:
                 errors_log[url] = err
-                all_results[url] = []
-                log_area.warning(f"⚠️ {netloc}: {err}")
+                log_area.warning(f"⚠️ {urlparse(url).netloc}: {err}")
+            elif stats.page(url)["truncated"]:
+                log_area.warning(f"✂️ {urlparse(url).netloc} — страница обрезана до {max_chars // 1024 // 1024} "
+                                 f"млн символов, найдено блоков: **{len(blocks)}**")
             else:
-                blocks = extract_blocks(html, mode_key)
-                all_results[url] = blocks
-                log_area.success(f"✅ {netloc} — найдено блоков: **{len(blocks)}**")
-
-        progress_bar.progress(1.0, text="📊 Формирую Excel...")
-        status_text.info("Создаю Excel-отчёт...")
-
-        try:
-            excel_bytes = make_excel(target_url, competitor_urls, all_results)
-            st.session_state["excel_bytes"] = excel_bytes
-            st.session_state["excel_ready"] = True
-        except Exception as ex:
-            st.error(f"Ошибка при создании Excel: {ex}")
-            st.session_state["excel_ready"] = False
-
+                log_area.success(f"✅ {urlparse(url).netloc} — найдено блоков: **{len(blocks)}**")
+            saved[url] = {
+                "params": run_params,
+                "fetched_at": time.time(),
+                "blocks": blocks,
+                "error": err,
+                "page": dict(stats.page(url)),
+            }
+            render_live()
+
+        completed.extend(reused)
+        if reused:
+            render_live()
+
+        # Разбор идёт прямо по ходу загрузки: мелкие страницы — сразу,
+        # крупные — в пуле процессов, их результаты забираются в паузах
+        parser = PageParser(mode_key, engine, parse_workers, stats, default_block_memo(), max_chars=max_chars)
+
+        def on_fetched(url: str, html: str | None, err: str | None):
+            nonlocal done
+            done += 1
+            netloc = urlparse(url).netloc
+            progress_bar.progress(done / total, text=f"⏳ Загружено {done}/{total}: {netloc}")
+            if err:
+                page_ready(url, [], err)
+                return
+            for ready_url, blocks in parser.submit(url, html):
+                page_ready(ready_url, blocks)
+
+        def on_idle():
+            for ready_url, blocks in parser.poll():
+                page_ready(ready_url, blocks)
+
+        with parser:
+            with stats.stage("fetch"):
+                fetch_all(fetch_urls, api_key, timeout, concurrency, on_done=on_fetched, on_idle=on_idle,
+                          cache=cache, force_refresh=force_refresh, stats=stats, strategy=strategy,
+                          profiles=default_render_profiles(), keep_html=False)
+            if parser.pending:
+                status_text.info(f"Дорабатываю разбор {len(parser.pending)} страниц...")
+            with stats.stage("parse"):
+                for ready_url, blocks in parser.drain():
+                    page_ready(ready_url, blocks)
+
+        if not force_refresh and fetch_urls:
+            log_area.info(f"💾 Кэш: из кэша — **{cache.hits}**, загружено — **{cache.misses}**")
+        if stats.counters["parse_memo"]:
+            log_area.info(f"🧠 Уже разобраны ранее: **{stats.counters['parse_memo']}** из {len(fetch_urls)} страниц")
+        if stats.counters["fetch_shared"]:
+            log_area.info(f"🤝 Из общей загрузки: **{stats.counters['fetch_shared']}** — сэкономлено запросов: "
+                          f"**{stats.counters['saved_requests']}**, кредитов ScrapingBee: **{stats.counters['saved_credits']}**")
+
+        # Порядок сайтов в отчёте — как во вводе, а не по готовности
+        all_results = {url: all_results[url] for url in all_urls}
+        if fuzzy:
+            with stats.stage("fuzzy"):
+                all_results = refine_groups(all_results)
+        if keep_history:
+            with stats.stage("history"):
+                run_id = SnapshotStore().save_run(target_url, competitor_urls, mode_key, all_results, stats,
+                                                  {**run_params, "fuzzy": fuzzy})
+            log_area.info(f"🕓 Запуск №{run_id} сохранён в историю")
+
+        st.session_state["report"] = ReportExports(target_url, competitor_urls, all_results, stats, templates=templates)
         progress_bar.progress(1.0, text="✅ Готово!")
         status_text.success("🎉 Анализ завершён!")
 
-        # ── Превью ────────────────────────────────────────────────────────────
-        st.divider()
-        st.subheader("📋 Краткие результаты")
-
-        cols = st.columns(min(len(all_urls), 6))
-        for i, url in enumerate(all_urls):
-            blocks = all_results.get(url, [])
-            netloc = urlparse(url).netloc
-            label  = f"★ {netloc}" if url == target_url else netloc
-            with cols[i % len(cols)]:
-                if url in errors_log:
-                    st.metric(label, "Ошибка", delta="⚠️", delta_color="off")
-                else:
-                    groups_found = len(set(b["group"] for b in blocks))
-                    st.metric(label, f"{len(blocks)} блоков", f"{groups_found} групп")
-
-        # Список отсутствующих блоков
-        target_blocks = all_results.get(target_url, [])
-        target_groups = set(b["group"] for b in target_blocks)
-        missing = []
-        for cu in competitor_urls:
-            for b in all_results.get(cu, []):
-                if b["group"] not in target_groups:
-                    missing.append(b["group"])
-
-        from collections import Counter
-        missing_freq = Counter(missing)
-        if missing_freq:
-            st.divider()
-            st.subheader("🔴 Блоки, которых нет на вашем сайте")
-            miss_df = pd.DataFrame(
-                [(g, f, "🔴 Обязательно" if f >= 3 else "🟡 Желательно" if f == 2 else "⚪ По желанию")
-                 for g, f in missing_freq.most_common()],
-                columns=["Группа блока", "Частота у конкурентов", "Рекомендация"]
+        # ── Статистика запуска ──────────────────────────────────────────────
+        with st.expander("📈 Статистика запуска"):
+            totals = stats.totals()
+            m_cols = st.columns(len(stats.stages) + 4)
+            for col, (stage, secs) in zip(m_cols, stats.stages.items()):
+                col.metric(STAGE_LABELS.get(stage, stage), f"{secs:.2f} с")
+            m_cols[-4].metric("Пик памяти разбора", f"{totals['parse_mem_max'] / 1024 / 1024:.1f} МБ",
+                              help="Наибольший прирост RSS процесса за время разбора одной страницы "
+                                   f"от {STREAM_MIN_CHARS // 1024 // 1024} млн символов; меньшие не замеряются")
+            m_cols[-3].metric("Загружено", f"{totals['bytes'] / 1024 / 1024:.1f} МБ")
+            m_cols[-2].metric("Без рендера", f"{totals.get('fetch_direct', 0)} из {totals['pages']}")
+            m_cols[-1].metric("Из кэша", f"{totals.get('fetch_cache', 0)} из {totals['pages']}")
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Сайт": urlparse(url).netloc,
+                        "Источник": METRIC_SOURCES.get(p["source"], p["source"]),
+                        "Почему рендер": p["escalated"] or "",
+                        "Профиль рендера": p["profile"] or "",
+                        "Загрузка, с": p["fetch_s"],
+                        "Попыток": p["attempts"],
+                        "Кредитов": p["credits"],
+                        "КБ": (p["bytes"] or 0) / 1024,
+                        "Разбор, с": p["parse_s"],
+                        "Память разбора крупной стр., МБ": p["parse_mem"] / 1024 / 1024 if p["parse_mem"] is not None else None,
+                        "Обрезана": "да" if p["truncated"] else "",
+                        "Группировка, с": p["group_s"],
+                        "Блоков": p["blocks"],
+                        "Ошибка": p["error"] or "",
+                    }
+                    for url, p in stats.pages.items()
+                ]),
+                use_container_width=True, hide_index=True,
             )
-            st.dataframe(miss_df, use_container_width=True, hide_index=True)
-
-    # ── Кнопка скачивания ────────────────────────────────────────────────────
-    if st.session_state.get("excel_ready"):
+            dl_json, dl_prom = st.columns(2)
+            dl_json.download_button("⬇️ Метрики (JSON)", stats.to_json(),
+                                    file_name="кндр_метрики.json", mime="application/json")
+            dl_prom.download_button("⬇️ Метрики (Prometheus)", stats.to_prometheus(),
+                                    file_name="kndr_metrics.prom", mime="text/plain")
+
+    # ── Кнопки скачивания ────────────────────────────────────────────────────
+    # Файл собирается по кнопке «Подготовить» (в её обработчике, до перезапуска
+    # скрипта) и запоминается в ReportExports; после этого кнопка становится
+    # обычной кнопкой скачивания готовых байтов
+    report = st.session_state.get("report")
+    if report is not None:
         with col_dl:
-            st.download_button(
-                label="📥 Скачать Excel",
-                data=st.session_state["excel_bytes"],
-                file_name="кндр_анализ.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True,
-            )
+            export_button(st, report, "xlsx", "📥 Скачать Excel", "📥 Подготовить Excel")
+        with col_info:
+            formats = [fmt for fmt in EXPORT_FORMATS if fmt != "xlsx"]
+            for col, fmt in zip(st.columns(len(formats)), formats):
+                label = EXPORT_FORMATS[fmt][0]
+                export_button(
+                    col, report, fmt, f"⬇️ {label}", f"⚙️ {label}",
+                    help="Таблицы blocks, comparison и summary" + ("" if fmt == "json" else " — по файлу в zip"),
+                )
+
+    # ── История запусков ─────────────────────────────────────────────────────
+    if SNAPSHOTS_PATH.exists():
+        with st.expander("🕓 История и изменения"):
+            if run_btn:
+                # После нового запуска сравниваем его, а не выбранный раньше
+                for key in ("history_new", "history_old"):
+                    st.session_state.pop(key, None)
+            # База и pandas нужны, только когда сравнение открыто
+            show = st.toggle("Сравнить запуски", key="history_show",
+                             help="Что изменилось на страницах между двумя сохранёнными запусками")
+            store = SnapshotStore() if show else None
+            runs = {r["id"]: r for r in store.runs()} if show else {}
+            if show and len(runs) < 2:
+                st.caption("Для сравнения нужно хотя бы два сохранённых запуска")
+            elif show:
+                import pandas as pd
+
+                def run_label(run_id: int) -> str:
+                    r = runs[run_id]
+                    started = time.strftime("%d.%m.%Y %H:%M", time.localtime(r["created_at"]))
+                    return f"№{run_id} · {started} · {urlparse(r['target']).netloc} · страниц: {r['n_pages']}"
+
+                col_old, col_new = st.columns(2)
+                new_run = col_new.selectbox("Новый запуск", list(runs), format_func=run_label, key="history_new")
+                # По умолчанию — предыдущий запуск по тому же сайту
+                older = [i for i in runs if i < new_run]
+                same = [i for i in older if runs[i]["target"] == runs[new_run]["target"]]
+                old_choices = older or [i for i in runs if i != new_run]
+                old_run = col_old.selectbox(
+                    "Прошлый запуск", old_choices, format_func=run_label, key="history_old",
+                    index=old_choices.index(same[0]) if same else 0,
+                )
+                pages = list(dict.fromkeys([*store.pages(new_run), *store.pages(old_run)]))
+                page = st.selectbox("Страница", [None, *pages], key="history_page",
+                                    format_func=lambda url: "Все страницы" if url is None else url)
+                diff = snapshot_diff(str(store.path), old_run, new_run, page)
+                if diff.empty:
+                    st.success("✅ Изменений нет")
+                else:
+                    st.caption(" · ".join(
+                        f"{CHANGE_LABELS[change]}: {n}" for change, n in diff["change"].value_counts().items()
+                    ))
+                    st.dataframe(
+                        pd.DataFrame({
+                            "Сайт": [urlparse(url).netloc for url in diff["site"]],
+                            "Страница": diff["url"],
+                            "Изменение": diff["change"].map(CHANGE_LABELS),
+                            "Группа блока": diff["group"],
+                            "Было блоков": diff["old_blocks"],
+                            "Стало блоков": diff["new_blocks"],
+                            "Заголовок": diff["new_heading"].fillna(diff["old_heading"]),
+                            "Подробности": diff["details"],
+                        }),
+                        use_container_width=True, hide_index=True,
+                    )
 
 
 if __name__ == "__main__":
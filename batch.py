@@ -0,0 +1,437 @@
+"""
+КНДР-парсер — пакетный запуск без Streamlit
+
+    python batch.py jobs.csv -o reports/ --api-key KEY
+
+Задания: CSV (колонки id, target, competitors, mode) или JSONL
+({"id": ..., "target": ..., "competitors": [...], "mode": "main"}).
+Конкуренты в CSV разделяются пробелами, «;» или «|»; id и mode необязательны.
+
+Результат: <out>/<id>.xlsx на каждое задание и <out>/summary.jsonl; --formats
+xlsx,json,csv,parquet — ещё и таблицы блоков, сравнения и сводки (CSV и Parquet — zip).
+Страницы, общие для нескольких заданий, загружаются и разбираются один раз — в том
+числе в разных написаниях (http/https, www., «/» в конце); повторы внутри задания убираются.
+Повторный запуск пропускает задания, уже записанные в summary.jsonl со статусом ok;
+partial (не загрузился кто-то из конкурентов) и error запускаются снова.
+Строки файла заданий с ошибкой пропускаются с предупреждением (номер строки).
+
+С --crawl каждый URL задания — начало раздела: его страницы берутся из sitemap.xml
+или по ссылкам внутри раздела (--max-pages, --max-depth), сравниваются разделы целиком.
+
+Каждое задание сохраняется в историю запусков (--history, по умолчанию
+snapshots.sqlite3 рядом с кэшем); изменения между запусками — python history.py diff.
+Задание, повторённое при продолжении пакета, заменяет свой запуск в истории.
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import time
+import hashlib
+import argparse
+import concurrent.futures
+from pathlib import Path
+from urllib.parse import urlparse
+
+from engine import (
+    CACHE_DIR,
+    CRAWL_MAX_DEPTH,
+    CRAWL_MAX_PAGES,
+    EXPORT_FORMATS,
+    MAX_HTML_CHARS,
+    PARSE_ENGINES,
+    RENDER_PROFILES_PATH,
+    SNAPSHOTS_PATH,
+    SYNONYM_FINGERPRINT,
+    HtmlCache,
+    RenderProfiles,
+    ReportExports,
+    RunStats,
+    SnapshotStore,
+    canonical_url,
+    crawl_site,
+    dedupe_urls,
+    fetch_all,
+    parse_pages,
+    missing_groups,
+    missing_section_groups,
+    recommendation,
+    refine_groups,
+    section_blocks,
+)
+
+
+def job_id(target: str, competitors: list[str], mode: str) -> str:
+    """Стабильный id задания — чтобы продолжать с места остановки"""
+    digest = hashlib.sha1(json.dumps([target, competitors, mode]).encode()).hexdigest()[:10]
+    return f"{urlparse(target).netloc or 'job'}-{digest}"
+
+
+def make_job(raw: dict, line_no: int) -> dict:
+    """Строка входного файла → задание; ValueError при ошибке"""
+    if not isinstance(raw, dict):
+        raise ValueError(f"строка {line_no}: ожидался объект JSON")
+    target = (raw.get("target") or "").strip()
+    competitors = raw.get("competitors") or []
+    if isinstance(competitors, str):
+        competitors = re.split(r"[\s;|]+", competitors)
+    competitors = [u.strip() for u in competitors if u and u.strip().startswith("http")]
+    competitors = dedupe_urls(competitors, exclude=[target])[0]
+    mode = (raw.get("mode") or "main").strip()
+
+    if not target.startswith("http"):
+        raise ValueError(f"строка {line_no}: URL анализируемого сайта должен начинаться с http:// или https://")
+    if not competitors:
+        raise ValueError(f"строка {line_no}: нет ни одного URL конкурента")
+    if mode not in ("main", "inner"):
+        raise ValueError(f"строка {line_no}: режим должен быть main или inner, а не {mode!r}")
+
+    jid = str(raw.get("id") or "").strip() or job_id(target, competitors, mode)
+    return {
+        "id": re.sub(r"[^\w.-]+", "_", jid),
+        "target": target,
+        "competitors": competitors,
+        "mode": mode,
+    }
+
+
+def read_jobs(path: Path) -> tuple[list[dict], list[str]]:
+    """
+    Читает задания из CSV или JSONL (по расширению) → (задания, ошибки строк).
+    Строка с ошибкой пропускается, остальные задания читаются дальше.
+    """
+    jobs, problems = [], []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.suffix.lower() in (".jsonl", ".ndjson", ".json"):
+            rows = ((i, line) for i, line in enumerate(f, 1) if line.strip())
+        else:
+            reader = csv.DictReader(f)
+            rows = ((reader.line_num, raw) for raw in reader)   # line_num — последняя строка записи
+        for i, raw in rows:
+            try:
+                if isinstance(raw, str):
+                    try:
+                        raw = json.loads(raw)
+                    except json.JSONDecodeError as e:
+                        raise ValueError(f"строка {i}: не JSON ({e.msg})") from None
+                jobs.append(make_job(raw, i))
+            except ValueError as e:
+                problems.append(str(e))
+    return jobs, problems
+
+
+def read_done(summary_path: Path) -> set[str]:
+    """id заданий, уже успешно записанных в summary.jsonl"""
+    done = set()
+    if not summary_path.exists():
+        return done
+    with open(summary_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # оборванная запись прерванного запуска
+            if rec.get("status") == "ok":
+                done.add(rec["id"])
+    return done
+
+
+def batch_id(out_dir: Path) -> str:
+    """
+    id пакетного запуска для истории: прежний, пока в out_dir есть summary.jsonl
+    (продолжение прерванного запуска), иначе новый
+    """
+    path = out_dir / ".batch_id"
+    if (out_dir / "summary.jsonl").exists():
+        try:
+            bid = path.read_text(encoding="utf-8").strip()
+        except OSError:
+            bid = ""
+        if bid:
+            return bid
+    bid = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+    path.write_text(bid + "\n", encoding="utf-8")
+    return bid
+
+
+def write_report(
+    job: dict, results: dict[str, list[dict]], out_dir: Path, formats: list[str],
+    sections: dict[str, dict[str, list[dict]]] | None = None, templates: bool = False,
+) -> dict[str, str]:
+    """Файлы отчёта по заданию → {формат: путь}; каждый пишется во временный файл и переименовывается"""
+    report = ReportExports(job["target"], job["competitors"], results, sections=sections, templates=templates)
+    paths = {}
+    for fmt in formats:
+        path = out_dir / f"{job['id']}.{EXPORT_FORMATS[fmt][1]}"
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_bytes(report.get(fmt))
+        os.replace(tmp, path)
+        paths[fmt] = str(path)
+    return paths
+
+
+STATUS_ICONS = {"ok": "📊", "partial": "⚠️", "error": "❌"}
+
+
+def run(args) -> int:
+    out_dir = Path(args.out)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    summary_path = out_dir / "summary.jsonl"
+
+    try:
+        jobs, problems = read_jobs(Path(args.jobs))
+    except (OSError, csv.Error) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    for problem in problems:
+        print(f"⚠️ Пропущено: {problem}", file=sys.stderr)
+
+    done = read_done(summary_path)
+    pending = [j for j in jobs if j["id"] not in done]
+    print(f"Заданий: {len(jobs)}, уже готово: {len(jobs) - len(pending)}, к запуску: {len(pending)}"
+          + (f", пропущено строк: {len(problems)}" if problems else ""))
+    if not pending:
+        return 1 if problems else 0
+
+    cache = None if args.no_cache else HtmlCache(Path(args.cache_dir))
+    profiles = None if args.no_profiles else RenderProfiles(Path(args.profiles))
+    history = None if args.no_history else SnapshotStore(Path(args.history))
+    # Повтор задания при продолжении пакета заменяет его запуск в истории, а не добавляет ещё один
+    batch = batch_id(out_dir) if history is not None else None
+    history_params = {
+        "strategy": args.render, "synonyms": SYNONYM_FINGERPRINT, "max_chars": args.max_html_mb * 1024 * 1024,
+        "fuzzy": not args.no_fuzzy,
+    }
+    if args.crawl:
+        history_params["crawl"] = [args.max_pages, args.max_depth, not args.no_sitemap]
+    stats = RunStats()
+    # Блоки страниц, общих для нескольких заданий: (canonical_url, mode) → blocks
+    parsed: dict[tuple[str, str], list[dict]] = {}
+    # С --crawl — страницы разделов: (canonical_url начала раздела, mode) → {url: blocks}
+    crawled: dict[tuple[str, str], dict[str, list[dict]]] = {}
+    failed = partial = 0
+
+    with open(summary_path, "a", encoding="utf-8") as summary, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=max(1, args.workers)) as report_pool:
+
+        for start in range(0, len(pending), args.chunk):
+            chunk = pending[start:start + args.chunk]
+            # Ошибки загрузки — только этой пачки: неудачные страницы не попадают
+            # в parsed/crawled и в следующей пачке загружаются снова
+            fetch_errors: dict[str, str] = {}   # canonical_url → ошибка
+
+            if args.crawl:
+                # ── Обход разделов: каждый раздел пачки — один раз ──────────
+                roots: dict[tuple[str, str], str] = {}
+                for job in chunk:
+                    for url in job["competitors"] + [job["target"]]:
+                        if (canonical_url(url), job["mode"]) not in crawled:
+                            roots.setdefault((canonical_url(url), job["mode"]), url)
+                print(f"[{start + 1}–{start + len(chunk)}/{len(pending)}] обход {len(roots)} разделов")
+                for (key, mode), url in sorted(roots.items()):
+                    with stats.stage("crawl"):
+                        pages, page_errors = crawl_site(
+                            url, args.api_key, mode, args.max_pages, args.max_depth, not args.no_sitemap,
+                            args.engine, args.workers, args.timeout, args.concurrency, cache,
+                            args.force_refresh, stats, strategy=args.render, profiles=profiles,
+                            max_chars=args.max_html_mb * 1024 * 1024,
+                        )
+                    section = {u: b for u, b in pages.items() if u not in page_errors}
+                    if section:
+                        crawled[(key, mode)] = section
+                    else:
+                        fetch_errors[key] = next(iter(page_errors.values()), "❌ Нет страниц раздела")
+                    print(f"  {'✅' if section else '⚠️'} {url} — страниц: {len(section)}"
+                          + (f", не загрузились: {len(page_errors)}" if page_errors else ""))
+            else:
+                # ── Загрузка: каждая страница пачки — один раз ──────────────
+                # Все написания адреса уходят в fetch_all: он загружает страницу
+                # один раз и считает сэкономленные запросы; разбирается первое
+                need: dict[tuple[str, str], str] = {}
+                spellings = set()
+                for job in chunk:
+                    for url in job["competitors"] + [job["target"]]:
+                        key = canonical_url(url)
+                        if (key, job["mode"]) not in parsed and key not in fetch_errors:
+                            need.setdefault((key, job["mode"]), url)
+                            spellings.add(url)
+                urls = sorted(spellings)
+
+                def on_fetched(url, html, err):
+                    print(f"  {'✅' if not err else '⚠️'} {url}" + (f" — {err}" if err else ""))
+
+                print(f"[{start + 1}–{start + len(chunk)}/{len(pending)}] загрузка {len(urls)} страниц")
+                with stats.stage("fetch"):
+                    fetched = fetch_all(
+                        urls, args.api_key, args.timeout, args.concurrency,
+                        on_done=on_fetched, cache=cache, force_refresh=args.force_refresh, stats=stats,
+                        strategy=args.render, profiles=profiles,
+                    )
+
+                # ── Разбор: по режимам, в пуле процессов ─────────────────────
+                for mode in ("main", "inner"):
+                    pages = {}
+                    for (key, m), url in need.items():
+                        if m != mode:
+                            continue
+                        html, err = fetched[url]
+                        if err:
+                            fetch_errors[key] = err
+                        else:
+                            pages[url] = html
+                    with stats.stage("parse"):
+                        for url, blocks in parse_pages(
+                            pages, mode, args.engine, args.workers, stats=stats,
+                            max_chars=args.max_html_mb * 1024 * 1024,
+                        ):
+                            parsed[(canonical_url(url), mode)] = blocks
+                del fetched
+
+            # ── Отчёты ───────────────────────────────────────────────────────
+            t_export = time.perf_counter()
+            futures = {}
+            for job in chunk:
+                all_urls = job["competitors"] + [job["target"]]
+                sections = None
+                if args.crawl:
+                    sections = {url: crawled.get((canonical_url(url), job["mode"]), {}) for url in all_urls}
+                    if not args.no_fuzzy:
+                        with stats.stage("fuzzy"):
+                            refined = refine_groups({u: b for pages in sections.values() for u, b in pages.items()})
+                        sections = {url: {u: refined[u] for u in pages} for url, pages in sections.items()}
+                    results = {url: section_blocks(pages) for url, pages in sections.items()}
+                else:
+                    results = {url: parsed.get((canonical_url(url), job["mode"]), []) for url in all_urls}
+                    if not args.no_fuzzy:
+                        with stats.stage("fuzzy"):
+                            results = refine_groups(results)
+                futures[report_pool.submit(write_report, job, results, out_dir, args.formats, sections, args.templates)] = (
+                    job, results, sections,
+                )
+
+            for fut in concurrent.futures.as_completed(futures):
+                job, results, sections = futures[fut]
+                errors = {url: fetch_errors[canonical_url(url)] for url in results if canonical_url(url) in fetch_errors}
+                if sections is not None:
+                    missing = missing_section_groups(job["target"], job["competitors"], sections)
+                else:
+                    missing = missing_groups(job["target"], job["competitors"], results)
+                rec = {
+                    "id": job["id"],
+                    "target": job["target"],
+                    "competitors": job["competitors"],
+                    "mode": job["mode"],
+                    "blocks": {url: len(blocks) for url, blocks in results.items()},
+                    "errors": errors,
+                    "missing_groups": [
+                        {"group": g, "freq": f, "recommendation": recommendation(f)}
+                        for g, f in missing.most_common()
+                    ],
+                }
+                if sections is not None:
+                    rec["pages"] = {url: len(pages) for url, pages in sections.items()}
+                try:
+                    rec["files"] = fut.result()
+                    if "xlsx" in rec["files"]:
+                        rec["xlsx"] = rec["files"]["xlsx"]
+                    # Без анализируемой страницы сравнение бессмысленно, без части конкурентов —
+                    # неполное; оба повторятся при перезапуске
+                    rec["status"] = "error" if job["target"] in errors else "partial" if errors else "ok"
+                except Exception as e:
+                    rec["status"] = "error"
+                    rec["error"] = f"Ошибка при создании отчёта: {e}"
+                failed += rec["status"] == "error"
+                partial += rec["status"] == "partial"
+                if history is not None:
+                    rec["run_id"] = history.save_run(
+                        job["target"], job["competitors"], job["mode"], results, stats, history_params, sections,
+                        run_key=f"{batch}/{job['id']}",
+                    )
+                summary.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                summary.flush()
+                print(f"  {STATUS_ICONS[rec['status']]} {job['id']}")
+            stats.stages["export"] = stats.stages.get("export", 0.0) + time.perf_counter() - t_export
+
+    if args.metrics_json:
+        Path(args.metrics_json).write_text(stats.to_json(), encoding="utf-8")
+    if args.metrics_prom:
+        Path(args.metrics_prom).write_text(stats.to_prometheus(), encoding="utf-8")
+    if cache is not None:
+        print(f"💾 Кэш: из кэша — {cache.hits}, загружено — {cache.misses}")
+    if stats.counters["fetch_shared"]:
+        print(f"🤝 Из общей загрузки: {stats.counters['fetch_shared']}, сэкономлено запросов — "
+              f"{stats.counters['saved_requests']}, кредитов ScrapingBee — {stats.counters['saved_credits']}")
+    print(f"Готово: {len(pending) - failed - partial}, частично: {partial}, с ошибками: {failed}")
+    return 1 if failed or partial or problems else 0
+
+
+def export_formats(value: str) -> list[str]:
+    """--formats: форматы через запятую"""
+    formats = list(dict.fromkeys(f.strip().lower() for f in value.split(",") if f.strip()))
+    unknown = [f for f in formats if f not in EXPORT_FORMATS]
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(
+            f"неизвестный формат: {', '.join(unknown) or value!r}; допустимы {', '.join(EXPORT_FORMATS)}"
+        )
+    return formats
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(
+        description="КНДР-парсер: пакетный конкурентный анализ без Streamlit",
+    )
+    p.add_argument("jobs", help="CSV или JSONL с заданиями")
+    p.add_argument("-o", "--out", default="reports", help="папка для отчётов и summary.jsonl")
+    p.add_argument("--formats", type=export_formats, default=["xlsx"],
+                   help=f"форматы отчёта через запятую: {', '.join(EXPORT_FORMATS)} (по умолчанию xlsx)")
+    p.add_argument("--api-key", default=os.environ.get("SCRAPINGBEE_API_KEY"),
+                   help="ключ ScrapingBee (по умолчанию $SCRAPINGBEE_API_KEY)")
+    p.add_argument("--engine", choices=list(PARSE_ENGINES), default="lxml",
+                   help="парсер HTML; stream — lxml по частям, без дерева всей страницы в памяти")
+    p.add_argument("--max-html-mb", type=int, default=MAX_HTML_CHARS // 1024 // 1024,
+                   help="страницы длиннее (млн символов) обрезаются перед разбором")
+    p.add_argument("--render", choices=["auto", "render"], default="auto",
+                   help="auto — JS-рендер через ScrapingBee только для страниц-оболочек; render — всегда")
+    p.add_argument("--timeout", type=int, default=30, help="таймаут на страницу, сек")
+    p.add_argument("--concurrency", type=int, default=5, help="параллельных загрузок")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                   help="процессов для разбора и отчётов")
+    p.add_argument("--chunk", type=int, default=20,
+                   help="заданий в пачке (страницы пачки держатся в памяти)")
+    p.add_argument("--cache-dir", default=str(CACHE_DIR), help="папка кэша страниц")
+    p.add_argument("--no-cache", action="store_true", help="не использовать кэш страниц")
+    p.add_argument("--force-refresh", action="store_true", help="загрузить заново, обновив кэш")
+    p.add_argument("--profiles", default=str(RENDER_PROFILES_PATH),
+                   help="файл профилей рендера по доменам")
+    p.add_argument("--no-profiles", action="store_true",
+                   help="всегда рендерить с настройками по умолчанию, не подбирая профиль домена")
+    p.add_argument("--crawl", action="store_true",
+                   help="URL заданий — начала разделов: обходить страницы раздела и сравнивать разделы")
+    p.add_argument("--max-pages", type=int, default=CRAWL_MAX_PAGES, help="страниц на раздел при --crawl")
+    p.add_argument("--max-depth", type=int, default=CRAWL_MAX_DEPTH,
+                   help="переходов по ссылкам от начала раздела, если его страниц нет в sitemap.xml")
+    p.add_argument("--no-sitemap", action="store_true", help="при --crawl не читать sitemap.xml, только ссылки")
+    p.add_argument("--no-fuzzy", action="store_true",
+                   help="не объединять похожие заголовки вне словаря, только словарь")
+    p.add_argument("--templates", action="store_true",
+                   help="отмечать почти-дубли блоков у конкурентов (общий шаблон) и не считать их в частоте")
+    p.add_argument("--history", default=str(SNAPSHOTS_PATH), help="база истории запусков (SQLite)")
+    p.add_argument("--no-history", action="store_true", help="не сохранять задания в историю запусков")
+    p.add_argument("--metrics-json", help="записать метрики запуска в JSON-файл")
+    p.add_argument("--metrics-prom", help="записать метрики запуска в текстовом формате Prometheus")
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if not args.api_key:
+        print("❌ Нужен ключ ScrapingBee: --api-key или $SCRAPINGBEE_API_KEY", file=sys.stderr)
+        return 2
+    args.chunk = max(1, args.chunk)
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
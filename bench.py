@@ -0,0 +1,412 @@
+"""
+КНДР-парсер — бенчмарк горячих путей: парсинг, группировка, почти-дубли, Excel и выгрузки, обход раздела,
+запуск интерфейса
+
+    python bench.py                   # прогон и сравнение с benchmarks/baseline.json
+    python bench.py --save-baseline   # записать текущие результаты как базовые
+    python bench.py --quick           # маленький корпус, для быстрой проверки
+
+Корпус: синтетические страницы (глубина вложенности, число заголовков, размер,
+RU/EN) + сохранённые страницы из benchmarks/fixtures/*.html. Работает офлайн:
+обход раздела — по локальному статическому сайту (benchmarks/static_site.py).
+Запуск интерфейса — в отдельном процессе: первое выполнение app.py (импорт
+движка) и повторное, как при каждом действии пользователя в Streamlit.
+Код возврата 1 — если пропускная способность упала или пиковая память выросла
+больше чем на --threshold относительно базовой, либо движки парсинга разошлись,
+либо обход нашёл не все страницы раздела.
+Базовые значения зависят от машины: сохраняйте их там же, где сравниваете.
+"""
+
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+from engine import (
+    CRAWL_MAX_PAGES, KEYWORD_INDEX, PARSE_ENGINES, ScrapingBeeClient, assign_groups, blocks_frame, crawl_site,
+    export_bytes, export_tables, extract_blocks, fuzzy_groups, make_excel, near_duplicate_clusters,
+)
+from benchmarks import static_site
+
+BENCH_DIR = Path(__file__).resolve().parent / "benchmarks"
+FIXTURES_DIR = BENCH_DIR / "fixtures"
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+APP_PATH = Path(__file__).resolve().parent / "app.py"
+
+# Выполняется в чистом процессе: app.py как скрипт Streamlit без сервера (bare mode).
+# Импорт самого streamlit не считается — от приложения он не зависит.
+STARTUP_SCRIPT = r"""
+import sys, json, time, logging, resource
+import streamlit
+logging.getLogger("streamlit").setLevel(logging.CRITICAL)
+path, reruns = sys.argv[1], int(sys.argv[2])
+code = compile(open(path, encoding="utf-8").read(), path, "exec")
+def run():
+    t0 = time.perf_counter()
+    exec(code, {"__name__": "__main__", "__file__": path})
+    return time.perf_counter() - t0
+first = run()
+rerun = min(run() for _ in range(reruns))
+# ru_maxrss после fork+exec наследует пик родителя, VmHWM — нет
+try:
+    with open("/proc/self/status") as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except OSError:
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"first": first, "rerun": rerun, "peak_kb": peak_kb}))
+"""
+
+FILLER = {
+    "ru": ("мы работаем с клиентами по всей стране и отвечаем за результат каждого проекта "
+           "наши специалисты помогут подобрать решение под ваши задачи и бюджет"),
+    "en": ("we work with clients across the country and take responsibility for every project "
+           "our specialists will help you choose a solution that fits your goals and budget"),
+}
+EXTRA_HEADINGS = {
+    "ru": ["О компании", "Наша команда", "Сертификаты", "География работ", "Как заказать",
+           "Новости компании", "Партнёры", "Вакансии", "Реквизиты", "Доставка и оплата"],
+    "en": ["About the company", "Our team", "Certificates", "Where we work", "How to order",
+           "Company news", "Partners", "Careers", "Legal details", "Shipping and payment"],
+}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  СИНТЕТИЧЕСКИЙ КОРПУС
+# ═══════════════════════════════════════════════════════════════════════════════
+def synthetic_page(
+    seed: int,
+    headings: int = 40,
+    depth: int = 4,
+    size_kb: int = 200,
+    lang: str = "ru",
+) -> str:
+    """
+    Страница-лендинг: секции с заголовками (ключевые слова словаря вперемешку
+    с заголовками вне словаря), вложенные div глубиной depth, кнопки, ссылки,
+    списки, формы, картинки и мусор (script/style/svg), добитая текстом до size_kb.
+    """
+    rnd = random.Random(seed)
+    keywords = [kw for kw in KEYWORD_INDEX if (kw.isascii() == (lang == "en"))]
+    extra = EXTRA_HEADINGS[lang]
+    filler = FILLER[lang].split()
+
+    def text(n_words: int) -> str:
+        return " ".join(rnd.choice(filler) for _ in range(n_words))
+
+    sections = []
+    per_section = max(1, size_kb * 1024 // max(headings, 1))
+    for i in range(headings):
+        kw = rnd.choice(keywords) if rnd.random() < 0.7 else rnd.choice(extra)
+        title = f"{kw.capitalize()} {text(rnd.randint(0, 3))}".strip()
+        level = rnd.choice((2, 2, 2, 3, 3, 4)) if i else 1
+        body = [f"<h{level}>{title}</h{level}>"]
+        body.append(f"<p>{text(40)}</p>")
+        if rnd.random() < 0.5:
+            body.append("<ul>" + "".join(f"<li><a href='/p{j}'>{text(3)}</a></li>" for j in range(rnd.randint(2, 8))) + "</ul>")
+        if rnd.random() < 0.4:
+            body.append(f"<button>{text(2)}</button>")
+        if rnd.random() < 0.4:
+            body.append("".join(f"<img src='/img/{i}-{j}.jpg' alt=''>" for j in range(rnd.randint(1, 4))))
+        if rnd.random() < 0.1:
+            body.append("<form><input name='phone'><button type='submit'>OK</button></form>")
+        if rnd.random() < 0.05:
+            body.append("<table><tr><td>1</td><td>2</td></tr></table>")
+        if rnd.random() < 0.05:
+            body.append("<iframe src='https://example.com/embed'></iframe>")
+        if rnd.random() < 0.2:
+            body.append("<script>window.x = 1;</script><svg><path d='M0 0'/></svg>")
+
+        html = "".join(body)
+        pad = per_section - len(html)
+        while pad > 0:
+            chunk = f"<p>{text(60)}</p>"
+            html += chunk
+            pad -= len(chunk)
+        for d in range(depth):
+            html = f"<div class='wrap-{d}'>{html}</div>"
+        sections.append(f"<section id='s{i}'>{html}</section>")
+
+    nav = "".join(f"<a href='/n{j}'>{text(1)}</a>" for j in range(12))
+    return (
+        f"<!DOCTYPE html><html lang='{lang}'><head><meta charset='utf-8'>"
+        f"<title>{text(4)}</title><style>.a{{color:red}}</style></head><body>"
+        f"<header><nav>{nav}</nav><h4>{text(2)}</h4></header>"
+        f"<main>{''.join(sections)}</main>"
+        f"<footer><h5>{rnd.choice(extra)}</h5><p>{text(20)}</p></footer>"
+        "</body></html>"
+    )
+
+
+def build_corpus(quick: bool = False) -> dict[str, str]:
+    """Синтетические страницы разного профиля + сохранённые фикстуры"""
+    profiles = [
+        # (имя, seed, заголовков, глубина, КБ, язык)
+        ("ru-small",  1,  20, 2,   50, "ru"),
+        ("en-small",  2,  20, 2,   50, "en"),
+        ("ru-medium", 3,  80, 4,  500, "ru"),
+        ("en-deep",   4,  80, 10, 500, "en"),
+        ("ru-large",  5, 300, 6, 2500, "ru"),
+    ]
+    if quick:
+        profiles = [(n, s, h // 4 or 1, d, kb // 10 or 1, lang) for n, s, h, d, kb, lang in profiles[:3]]
+    corpus = {
+        name: synthetic_page(seed, headings=h, depth=d, size_kb=kb, lang=lang)
+        for name, seed, h, d, kb, lang in profiles
+    }
+    for path in sorted(FIXTURES_DIR.glob("*.html")):
+        corpus[f"fixture:{path.stem}"] = path.read_text(encoding="utf-8", errors="replace")
+    return corpus
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ИЗМЕРЕНИЯ
+# ═══════════════════════════════════════════════════════════════════════════════
+def measure(fn, repeat: int) -> tuple[float, int]:
+    """(лучшее время из repeat прогонов, пиковая память одного прогона в байтах)"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    # Память — отдельным прогоном: tracemalloc сильно замедляет код. Мусор прошлых
+    # прогонов собирается заранее, иначе пик зависит от того, когда сработает gc
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def measure_startup(repeat: int, reruns: int = 10) -> dict:
+    """Лучшее из repeat процессов: первое выполнение app.py, повторное, пиковый RSS процесса"""
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, str(APP_PATH), str(reruns)],
+            cwd=APP_PATH.parent, capture_output=True, text=True, check=True,
+        )
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {
+        "first": min(r["first"] for r in runs),
+        "rerun": min(r["rerun"] for r in runs),
+        "peak_mb": min(r["peak_kb"] for r in runs) / 1024,
+    }
+
+
+def run_benchmarks(corpus: dict[str, str], repeat: int) -> tuple[dict, list[str]]:
+    """Метрики по стадиям и список расхождений (движки парсинга, полнота обхода)"""
+    pages = list(corpus.values())
+    total_mb = sum(len(h.encode("utf-8")) for h in pages) / 1024 / 1024
+    results: dict[str, dict] = {}
+    mismatches = []
+
+    # ── Парсинг ──────────────────────────────────────────────────────────────
+    parsed: dict[str, dict[str, list[dict]]] = {}
+    for engine in PARSE_ENGINES:
+        for mode in ("main", "inner"):
+            out = {}
+
+            def parse():
+                for name, html in corpus.items():
+                    out[name] = extract_blocks(html, mode, engine)
+
+            secs, peak = measure(parse, repeat)
+            n_headings = sum(len(b) for b in out.values())
+            results[f"parse.{engine}.{mode}"] = {
+                "seconds": secs,
+                "pages_per_s": len(pages) / secs,
+                "headings_per_s": n_headings / secs,
+                "mb_per_s": total_mb / secs,
+                "peak_mb": peak / 1024 / 1024,
+            }
+            parsed.setdefault(mode, {})[engine] = out
+
+    # Движки обязаны давать одинаковые блоки
+    for mode, by_engine in parsed.items():
+        reference = by_engine["bs4"]
+        for engine, out in by_engine.items():
+            for name in corpus:
+                if out[name] != reference[name]:
+                    mismatches.append(f"{engine} ≠ bs4: {name} ({mode})")
+
+    blocks_by_page = parsed["main"]["lxml"]
+
+    # ── Группировка ──────────────────────────────────────────────────────────
+    headings = [b["heading"] for blocks in blocks_by_page.values() for b in blocks]
+    # Пачка покрупнее, чтобы время не тонуло в шуме
+    batch = headings * max(1, 20000 // max(len(headings), 1))
+    secs, peak = measure(lambda: assign_groups(batch), repeat)
+    results["group"] = {
+        "seconds": secs,
+        "headings_per_s": len(batch) / secs,
+        "peak_mb": peak / 1024 / 1024,
+    }
+    secs, peak = measure(lambda: fuzzy_groups(batch), repeat)
+    results["fuzzy"] = {
+        "seconds": secs,
+        "headings_per_s": len(batch) / secs,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+    # ── Почти-дубли блоков (SimHash + LSH) ───────────────────────────────────
+    # Корпус на нескольких «сайтах», как конкуренты на одном шаблоне
+    corpus_blocks = [b for blocks in blocks_by_page.values() for b in blocks]
+    n_copies = max(2, 20000 // max(len(corpus_blocks), 1))
+    frame = blocks_frame({f"https://copy{i}.example": corpus_blocks for i in range(n_copies)})
+    secs, peak = measure(lambda: near_duplicate_clusters(frame), repeat)
+    results["dedup"] = {
+        "seconds": secs,
+        "rows_per_s": len(frame) / secs,
+        "peak_mb": peak / 1024 / 1024,
+    }
+
+    # ── Excel ────────────────────────────────────────────────────────────────
+    urls = [f"https://{name.replace(':', '-')}.example" for name in blocks_by_page]
+    all_results = dict(zip(urls, blocks_by_page.values()))
+    rows = sum(len(b) for b in all_results.values())
+    secs, peak = measure(lambda: make_excel(urls[-1], urls[:-1], all_results, templates=True), repeat)
+    results["export"] = {
+        "seconds": secs,
+        "rows_per_s": rows / secs,
+        "peak_mb": peak / 1024 / 1024,
+    }
+    # Таблицы считаются один раз на JSON/CSV/Parquet — в замер каждого формата входят
+    for fmt in ("json", "csv", "parquet"):
+        secs, peak = measure(lambda: export_bytes(export_tables(urls[-1], urls[:-1], all_results, templates=True), fmt), repeat)
+        results[f"export.{fmt}"] = {
+            "seconds": secs,
+            "rows_per_s": rows / secs,
+            "peak_mb": peak / 1024 / 1024,
+        }
+
+    # ── Обход раздела (локальный сайт, прямая загрузка) ────────────────────
+    # По ссылкам — от адреса с редиректом (/uslugi → /uslugi/), по sitemap — индекс, .xml и .xml.gz
+    client = ScrapingBeeClient()
+    try:
+        for name, sitemap in (("links", False), ("sitemap", True)):
+            srv = static_site.serve(pages=2 * CRAWL_MAX_PAGES, sitemap=sitemap)
+            found = {}
+
+            def crawl():
+                found["pages"], _ = crawl_site(srv.root, "", client=client)
+
+            try:
+                secs, peak = measure(crawl, repeat)
+            finally:
+                srv.shutdown()
+                srv.server_close()
+            if len(found["pages"]) < CRAWL_MAX_PAGES:
+                mismatches.append(f"обход ({name}): {len(found['pages'])} страниц из {CRAWL_MAX_PAGES}")
+            results[f"crawl.{name}"] = {
+                "seconds": secs,
+                "pages_per_s": len(found["pages"]) / secs,
+                "peak_mb": peak / 1024 / 1024,
+            }
+    finally:
+        client.close()
+
+    # ── Запуск интерфейса ───────────────────────────────────────────────────
+    startup = measure_startup(repeat)
+    results["startup"] = {"seconds": startup["first"], "starts_per_s": 1 / startup["first"], "peak_mb": startup["peak_mb"]}
+    results["rerun"] = {"seconds": startup["rerun"], "reruns_per_s": 1 / startup["rerun"], "peak_mb": startup["peak_mb"]}
+
+    return results, mismatches
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Регрессии: метрики *_per_s упали, peak_mb вырос больше чем на threshold"""
+    regressions = []
+    for stage, metrics in results.items():
+        base = baseline.get(stage)
+        if not base:
+            continue
+        for key, value in metrics.items():
+            old = base.get(key)
+            if not old:
+                continue
+            if key.endswith("_per_s") and value < old * (1 - threshold):
+                regressions.append(f"{stage}.{key}: {value:,.1f} < {old:,.1f} (−{1 - value / old:.0%})")
+            elif key == "peak_mb" and value > old * (1 + threshold):
+                regressions.append(f"{stage}.{key}: {value:,.1f} > {old:,.1f} (+{value / old - 1:.0%})")
+    return regressions
+
+
+def print_table(results: dict, baseline: dict):
+    print(f"{'стадия':<20} {'сек':>8} {'стр/с':>9} {'загол/с':>11} {'строк/с':>10} {'МБ/с':>7} {'пик МБ':>8}  vs база")
+    for stage, m in results.items():
+        base = baseline.get(stage, {})
+        main_key = next((k for k in ("headings_per_s", "rows_per_s") if k in m), None)
+        delta = ""
+        if main_key and base.get(main_key):
+            delta = f"{m[main_key] / base[main_key] - 1:+.0%}"
+        cell = lambda key, width, fmt: format(m[key], fmt).rjust(width) if key in m else " " * width
+        print(
+            f"{stage:<20} {m['seconds']:>8.3f} "
+            f"{cell('pages_per_s', 9, '.1f')} {cell('headings_per_s', 11, ',.0f')} "
+            f"{cell('rows_per_s', 10, ',.0f')} {cell('mb_per_s', 7, '.1f')} {m['peak_mb']:>8.1f}  {delta}"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Бенчмарк парсинга, группировки и экспорта КНДР-парсера")
+    p.add_argument("--repeat", type=int, default=3, help="прогонов на стадию (берётся лучший)")
+    p.add_argument("--threshold", type=float, default=0.2, help="допустимая регрессия, доля (0.2 = 20%%)")
+    p.add_argument("--baseline", default=str(BASELINE_PATH), help="файл базовых результатов")
+    p.add_argument("--save-baseline", action="store_true", help="записать результаты как базовые")
+    p.add_argument("--quick", action="store_true", help="маленький корпус")
+    p.add_argument("--json", help="записать результаты в JSON-файл")
+    args = p.parse_args(argv)
+
+    corpus = build_corpus(args.quick)
+    size_mb = sum(len(h.encode("utf-8")) for h in corpus.values()) / 1024 / 1024
+    print(f"Корпус: {len(corpus)} страниц, {size_mb:.1f} МБ")
+
+    results, mismatches = run_benchmarks(corpus, max(1, args.repeat))
+
+    baseline_path = Path(args.baseline)
+    baseline = {}
+    if baseline_path.exists() and not args.save_baseline:
+        saved = json.loads(baseline_path.read_text(encoding="utf-8"))
+        if saved.get("quick", False) == args.quick:
+            baseline = saved["results"]
+        else:
+            print("⚠️  Базовые результаты сняты на другом корпусе (--quick) — сравнение пропущено")
+
+    print_table(results, baseline)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps({
+            "machine": platform.platform(),
+            "python": platform.python_version(),
+            "quick": args.quick,
+            "results": results,
+        }, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"💾 Базовые результаты записаны в {baseline_path}")
+
+    failed = False
+    for m in mismatches:
+        print(f"❌ Расхождение: {m}")
+        failed = True
+    for r in compare(results, baseline, args.threshold):
+        print(f"❌ Регрессия: {r}")
+        failed = True
+    if not failed:
+        print("✅ Без регрессий")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
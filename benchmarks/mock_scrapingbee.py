@@ -0,0 +1,130 @@
+"""
+Локальная заглушка ScrapingBee API для проверки загрузки без сети и кредитов
+
+    python benchmarks/mock_scrapingbee.py --port 8765 --latency 0.5 --rate-429 0.2 --max-concurrency 4
+    SCRAPINGBEE_ENDPOINT=http://127.0.0.1:8765/ streamlit run app.py
+
+Отдаёт страницу из benchmarks/fixtures/<имя>.html, если путь URL заканчивается
+на <имя>, иначе — синтетическую страницу. Умеет добавлять задержку и отвечать
+429 (случайно с заданной вероятностью и при превышении числа одновременных
+запросов), 500 — с заданной вероятностью. С --min-wait страница, отрендеренная
+без JS или с меньшим wait, отдаётся без заголовков ниже H1 — как сайт, который
+догружает контент скриптом.
+"""
+
+import re
+import sys
+import time
+import random
+import argparse
+import threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+def make_handler(args):
+    lock = threading.Lock()
+    state = {"in_flight": 0, "requests": 0, "throttled": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            if args.verbose:
+                super().log_message(*a)
+
+        def reply(self, code: int, body: str, headers: dict | None = None):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass   # клиент отменил запрос
+
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            url = params.get("url", [""])[0]
+            with lock:
+                state["requests"] += 1
+                state["in_flight"] += 1
+                overloaded = args.max_concurrency and state["in_flight"] > args.max_concurrency
+            try:
+                if not params.get("api_key", [""])[0]:
+                    return self.reply(401, "no api key")
+                if overloaded or random.random() < args.rate_429:
+                    with lock:
+                        state["throttled"] += 1
+                    headers = {"Retry-After": str(args.retry_after)} if args.retry_after else {}
+                    return self.reply(429, "Too many concurrent requests", headers)
+                if random.random() < args.rate_500:
+                    return self.reply(500, "internal error")
+                wait = int(params.get("wait", ["0"])[0]) if params.get("render_js", ["true"])[0] == "true" else -1
+                time.sleep(max(0.0, args.latency + max(wait, 0) / 1000 + random.uniform(-args.jitter, args.jitter)))
+                partial = wait < args.min_wait
+
+                name = urlparse(url).path.rstrip("/").rsplit("/", 1)[-1]
+                fixture = FIXTURES_DIR / f"{name}.html"
+                if name and fixture.exists():
+                    html = fixture.read_text(encoding="utf-8")
+                else:
+                    html = (
+                        f"<html><body><section><h1>{urlparse(url).netloc}</h1><p>Главная</p></section>"
+                        "<section><h2>Наши услуги</h2><ul><li>Один</li><li>Два</li></ul>"
+                        "<a href='#'>Заказать</a></section></body></html>"
+                    )
+                if partial:
+                    html = re.sub(r"<h([2-6])\b.*?</h\1>", "", html, flags=re.S | re.I)
+                return self.reply(200, html)
+            finally:
+                with lock:
+                    state["in_flight"] -= 1
+
+    return Handler, state
+
+
+def serve(args) -> ThreadingHTTPServer:
+    """Запускает сервер в фоновом потоке и возвращает его"""
+    handler, state = make_handler(args)
+    srv = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    srv.state = state
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Заглушка ScrapingBee API")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--latency", type=float, default=0.5, help="задержка ответа, сек")
+    p.add_argument("--jitter", type=float, default=0.2, help="разброс задержки, сек")
+    p.add_argument("--rate-429", type=float, default=0.0, help="доля случайных ответов 429")
+    p.add_argument("--rate-500", type=float, default=0.0, help="доля ответов 500")
+    p.add_argument("--max-concurrency", type=int, default=0,
+                   help="больше одновременных запросов — ответ 429 (0 — без лимита)")
+    p.add_argument("--retry-after", type=int, default=0, help="заголовок Retry-After для 429, сек")
+    p.add_argument("--min-wait", type=int, default=-1,
+                   help="wait (мс), без которого страница приходит без H2–H6 (-1 — хватает и render_js=false)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    srv = serve(args)
+    print(f"Заглушка ScrapingBee: http://127.0.0.1:{args.port}/")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"запросов: {srv.state['requests']}, 429: {srv.state['throttled']}")
+    except KeyboardInterrupt:
+        srv.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
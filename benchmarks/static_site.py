@@ -0,0 +1,143 @@
+"""
+Локальный статический сайт для проверки обхода разделов без сети
+
+    python benchmarks/static_site.py --port 8766 --pages 60 --sitemap
+    python batch.py jobs.csv --crawl ...   # где в jobs.csv — http://127.0.0.1:8766/uslugi
+
+Раздел /uslugi/ — дерево страниц: у каждой до --fanout дочерних, ссылки
+относительные (p7/, ../p12/), плюс ссылки вне раздела и на картинки.
+/uslugi без «/» отвечает редиректом на /uslugi/ — относительные ссылки
+главной раздела верны только от адреса после редиректа. С --sitemap есть
+robots.txt → индекс sitemap → обычный файл и .xml.gz со страницами раздела.
+"""
+
+import sys
+import gzip
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SECTION = "/uslugi/"
+
+WORDS = (
+    "ремонт квартир под ключ смета сроки гарантия мастер замер материалы отделка "
+    "плитка ламинат электрика сантехника дизайн проект бригада договор цена этап"
+).split()
+
+
+def page_path(i: int) -> str:
+    return SECTION if i == 0 else f"{SECTION}p{i}/"
+
+
+def page_html(i: int, n_pages: int, fanout: int) -> str:
+    """Страница i: заголовки с текстом и ссылки на дочерние страницы дерева"""
+    children = [c for c in range(i * fanout + 1, i * fanout + fanout + 1) if c < n_pages]
+    # Ссылки относительно самой страницы: с главной раздела — «p7/», с p3 — «../p7/»
+    prefix = "" if i == 0 else "../"
+    links = "".join(f'<li><a href="{prefix}p{c}/">Услуга {c}</a></li>' for c in children)
+    sections = []
+    for k in range(6):
+        text = " ".join(WORDS[(i * 7 + k * 3 + j) % len(WORDS)] for j in range(60))
+        sections.append(f"<section><h2>Раздел {k + 1} страницы {i}</h2><p>{text}.</p>"
+                        f'<img src="/img/{i}-{k}.jpg" alt=""><a class="btn" href="/zakaz/">Заказать</a></section>')
+    return (
+        f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Страница {i}</title></head><body>"
+        f'<header><nav><a href="/">Главная</a><a href="/blog/">Блог</a><a href="https://other.example/">Партнёр</a></nav></header>'
+        f"<main><h1>Услуга {i}</h1>{''.join(sections)}<ul>{links}</ul></main>"
+        f"<footer><a href=\"/contacts/\">Контакты</a></footer></body></html>"
+    )
+
+
+def build_site(n_pages: int, fanout: int, sitemap: bool, base: str) -> dict[str, tuple[int, str, bytes]]:
+    """Путь → (код, Content-Type, тело)"""
+    site = {page_path(i): (200, "text/html; charset=utf-8", page_html(i, n_pages, fanout).encode("utf-8"))
+            for i in range(n_pages)}
+    if sitemap:
+        urls = [f"{base}{page_path(i)}" for i in range(n_pages)]
+        half = len(urls) // 2
+
+        def urlset(part: list[str]) -> bytes:
+            locs = "".join(f"<url><loc>{u}</loc></url>" for u in part)
+            return (f'<?xml version="1.0" encoding="UTF-8"?>'
+                    f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{locs}</urlset>').encode()
+
+        index = "".join(f"<sitemap><loc>{base}/{name}</loc></sitemap>" for name in ("sitemap-1.xml", "sitemap-2.xml.gz"))
+        site["/robots.txt"] = (200, "text/plain", f"User-agent: *\nSitemap: {base}/sitemap-index.xml\n".encode())
+        site["/sitemap-index.xml"] = (200, "application/xml", (
+            f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{index}</sitemapindex>').encode())
+        site["/sitemap-1.xml"] = (200, "application/xml", urlset(urls[:half]))
+        site["/sitemap-2.xml.gz"] = (200, "application/gzip", gzip.compress(urlset(urls[half:])))
+    return site
+
+
+def make_handler(site: dict, state: dict, verbose: bool = False):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, как у настоящих сайтов
+
+        def log_message(self, *a):
+            if verbose:
+                super().log_message(*a)
+
+        def reply(self, code: int, content_type: str, body: bytes, headers: dict | None = None):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                pass   # клиент не дочитал (предел размера sitemap)
+
+        def do_GET(self):
+            with lock:
+                state["requests"] += 1
+            path = self.path.split("?", 1)[0].split("#", 1)[0]
+            if path == SECTION.rstrip("/"):
+                return self.reply(301, "text/html", b"", {"Location": SECTION})
+            if path in site:
+                return self.reply(*site[path])
+            return self.reply(404, "text/html", b"not found")
+
+    return Handler
+
+
+def serve(port: int = 0, pages: int = 60, fanout: int = 5, sitemap: bool = False, verbose: bool = False) -> ThreadingHTTPServer:
+    """Запускает сайт в фоновом потоке (port=0 — свободный порт) и возвращает сервер"""
+    state = {"requests": 0}
+    srv = ThreadingHTTPServer(("127.0.0.1", port), BaseHTTPRequestHandler)
+    srv.daemon_threads = True
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+    srv.RequestHandlerClass = make_handler(build_site(pages, fanout, sitemap, base), state, verbose)
+    srv.state = state
+    srv.root = f"{base}{SECTION.rstrip('/')}"   # начало раздела — с редиректом
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+def main(argv: list[str] | None = None) -> int:
+    p = argparse.ArgumentParser(description="Статический сайт для обхода разделов")
+    p.add_argument("--port", type=int, default=8766)
+    p.add_argument("--pages", type=int, default=60, help="страниц в разделе")
+    p.add_argument("--fanout", type=int, default=5, help="ссылок на дочерние страницы со страницы")
+    p.add_argument("--sitemap", action="store_true", help="robots.txt и sitemap (индекс, .xml и .xml.gz)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    args = p.parse_args(argv)
+    srv = serve(args.port, args.pages, args.fanout, args.sitemap, args.verbose)
+    print(f"Раздел сайта: {srv.root}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"запросов: {srv.state['requests']}")
+    except KeyboardInterrupt:
+        srv.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3511 @@
+"""
+КНДР-парсер — движок: загрузка страниц, разбор на блоки, группировка, сводка,
+Excel-отчёт и история запусков. Без Streamlit: его импортируют интерфейс (app.py),
+batch.py, bench.py и history.py.
+
+Модуль загружается один раз на процесс, поэтому словарь, индекс ключевых слов
+и стили Excel не пересобираются при перезапусках скрипта Streamlit.
+numpy, pandas, openpyxl, lxml, BeautifulSoup и httpx загружаются при первом использовании.
+"""
+
+import io
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import random
+import bisect
+import contextlib
+import functools
+import sqlite3
+import hashlib
+import asyncio
+import threading
+import zipfile
+import zlib
+import concurrent.futures
+import concurrent.futures.process
+from array import array
+from pathlib import Path
+from typing import TYPE_CHECKING
+from urllib.parse import urlparse, urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+from collections import Counter, OrderedDict, defaultdict
+
+if TYPE_CHECKING:
+    import httpx
+    import numpy as np
+    import pandas as pd
+    from lxml import etree
+    from openpyxl.styles import Border
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  СЛОВАРЬ СИНОНИМОВ (русский + английский)
+# ═══════════════════════════════════════════════════════════════════════════════
+SYNONYM_GROUPS = {
+    "🦸 Герой / Hero": [
+        # RU
+        "герой", "главный", "первый экран", "обложка", "баннер", "слайдер", "слайд",
+        "добро пожаловать", "мы помогаем", "мы создаём", "мы делаем",
+        # EN
+        "hero", "welcome", "banner", "slider", "above the fold", "headline",
+        "we help", "we create", "we build", "get started",
+    ],
+    "⭐ Преимущества": [
+        "преимущество", "выгода", "польза", "плюс", "достоинство", "особенность",
+        "почему мы", "почему нас", "зачем", "чем мы лучше", "наши преимущества",
+        "why us", "why choose", "benefits", "advantages", "features", "what makes",
+    ],
+    "🛠️ Услуги / Продукты": [
+        "услуга", "сервис", "решение", "продукт", "предложение", "направление",
+        "что мы делаем", "что мы предлагаем", "наши услуги", "наши продукты",
+        "services", "products", "solutions", "offerings", "what we do",
+    ],
+    "💰 Цены / Тарифы": [
+        "цена", "стоимость", "тариф", "прайс", "расценка", "сколько стоит",
+        "пакет", "тарифный план", "оплата", "стоить",
+        "price", "pricing", "plans", "packages", "cost", "rates", "tariff",
+    ],
+    "💬 Отзывы": [
+        "отзыв", "мнение", "оценка", "рецензия", "рекомендация", "что говорят",
+        "наши клиенты", "нам доверяют",
+        "testimonials", "reviews", "feedback", "what our clients say", "what people say",
+    ],
+    "❓ FAQ": [
+        "faq", "вопрос", "ответ", "частый вопрос", "часто задают",
+        "frequently asked", "questions", "q&a", "answers",
+    ],
+    "👥 Команда": [
+        "команда", "сотрудник", "специалист", "эксперт", "мастер", "профессионал",
+        "наша команда", "познакомьтесь",
+        "team", "our team", "meet", "staff", "experts", "specialists",
+    ],
+    "🏢 О компании": [
+        "компания", "организация", "студия", "агентство", "кто мы", "о нас",
+        "история", "миссия", "ценности", "о компании",
+        "about", "about us", "our story", "mission", "vision", "who we are",
+    ],
+    "📞 Контакты": [
+        "контакт", "связь", "адрес", "телефон", "написать", "позвонить",
+        "обратная связь", "свяжитесь", "форма связи",
+        "contact", "contacts", "get in touch", "reach us", "write to us",
+    ],
+    "🗂️ Портфолио / Кейсы": [
+        "портфолио", "кейс", "проект", "наши работы", "пример работ",
+        "portfolio", "case studies", "our work", "projects", "examples",
+    ],
+    "🤝 Партнёры / Клиенты": [
+        "партнёр", "партнер", "клиент", "логотип", "бренд", "нам доверяют",
+        "с нами работают", "наши клиенты",
+        "partners", "clients", "trusted by", "brands", "our clients",
+    ],
+    "🛡️ Гарантии": [
+        "гарантия", "гарантировать", "обязательство", "уверенность", "надёжность",
+        "guarantee", "guarantees", "warranty", "commitment", "reliability",
+    ],
+    "📋 Процесс / Этапы": [
+        "процесс", "этап", "шаг", "как мы работаем", "порядок работы",
+        "схема", "как это работает",
+        "process", "how it works", "steps", "our process", "workflow",
+    ],
+    "📊 Статистика / Цифры": [
+        "статистика", "цифра", "факт", "достижение", "результат", "показатель",
+        "нас выбрали", "доверяют",
+        "stats", "statistics", "numbers", "achievements", "results", "facts",
+    ],
+    "📝 Блог / Статьи": [
+        "блог", "статья", "новость", "публикация", "пост", "материал",
+        "blog", "articles", "news", "posts", "latest", "insights",
+    ],
+    "🎥 Видео": [
+        "видео", "ролик", "презентация", "демо", "смотреть",
+        "video", "watch", "demo", "presentation",
+    ],
+    "📩 CTA / Заявка": [
+        "заявка", "записаться", "получить", "заказать", "попробовать",
+        "начать", "купить", "оставить заявку", "бесплатно",
+        "cta", "call to action", "sign up", "get started", "try free",
+        "book", "order", "buy", "request",
+    ],
+}
+
+
+def build_keyword_index() -> dict[str, str]:
+    """Словарь keyword → group name"""
+    idx = {}
+    for group, keywords in SYNONYM_GROUPS.items():
+        for kw in keywords:
+            idx[kw.lower()] = group
+    return idx
+
+
+KEYWORD_INDEX = build_keyword_index()
+
+
+def normalize(text: str) -> str:
+    """Нормализация: lower + удаление пунктуации"""
+    text = text.lower()
+    text = re.sub(r"[^\w\s]", " ", text, flags=re.UNICODE)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class KeywordMatcher:
+    """
+    Все ключевые слова, скомпилированные в одно регулярное выражение.
+    Побеждает самая длинная фраза (при равной длине — раньше в словаре),
+    как при переборе ключей, отсортированных по длине.
+    """
+
+    def __init__(self, index: dict[str, str]):
+        # Порядок приоритета: длиннее — точнее
+        self.keywords = sorted(index.keys(), key=len, reverse=True)
+        self.groups = [index[kw] for kw in self.keywords]
+        self.rank = {kw: i for i, kw in enumerate(self.keywords)}
+        # Lookahead даёт совпадение в каждой позиции (в т.ч. перекрывающиеся),
+        # а жадный префиксный trie — самую длинную фразу, начинающуюся в ней
+        self.pattern = re.compile(
+            "(?=(" + self._trie_regex(self.keywords) + "))"
+        ) if self.keywords else None
+
+    @staticmethod
+    def _trie_regex(keywords: list[str]) -> str:
+        """Регулярка в виде префиксного дерева: проверка O(длина фразы), а не O(число фраз)"""
+        trie: dict = {}
+        for kw in keywords:
+            node = trie
+            for ch in kw:
+                node = node.setdefault(ch, {})
+            node[""] = True
+
+        def build(node: dict) -> str:
+            alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+            if not alts:
+                return ""
+            body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+            if "" in node:
+                return f"(?:{body})?"
+            return body
+
+        return build(trie)
+
+    def match(self, norm: str) -> str | None:
+        """Группа для нормализованного текста или None"""
+        if self.pattern is None:
+            return None
+        best = min((self.rank[m.group(1)] for m in self.pattern.finditer(norm)), default=None)
+        return None if best is None else self.groups[best]
+
+    def match_many(self, norms: list[str]) -> list[str | None]:
+        """Группы для пачки нормализованных текстов за один проход регулярки"""
+        result: list[str | None] = [None] * len(norms)
+        if self.pattern is None or not norms:
+            return result
+        # normalize() схлопывает пробелы, поэтому \n не встречается внутри текстов
+        starts = []
+        pos = 0
+        for n in norms:
+            starts.append(pos)
+            pos += len(n) + 1
+        best = [len(self.keywords)] * len(norms)
+        for m in self.pattern.finditer("\n".join(norms)):
+            i = bisect.bisect_right(starts, m.start()) - 1
+            r = self.rank[m.group(1)]
+            if r < best[i]:
+                best[i] = r
+        for i, r in enumerate(best):
+            if r < len(self.keywords):
+                result[i] = self.groups[r]
+        return result
+
+
+KEYWORD_MATCHER = KeywordMatcher(KEYWORD_INDEX)
+
+
+def fallback_group(heading: str, norm: str) -> str:
+    """Группа для заголовка вне словаря: первые значимые слова"""
+    words = [w for w in norm.split() if len(w) > 3]
+    return " ".join(words[:3]) if words else heading[:25]
+
+
+def assign_group(heading: str) -> str:
+    """Определяет семантическую группу заголовка по ключевым словам"""
+    norm = normalize(heading)
+    return KEYWORD_MATCHER.match(norm) or fallback_group(heading, norm)
+
+
+def assign_groups(headings: list[str]) -> list[str]:
+    """assign_group для списка заголовков одним вызовом"""
+    norms = [normalize(h) for h in headings]
+    return [
+        g or fallback_group(h, n)
+        for h, n, g in zip(headings, norms, KEYWORD_MATCHER.match_many(norms))
+    ]
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  НЕЧЁТКАЯ ГРУППИРОВКА ЗАГОЛОВКОВ ВНЕ СЛОВАРЯ (n-граммы, разреженное сходство)
+# ═══════════════════════════════════════════════════════════════════════════════
+FUZZY_PROTOTYPE_SIMILARITY = 0.55   # косинус с ключевым словом группы словаря — вливаем в неё
+FUZZY_CLUSTER_SIMILARITY = 0.6      # косинус между заголовками — одна общая группа
+FUZZY_MAX_DF = 0.2                  # n-граммы чаще этой доли документов не порождают пар
+
+
+def ngram_matrix(texts: list[str]) -> "tuple[np.ndarray, np.ndarray, np.ndarray]":
+    """
+    Символьные 3-граммы текстов → разреженная матрица TF-IDF в формате COO
+    (строка = номер текста, признак, вес) с нормой строк 1
+    """
+    import numpy as np
+
+    # Все тексты — один массив кодов символов; 0 разделяет тексты
+    joined = "\0".join(f" {t} " for t in texts)
+    codes = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    if len(codes) < 3:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+    gram = (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+    valid = (codes[:-2] != 0) & (codes[1:-1] != 0) & (codes[2:] != 0)
+    n_rows = len(texts)
+    row = np.cumsum(codes == 0)[:-2][valid]
+    _, feat = np.unique(gram[valid], return_inverse=True)
+    n_feat = int(feat.max()) + 1 if len(feat) else 0
+
+    cell, tf = np.unique(row * n_feat + feat, return_counts=True)
+    row, feat = cell // n_feat, cell % n_feat
+    df = np.bincount(feat, minlength=n_feat)
+    weight = tf * (np.log((1 + n_rows) / (1 + df[feat])) + 1)
+    norm = np.sqrt(np.bincount(row, weights=weight ** 2, minlength=n_rows))
+    return row, feat, weight / norm[row]
+
+
+def sparse_similarities(
+    row: "np.ndarray", feat: "np.ndarray", weight: "np.ndarray", n_rows: int,
+    n_query: int | None = None, max_df: float = FUZZY_MAX_DF,
+) -> "tuple[np.ndarray, np.ndarray, np.ndarray]":
+    """
+    Косинусное сходство пар строк, у которых есть общий признак: (a, b, sim)
+    с a < b. n_query — считать только пары, где a < n_query (строки-запросы
+    против всех), иначе все пары. Пары порождаются внутри каждого признака,
+    поэтому частые n-граммы (больше max_df строк, но не меньше 20) отбрасываются.
+    """
+    import numpy as np
+
+    order = np.lexsort((row, feat))
+    row, feat, weight = row[order], feat[order], weight[order]
+    df = np.bincount(feat)
+    keep = df[feat] <= max(20, int(max_df * n_rows))
+    row, feat, weight = row[keep], feat[keep], weight[keep]
+    if not len(row):
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+
+    # Для каждой записи — все следующие записи того же признака
+    group_end = np.searchsorted(feat, feat, side="right")
+    n_pairs = group_end - np.arange(len(feat)) - 1
+    if n_query is not None:
+        n_pairs[row >= n_query] = 0
+    left = np.repeat(np.arange(len(feat)), n_pairs)
+    offset = np.arange(len(left)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+    right = left + 1 + offset
+
+    a, b = row[left], row[right]
+    key = np.minimum(a, b) * n_rows + np.maximum(a, b)
+    pairs, inverse = np.unique(key, return_inverse=True)
+    sim = np.bincount(inverse, weights=weight[left] * weight[right])
+    return pairs // n_rows, pairs % n_rows, sim
+
+
+def connected_components(n: int, a: "np.ndarray", b: "np.ndarray") -> "np.ndarray":
+    """Метка компоненты связности для каждой вершины — наименьший номер вершины в ней"""
+    import numpy as np
+
+    labels = np.arange(n)
+    while True:
+        new = labels.copy()
+        np.minimum.at(new, a, labels[b])
+        np.minimum.at(new, b, labels[a])
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def fuzzy_groups(headings: list[str]) -> list[str]:
+    """
+    assign_groups для всех заголовков запуска сразу, но заголовки вне словаря
+    не разваливаются на разовые группы: похожие на ключевое слово группы
+    словаря вливаются в неё, похожие друг на друга — в общую группу, названную
+    по первому из них. Образцы — только ключевые слова: заголовок, попавший в
+    группу словаря, образцом не служит, иначе похожие на него цепочкой уводили
+    бы в группу заголовки, далёкие от её ключевых слов.
+    """
+    import numpy as np
+
+    norms = [normalize(h) for h in headings]
+    matched = KEYWORD_MATCHER.match_many(norms)
+    groups = [g or fallback_group(h, n) for h, n, g in zip(headings, norms, matched)]
+    # Одинаковые после нормализации заголовки сравниваются один раз
+    first = {}
+    for i, g in enumerate(matched):
+        if g is None:
+            first.setdefault(norms[i], i)
+    if not first:
+        return groups
+    unmatched = list(first.values())
+
+    # Строки матрицы: сначала заголовки вне словаря, затем образцы групп словаря
+    samples = {kw: g for g, keywords in SYNONYM_GROUPS.items() for kw in keywords}
+    sample_groups = list(samples.values())
+    texts = list(first) + list(samples)
+    u = len(unmatched)
+
+    a, b, sim = sparse_similarities(*ngram_matrix(texts), len(texts), n_query=u)
+
+    # Заголовок ↔ образец (a < b, образцы идут после заголовков): ближайший образец
+    to_sample = np.flatnonzero((a < u) & (b >= u) & (sim >= FUZZY_PROTOTYPE_SIMILARITY))
+    to_sample = to_sample[np.argsort(sim[to_sample], kind="stable")]   # лучший записывается последним
+    best_sample = np.full(u, -1)
+    best_sample[a[to_sample]] = b[to_sample] - u
+    for k in np.flatnonzero(best_sample >= 0):
+        groups[unmatched[k]] = sample_groups[best_sample[k]]
+
+    # Заголовок ↔ заголовок: кластеры среди оставшихся вне словаря
+    free = best_sample < 0
+    pair = np.flatnonzero((b < u) & (sim >= FUZZY_CLUSTER_SIMILARITY))
+    pair = pair[free[a[pair]] & free[b[pair]]]
+    labels = connected_components(u, a[pair], b[pair])
+    for k in np.flatnonzero(free & (labels != np.arange(u))):
+        groups[unmatched[k]] = groups[unmatched[labels[k]]]
+    for i, g in enumerate(matched):
+        if g is None:
+            groups[i] = groups[first[norms[i]]]
+    return groups
+
+
+def refine_groups(all_results: dict[str, list[dict]]) -> dict[str, list[dict]]:
+    """
+    Перегруппировка всех блоков запуска через fuzzy_groups. Возвращает новые
+    словари блоков там, где группа изменилась; исходные блоки не меняются.
+    """
+    headings = [b["heading"] for blocks in all_results.values() for b in blocks]
+    groups = iter(fuzzy_groups(headings))
+    return {
+        url: [b if b["group"] == g else {**b, "group": g} for b, g in zip(blocks, groups)]
+        for url, blocks in all_results.items()
+    }
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ЗАГРУЗКА СТРАНИЦ (ScrapingBee)
+# ═══════════════════════════════════════════════════════════════════════════════
+SCRAPINGBEE_ENDPOINT = os.environ.get("SCRAPINGBEE_ENDPOINT", "https://app.scrapingbee.com/api/v1/")
+
+
+# Профили рендера — от дешёвого к надёжному; "default" подходит любому сайту
+RENDER_PROFILES = {
+    "nojs": {"render_js": "false"},                       # 1 кредит вместо 5
+    "fast": {"render_js": "true", "wait": "0", "block_resources": "true"},
+    "light": {"render_js": "true", "wait": "1000", "wait_for": "body", "block_resources": "true"},
+    "default": {
+        "render_js": "true",
+        "wait": "2000",           # ждём 2 сек после JS
+        "wait_for": "body",
+        "block_resources": "false",
+    },
+}
+DEFAULT_RENDER_PROFILE = "default"
+
+
+def scrapingbee_params(url: str, api_key: str, profile: str = DEFAULT_RENDER_PROFILE) -> dict[str, str]:
+    """Параметры запроса к ScrapingBee"""
+    return {
+        "api_key": api_key,
+        "url": url,
+        **RENDER_PROFILES[profile],
+        "block_ads": "true",
+        "return_page_source": "true",
+    }
+
+
+def render_credits(profile: str) -> int:
+    """Кредитов ScrapingBee за успешный запрос с профилем: 5 с JS-рендером, 1 без"""
+    return 1 if RENDER_PROFILES[profile].get("render_js") == "false" else 5
+
+
+def scrapingbee_result(r: "httpx.Response") -> tuple[str | None, str | None]:
+    """Ответ ScrapingBee → (html, ошибка)"""
+    if r.status_code == 200:
+        return r.text, None
+    elif r.status_code == 401:
+        return None, "❌ Неверный API-ключ ScrapingBee"
+    elif r.status_code == 422:
+        return None, f"❌ Сайт заблокировал парсинг (код 422)"
+    elif r.status_code == 429:
+        return None, "❌ ScrapingBee: превышен лимит запросов (429)"
+    elif r.status_code == 500:
+        return None, "❌ ScrapingBee: внутренняя ошибка сервера"
+    else:
+        return None, f"❌ HTTP {r.status_code}: {r.text[:200]}"
+
+
+def fetch_via_scrapingbee(url: str, api_key: str, timeout: int = 30) -> tuple[str | None, str | None]:
+    """Загружает страницу через ScrapingBee API с JS-рендерингом"""
+    client = default_scrapingbee_client()
+    html, err, *_ = client.submit(client.fetch(url, api_key, timeout)).result()
+    return html, err
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  КЭШ ОТРЕНДЕРЕННЫХ СТРАНИЦ (диск, gzip, TTL + LRU)
+# ═══════════════════════════════════════════════════════════════════════════════
+CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "html"
+CACHE_TTL = 24 * 3600               # сек
+CACHE_MAX_BYTES = 200 * 1024 * 1024  # 200 МБ сжатых страниц
+
+
+class HtmlCache:
+    """
+    Кэш HTML на диске: один gzip-файл на ключ (URL + параметры ScrapingBee).
+    mtime файла — время загрузки (для TTL), atime — последнее чтение (для LRU).
+    """
+
+    def __init__(self, root: Path = CACHE_DIR, ttl: int = CACHE_TTL, max_bytes: int = CACHE_MAX_BYTES):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(params: dict[str, str]) -> str:
+        """Ключ кэша: параметры запроса без API-ключа"""
+        data = {k: v for k, v in params.items() if k != "api_key"}
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.html.gz"
+
+    def get(self, key: str, count: bool = True) -> str | None:
+        """Запись по ключу; count=False — служебное чтение, не в hits/misses"""
+        path = self._path(key)
+        try:
+            st_ = path.stat()
+            if time.time() - st_.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+                self.misses += count
+                return None
+            html = gzip.decompress(path.read_bytes()).decode("utf-8")
+            os.utime(path, (time.time(), st_.st_mtime))
+        except (OSError, EOFError, UnicodeDecodeError):
+            self.misses += count
+            return None
+        self.hits += count
+        return html
+
+    def put(self, key: str, html: str):
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self._path(key).with_suffix(".tmp")
+            tmp.write_bytes(gzip.compress(html.encode("utf-8"), compresslevel=6))
+            os.replace(tmp, self._path(key))
+        except OSError:
+            return
+        self.evict()
+
+    def evict(self):
+        """Удаляет просроченные записи, затем самые давно читанные — до лимита размера"""
+        now = time.time()
+        entries = []
+        for path in self.root.glob("*.html.gz"):
+            try:
+                st_ = path.stat()
+            except OSError:
+                continue
+            if now - st_.st_mtime > self.ttl:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((st_.st_atime, st_.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ПРЯМАЯ ЗАГРУЗКА (без JS-рендера) И ПРОВЕРКА НА JS-ОБОЛОЧКУ
+# ═══════════════════════════════════════════════════════════════════════════════
+FETCH_STRATEGIES = {"auto": "Только если нужен", "render": "Всегда"}
+DIRECT_TIMEOUT = 10          # сек; дольше — сразу уходим в ScrapingBee
+DIRECT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "ru,en;q=0.8",
+}
+SHELL_MIN_TEXT = 500         # видимых символов (без пробелов) — меньше считаем оболочкой
+
+SPA_ROOT_RE = re.compile(
+    r"<(div|main)\b[^>]*\sid=[\"']?(?:root|app|__next|__nuxt|___gatsby|svelte)(?=[\"'\s>])[^>]*>\s*</\1\s*>"
+    r"|<app-root\b[^>]*>\s*</app-root\s*>",
+    re.I,
+)
+NON_VISIBLE_RE = re.compile(r"<(script|style|noscript|template)\b.*?</\1\s*>|<!--.*?-->", re.I | re.S)
+HEADING_TAG_RE = re.compile(r"<h[1-6][\s>]", re.I)
+ANY_TAG_RE = re.compile(r"<[^>]*>")
+META_CHARSET_RE = re.compile(rb"<meta[^>]+charset=[\"']?([\w-]+)", re.I)
+
+
+def js_shell_reason(html: str) -> str | None:
+    """
+    Похоже ли на страницу, которая собирается JS-ом в браузере?
+    Возвращает причину (для статистики) или None, если контент уже в HTML.
+    """
+    if SPA_ROOT_RE.search(html):
+        return "пустой контейнер SPA"
+    visible = NON_VISIBLE_RE.sub(" ", html)
+    if not HEADING_TAG_RE.search(visible):
+        return "нет заголовков"
+    if len("".join(ANY_TAG_RE.sub(" ", visible).split())) < SHELL_MIN_TEXT:
+        return "мало текста"
+    return None
+
+
+def response_html(r: "httpx.Response") -> str:
+    """Текст ответа; без charset в заголовке — по <meta charset> (cp1251 и т.п.)"""
+    if r.charset_encoding is None:
+        m = META_CHARSET_RE.search(r.content[:4096])
+        if m:
+            try:
+                return r.content.decode(m.group(1).decode("ascii"), errors="replace")
+            except LookupError:
+                pass
+    return r.text
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ПРОФИЛИ РЕНДЕРА ПО ДОМЕНАМ (самые дешёвые настройки без потери заголовков)
+# ═══════════════════════════════════════════════════════════════════════════════
+RENDER_PROFILES_PATH = CACHE_DIR.parent / "render_profiles.json"
+RENDER_PROFILE_TTL = 30 * 24 * 3600   # сек; потом домен подбирается заново
+RENDER_PROFILE_MAX_REFS = 50          # эталонных страниц на домен
+
+
+def heading_signature(html: str) -> tuple[str, int]:
+    """Отпечаток набора заголовков страницы (как их видит extract_blocks) и их число"""
+    headings = [f"{level}:{text}" for text, level, *_ in parse_blocks_lxml(html, "main")]
+    return hashlib.sha1("\n".join(headings).encode("utf-8")).hexdigest(), len(headings)
+
+
+class RenderProfiles:
+    """
+    Профиль рендера на домен, JSON на диске:
+    {домен: {"profile": ..., "failed": [...], "refs": {url: [отпечаток, заголовков]}, "updated": ...}}.
+
+    Новый домен рендерится профилем "default", отпечаток его заголовков
+    запоминается как эталон. При следующих загрузках той же страницы пробуется
+    профиль на ступень дешевле: если заголовки совпали с эталоном — он становится
+    профилем домена, если нет — помечается неудачным и больше не пробуется.
+    """
+
+    def __init__(self, path: Path = RENDER_PROFILES_PATH, ttl: int = RENDER_PROFILE_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.probing: set[str] = set()   # одна проба на домен одновременно
+        try:
+            self.domains: dict[str, dict] = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            self.domains = {}
+
+    def _entry(self, domain: str) -> dict:
+        e = self.domains.get(domain)
+        if e is None or time.time() - e.get("updated", 0) > self.ttl or e.get("profile") not in RENDER_PROFILES:
+            e = self.domains[domain] = {
+                "profile": DEFAULT_RENDER_PROFILE, "failed": [], "refs": {}, "updated": time.time(),
+            }
+        return e
+
+    def profile(self, domain: str) -> str:
+        with self.lock:
+            return self._entry(domain)["profile"]
+
+    def probe_candidate(self, domain: str, url: str) -> str | None:
+        """
+        Профиль на ступень дешевле текущего, если его есть с чем сравнить.
+        Занимает пробу домена до end_probe().
+        """
+        with self.lock:
+            e = self._entry(domain)
+            names = list(RENDER_PROFILES)
+            i = names.index(e["profile"])
+            if i == 0 or url not in e["refs"] or names[i - 1] in e["failed"] or domain in self.probing:
+                return None
+            self.probing.add(domain)
+            return names[i - 1]
+
+    def end_probe(self, domain: str):
+        with self.lock:
+            self.probing.discard(domain)
+
+    def verify(self, domain: str, url: str, profile: str, signature: str) -> bool:
+        """Итог пробы: совпали заголовки с эталоном — профиль принят"""
+        with self.lock:
+            e = self._entry(domain)
+            ok = e["refs"].get(url, [None])[0] == signature
+            if ok:
+                e["profile"] = profile
+            elif profile not in e["failed"]:
+                e["failed"].append(profile)
+            self._save()
+        return ok
+
+    def remember(self, domain: str, url: str, signature: str, count: int):
+        """Эталон заголовков страницы, загруженной проверенным профилем"""
+        with self.lock:
+            refs = self._entry(domain)["refs"]
+            refs.pop(url, None)
+            refs[url] = [signature, count]
+            while len(refs) > RENDER_PROFILE_MAX_REFS:
+                del refs[next(iter(refs))]
+            self._save()
+
+    def lost_headings(self, domain: str, url: str, count: int) -> bool:
+        """Заголовков нет совсем или меньше, чем в эталоне страницы"""
+        with self.lock:
+            ref = self._entry(domain)["refs"].get(url)
+        return count == 0 or (ref is not None and count < ref[1])
+
+    def reset(self, domain: str):
+        """Дешёвый профиль дал меньше заголовков, чем "default", — обратно к "default" """
+        with self.lock:
+            e = self._entry(domain)
+            if e["profile"] != DEFAULT_RENDER_PROFILE:
+                if e["profile"] not in e["failed"]:
+                    e["failed"].append(e["profile"])
+                e["profile"] = DEFAULT_RENDER_PROFILE
+                self._save()
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self.domains, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  КЛИЕНТ SCRAPINGBEE (пул соединений, повторы, адаптивный параллелизм)
+# ═══════════════════════════════════════════════════════════════════════════════
+SCRAPINGBEE_MAX_CONCURRENCY = 10        # потолок одновременных запросов на процесс
+SCRAPINGBEE_RETRIES = 3                 # повторов сверх первой попытки
+SCRAPINGBEE_BACKOFF = (1.0, 20.0)       # база и потолок экспоненциальной паузы, сек
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+class AdaptiveLimiter:
+    """
+    Лимит одновременных запросов по схеме AIMD: ответ 429 делит лимит пополам,
+    а после `limit` успешных ответов подряд лимит растёт на единицу.
+    """
+
+    def __init__(self, limit: int, min_limit: int = 1):
+        self.max_limit = limit
+        self.min_limit = min_limit
+        self.limit = limit
+        self.in_flight = 0
+        self.successes = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, outcome: str):
+        """outcome: 'ok' | 'throttled' | 'error'"""
+        async with self.cond:
+            self.in_flight -= 1
+            if outcome == "throttled":
+                self.limit = max(self.min_limit, self.limit // 2)
+                self.successes = 0
+            elif outcome == "ok":
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self.successes = 0
+            self.cond.notify_all()
+
+
+class ScrapingBeeClient:
+    """
+    Долгоживущий клиент ScrapingBee на один процесс: общий httpx.AsyncClient
+    (соединения и TLS переиспользуются между страницами и запусками) в
+    собственном событийном цикле в фоновом потоке, повторы с экспоненциальной
+    паузой и jitter, адаптивный лимит параллелизма по сигналам 429.
+    Отдельный пул — для прямой загрузки сайтов без рендера (fetch_direct).
+    Одинаковые загрузки в полёте объединяются (single_flight) — в том числе
+    между запусками и сессиями Streamlit, у которых клиент общий.
+    """
+
+    def __init__(
+        self,
+        endpoint: str = SCRAPINGBEE_ENDPOINT,
+        max_concurrency: int = SCRAPINGBEE_MAX_CONCURRENCY,
+        retries: int = SCRAPINGBEE_RETRIES,
+        backoff: tuple[float, float] = SCRAPINGBEE_BACKOFF,
+    ):
+        import httpx
+
+        self.endpoint = endpoint
+        self.retries = retries
+        self.backoff_base, self.backoff_max = backoff
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="scrapingbee", daemon=True)
+        self.thread.start()
+
+        async def setup():
+            limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+            direct = httpx.AsyncClient(headers=DIRECT_HEADERS, follow_redirects=True)
+            return httpx.AsyncClient(limits=limits), direct, AdaptiveLimiter(max_concurrency)
+
+        self.http, self.direct, self.limiter = self.submit(setup()).result()
+        self.inflight: dict[tuple, asyncio.Task] = {}   # только из цикла клиента
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Запускает корутину в цикле клиента"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def close(self):
+        self.submit(self.http.aclose()).result()
+        self.submit(self.direct.aclose()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def single_flight(self, key: tuple, load) -> tuple[object, bool]:
+        """
+        Один вызов load() на ключ: пока загрузка с тем же ключом идёт, остальные
+        ждут её результат → (результат, получен ли он чужой загрузкой).
+        Загрузка — отдельная задача: отмена одного из ждущих не обрывает её для остальных.
+        """
+        task = self.inflight.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        def done(t: asyncio.Task):
+            self.inflight.pop(key, None)
+            if not t.cancelled():
+                t.exception()   # ошибка уже отдана ждущим; без этого asyncio пишет в лог
+
+        task = self.inflight[key] = asyncio.ensure_future(load())
+        task.add_done_callback(done)
+        return await asyncio.shield(task), False
+
+    def backoff_delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """Пауза перед повтором: Retry-After, если он есть, иначе full jitter"""
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def fetch(
+        self, url: str, api_key: str, timeout: int = 30, profile: str = DEFAULT_RENDER_PROFILE,
+    ) -> tuple[str | None, str | None, int, str]:
+        """
+        Одна страница с повторами → (html, ошибка, число попыток, адрес после
+        редиректов — по заголовку Spb-Resolved-Url); таймаут — на попытку
+        """
+        import httpx
+
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            outcome = "error"
+            final_url = url
+            await self.limiter.acquire()
+            try:
+                r = await asyncio.wait_for(
+                    self.http.get(self.endpoint, params=scrapingbee_params(url, api_key, profile), timeout=timeout + 10),
+                    timeout=timeout + 10,
+                )
+            except (httpx.TimeoutException, asyncio.TimeoutError):
+                html, err, retryable = None, f"❌ Таймаут ({timeout} сек)", True
+            except httpx.TransportError as e:
+                html, err, retryable = None, f"❌ {str(e)[:150] or type(e).__name__}", True
+            except Exception as e:
+                html, err, retryable = None, f"❌ {str(e)[:150]}", False
+            else:
+                html, err = scrapingbee_result(r)
+                final_url = r.headers.get("Spb-Resolved-Url") or url
+                retryable = r.status_code in RETRY_STATUSES
+                retry_after = r.headers.get("Retry-After")
+                if r.status_code == 429:
+                    outcome = "throttled"
+                elif r.status_code == 200:
+                    outcome = "ok"
+            finally:
+                await self.limiter.release(outcome)
+            if not retryable or attempt == self.retries:
+                return html, err, attempt + 1, final_url
+            await asyncio.sleep(self.backoff_delay(attempt, retry_after))
+
+    async def get_direct(self, url: str, timeout: int = 30) -> tuple["httpx.Response | None", str | None]:
+        """Обычный GET без ScrapingBee → (ответ 200, причина неудачи); без повторов"""
+        import httpx
+
+        timeout = min(timeout, DIRECT_TIMEOUT)
+        try:
+            r = await asyncio.wait_for(self.direct.get(url, timeout=timeout), timeout=timeout + 5)
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            return None, "таймаут"
+        except (httpx.HTTPError, ValueError) as e:
+            return None, str(e)[:150] or type(e).__name__
+        if r.status_code != 200:
+            return None, f"HTTP {r.status_code}"
+        return r, None
+
+    async def get_direct_bytes(self, url: str, max_bytes: int, timeout: int = 30) -> tuple[bytes | None, str | None]:
+        """
+        get_direct для файлов: тело ответа 200 читается потоком, не больше
+        max_bytes (распакованных) — остальное не загружается → (байты, причина неудачи)
+        """
+        import httpx
+
+        timeout = min(timeout, DIRECT_TIMEOUT)
+
+        async def read() -> tuple[bytes | None, str | None]:
+            async with self.direct.stream("GET", url, timeout=timeout) as r:
+                if r.status_code != 200:
+                    return None, f"HTTP {r.status_code}"
+                data = bytearray()
+                async for chunk in r.aiter_bytes():
+                    data += chunk
+                    if len(data) >= max_bytes:
+                        break
+                return bytes(data[:max_bytes]), None
+
+        try:
+            return await asyncio.wait_for(read(), timeout=timeout + 5)
+        except (httpx.TimeoutException, asyncio.TimeoutError):
+            return None, "таймаут"
+        except (httpx.HTTPError, ValueError) as e:
+            return None, str(e)[:150] or type(e).__name__
+
+    async def fetch_direct(self, url: str, timeout: int = 30) -> tuple[str | None, str | None, str]:
+        """Страница без ScrapingBee → (html, причина неудачи, адрес после редиректов)"""
+        r, err = await self.get_direct(url, timeout)
+        if r is None:
+            return None, err, url
+        if "html" not in r.headers.get("Content-Type", "text/html"):
+            return None, "не HTML", str(r.url)
+        return response_html(r), None, str(r.url)
+
+
+@functools.cache
+def default_scrapingbee_client() -> ScrapingBeeClient:
+    """Клиент на процесс; переживает перезапуски скрипта Streamlit и общий для сессий"""
+    return ScrapingBeeClient()
+
+
+async def fetch_rendered(
+    client: ScrapingBeeClient,
+    url: str,
+    api_key: str,
+    timeout: int = 30,
+    profiles: RenderProfiles | None = None,
+) -> tuple[str | None, str | None, int, str, int, str]:
+    """
+    Загрузка через ScrapingBee по профилю домена →
+    (html, ошибка, попыток, профиль, кредитов, адрес после редиректов).
+    Попутно пробует профиль дешевле и откатывается на "default", если дешёвый
+    профиль потерял заголовки: при "default" их больше. Страницы без заголовков
+    профиль домена не меняют. Кредиты — только за успешные ответы.
+    """
+    if profiles is None:
+        html, err, attempts, final_url = await client.fetch(url, api_key, timeout)
+        credits = render_credits(DEFAULT_RENDER_PROFILE) if html is not None else 0
+        return html, err, attempts, DEFAULT_RENDER_PROFILE, credits, final_url
+
+    loop = asyncio.get_running_loop()
+    domain = urlparse(url).netloc.lower()
+    attempts = credits = 0
+
+    probe = profiles.probe_candidate(domain, url)
+    if probe:
+        try:
+            html, err, n, final_url = await client.fetch(url, api_key, timeout, probe)
+            attempts += n
+            if html is not None:
+                credits += render_credits(probe)
+                signature, _ = await loop.run_in_executor(None, heading_signature, html)
+                if profiles.verify(domain, url, probe, signature):
+                    return html, None, attempts, probe, credits, final_url
+        finally:
+            profiles.end_probe(domain)
+
+    profile = profiles.profile(domain)
+    html, err, n, final_url = await client.fetch(url, api_key, timeout, profile)
+    attempts += n
+    if html is None:
+        return html, err, attempts, profile, credits, final_url
+    credits += render_credits(profile)
+    signature, count = await loop.run_in_executor(None, heading_signature, html)
+    if profile != DEFAULT_RENDER_PROFILE and profiles.lost_headings(domain, url, count):
+        cheap_count = count
+        profile = DEFAULT_RENDER_PROFILE
+        html, err, n, final_url = await client.fetch(url, api_key, timeout, profile)
+        attempts += n
+        if html is None:
+            return html, err, attempts, profile, credits, final_url
+        credits += render_credits(profile)
+        signature, count = await loop.run_in_executor(None, heading_signature, html)
+        if count > cheap_count:
+            profiles.reset(domain)
+    # По странице без заголовков профиль не подобрать: не эталон и не повод для отката
+    if count:
+        profiles.remember(domain, url, signature, count)
+    return html, None, attempts, profile, credits, final_url
+
+
+async def fetch_all_async(
+    client: ScrapingBeeClient,
+    urls: list[str],
+    api_key: str,
+    timeout: int = 30,
+    concurrency: int = 5,
+    on_done=None,
+    cache: HtmlCache | None = None,
+    force_refresh: bool = False,
+    stats: "RunStats | None" = None,
+    strategy: str = "auto",
+    profiles: RenderProfiles | None = None,
+    keep_html: bool = True,
+    final_urls: dict[str, str] | None = None,
+) -> dict[str, tuple[str | None, str | None]]:
+    """
+    Параллельная загрузка с ограничением числа одновременных запросов.
+    Выполняется в цикле client (см. fetch_all).
+    on_done(url, html, err) вызывается по мере готовности (в порядке завершения).
+    Исключение из on_done отменяет все незавершённые загрузки.
+    cache: страницы из кэша не загружаются повторно; force_refresh — игнорировать кэш.
+    strategy: 'auto' — сначала прямой GET, ScrapingBee с JS-рендером только для
+    JS-оболочек и при ошибке; 'render' — всегда через ScrapingBee.
+    profiles: подбирать настройки ScrapingBee по домену (см. RenderProfiles).
+    keep_html=False: HTML отдаётся только в on_done, в результате — None
+    (страницы не копятся в памяти до конца загрузки).
+    Написания одного адреса (canonical_url) загружаются один раз, а загрузка,
+    которая уже идёт в этом клиенте, не повторяется (ScrapingBeeClient.single_flight);
+    сэкономленные запросы и кредиты — в stats (record_shared).
+    final_urls: сюда пишется адрес страницы после редиректов, если он другой
+    (для ссылок страницы, см. crawl_site); в кэше хранится рядом с HTML.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    results: dict[str, tuple[str | None, str | None]] = {}
+
+    def cache_key(key: str, redirect: bool = False) -> str:
+        # Параметры запроса к ScrapingBee (API-ключ HtmlCache.key отбрасывает) плюс то,
+        # что ещё меняет загруженный HTML: стратегия и подбор профиля по домену
+        return cache.key({
+            **scrapingbee_params(key, api_key),
+            "fetch": strategy,
+            "profiles": "true" if profiles is not None else "false",
+            **({"redirect": "1"} if redirect else {}),
+        })
+
+    spellings: dict[str, list[str]] = defaultdict(list)   # canonical_url → написания в порядке ввода
+    for url in dict.fromkeys(urls):
+        spellings[canonical_url(url)].append(url)
+
+    pending = []
+    for key, names in spellings.items():
+        html = None
+        t0 = time.perf_counter()
+        if cache is not None and not force_refresh:
+            html = cache.get(cache_key(key))
+        if html is None:
+            pending.append(key)
+            continue
+        final_url = cache.get(cache_key(key, redirect=True), count=False) if final_urls is not None else None
+        for url in names:
+            if final_url and final_url != url:
+                final_urls[url] = final_url
+            results[url] = (html if keep_html else None, None)
+            if stats is not None:
+                stats.record_fetch(url, time.perf_counter() - t0, html, None, "cache")
+            if on_done:
+                on_done(url, html, None)
+
+    async def load(url: str) -> dict:
+        """Загрузка одной страницы → html, ошибка и её цена (запросов, кредитов)"""
+        escalated = None
+        if strategy == "auto":
+            html, direct_err, final_url = await client.fetch_direct(url, timeout)
+            escalated = direct_err or js_shell_reason(html)
+            if escalated is None:
+                return {"html": html, "err": None, "source": "direct", "attempts": 1, "escalated": None,
+                        "profile": None, "requests": 1, "credits": 0, "final_url": final_url}
+        html, err, attempts, profile, credits, final_url = await fetch_rendered(client, url, api_key, timeout, profiles)
+        return {"html": html, "err": err, "source": "scrapingbee", "attempts": attempts, "escalated": escalated,
+                "profile": profile, "requests": attempts + (strategy == "auto"), "credits": credits,
+                "final_url": final_url}
+
+    async def one(key: str):
+        async with sem:
+            t0 = time.perf_counter()
+            flight = (key, strategy, profiles is not None, api_key)
+            got, shared = await client.single_flight(flight, lambda: load(spellings[key][0]))
+            return key, got, shared, time.perf_counter() - t0
+
+    tasks = [asyncio.create_task(one(key)) for key in pending]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            key, got, shared, seconds = await fut
+            html, err, final_url = got["html"], got["err"], got["final_url"]
+            redirected = html is not None and final_url != spellings[key][0]
+            if cache is not None and html is not None:
+                cache.put(cache_key(key), html)
+                if redirected:
+                    cache.put(cache_key(key, redirect=True), final_url)
+            for i, url in enumerate(spellings[key]):
+                if final_urls is not None and redirected:
+                    final_urls[url] = final_url
+                results[url] = (html if keep_html else None, err)
+                if stats is not None:
+                    if shared or i:
+                        stats.record_shared(url, seconds, html, err, got["requests"], got["credits"])
+                    else:
+                        stats.record_fetch(url, seconds, html, err, got["source"], got["attempts"],
+                                           got["escalated"], got["profile"], got["credits"])
+                if on_done:
+                    on_done(url, html, err)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    return results
+
+
+def fetch_all(
+    urls: list[str],
+    api_key: str,
+    timeout: int = 30,
+    concurrency: int = 5,
+    on_done=None,
+    cache: HtmlCache | None = None,
+    force_refresh: bool = False,
+    stats: "RunStats | None" = None,
+    client: ScrapingBeeClient | None = None,
+    strategy: str = "auto",
+    profiles: RenderProfiles | None = None,
+    on_idle=None,
+    keep_html: bool = True,
+    final_urls: dict[str, str] | None = None,
+) -> dict[str, tuple[str | None, str | None]]:
+    """
+    Синхронная обёртка над fetch_all_async (для скрипта Streamlit).
+    Загрузка идёт в цикле клиента, а on_done вызывается в текущем потоке —
+    вызовы st.* работают только из потока скрипта.
+    on_idle() вызывается в том же потоке, пока новых страниц нет (раз в 0.1 сек).
+    """
+    client = client or default_scrapingbee_client()
+    done_q: queue.Queue = queue.Queue()
+    fut = client.submit(fetch_all_async(
+        client, urls, api_key, timeout, concurrency,
+        lambda *item: done_q.put(item), cache, force_refresh, stats, strategy, profiles, keep_html, final_urls,
+    ))
+    try:
+        while True:
+            try:
+                item = done_q.get(timeout=0.1)
+            except queue.Empty:
+                if fut.done() and done_q.empty():
+                    break
+                if on_idle:
+                    on_idle()
+                continue
+            if on_done:
+                on_done(*item)
+        return fut.result()
+    finally:
+        fut.cancel()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ПАРСИНГ HTML → БЛОКИ
+# ═══════════════════════════════════════════════════════════════════════════════
+HEADING_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6")
+JUNK_TAGS = ("script", "style", "noscript", "svg", "meta", "link")
+INNER_JUNK_TAGS = ("header", "footer", "nav")   # вырезаются в режиме 'inner'
+BLOCK_TAGS = ("section", "div", "article", "main", "aside")
+
+# Индексы счётчиков в векторе признаков элемента
+F_TEXT_LEN, F_TEXT_PARTS, F_BUTTONS, F_LINKS_CTA, F_FORMS, F_LISTS, \
+    F_IFRAMES, F_VIDEOS, F_TABLES, F_IMAGES, F_FAQ = range(11)
+N_FEATURES = 11
+
+FEATURE_BY_TAG = {
+    "button": F_BUTTONS, "form": F_FORMS, "ul": F_LISTS, "ol": F_LISTS,
+    "iframe": F_IFRAMES, "video": F_VIDEOS, "table": F_TABLES, "img": F_IMAGES,
+}
+
+
+def is_faq_schema(script_text: str | None) -> bool:
+    """Содержимое <script type="application/ld+json"> с разметкой FAQPage"""
+    try:
+        data = json.loads(script_text or "")
+        items = [data] if isinstance(data, dict) else (data if isinstance(data, list) else [])
+        return any(isinstance(item, dict) and item.get("@type") == "FAQPage" for item in items)
+    except Exception:
+        return False
+
+
+# ─── Отпечаток текста блока (SimHash) ─────────────────────────────────────────
+# Признаки — строки текста блока (текстовые узлы) с весом по длине, каждый бит
+# отпечатка — взвешенное голосование большинства по их хэшам. Блоки шаблона
+# повторяют одни и те же строки, поэтому их отпечатки отличаются в нескольких
+# битах и почти-дубли ищутся без попарного сравнения текстов. Строка хэшируется
+# при обходе, сам текст не хранится.
+SIMHASH_MIN_TEXT = 80         # блоки короче (симв.) не получают отпечатка и не сравниваются
+SIMHASH_PIECE_CHARS = 64      # символов начала строки в её хэше (плюс длина строки)
+SIMHASH_CHUNK_PIECES = 256    # строк на один проход (матрица голосов — 64 КБ)
+
+
+def piece_key(text: str) -> int:
+    """
+    Строка текста → признак SimHash: crc32 её начала и длина (она же вес),
+    одинаковые во всех процессах (в отличие от hash())
+    """
+    return zlib.crc32(text[:SIMHASH_PIECE_CHARS].encode("utf-8", "surrogatepass")) << 32 | len(text)
+
+
+def mix64(x: "np.ndarray") -> "np.ndarray":
+    """Перемешивание бит (финализатор splitmix64) — 64 независимых бита из признака"""
+    import numpy as np
+
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def text_simhashes(pieces: array, spans: list[tuple[int, int] | None]) -> list[int]:
+    """
+    SimHash текста блоков. pieces — array("Q") признаков (piece_key) строк текста
+    страницы в порядке учёта при обходе: строки элемента идут подряд; spans —
+    (от, до) строк каждого блока, None — блок без отпечатка. Голоса по битам
+    считаются нарастающим итогом на границах блоков, так что вложенные блоки не
+    считаются заново, а порядок строк не влияет на отпечаток. 0 — в блоке нет
+    текста. Знаковое int64, как INTEGER в SQLite.
+    """
+    import numpy as np
+
+    rows = [i for i, span in enumerate(spans) if span is not None]
+    fingerprints = [0] * len(spans)
+    if not rows:
+        return fingerprints
+    edges, inverse = np.unique(np.array([spans[i] for i in rows], dtype=np.int64).ravel(), return_inverse=True)
+    # Строки до первой и после последней границы ни в один блок не входят
+    keys = np.frombuffer(pieces, dtype=np.uint64)[edges[0]:edges[-1]] if len(pieces) else np.zeros(0, dtype=np.uint64)
+    edges = edges - edges[0]
+    votes = np.zeros((len(edges), 64), dtype=np.int32)    # взвешенные суммы бит строк до границы
+    weights = np.zeros(len(edges), dtype=np.int64)        # суммарный вес этих строк
+    total = np.zeros(64, dtype=np.int32)
+    total_weight = 0
+    for first in range(0, len(keys), SIMHASH_CHUNK_PIECES):
+        chunk = keys[first:first + SIMHASH_CHUNK_PIECES]
+        w = (chunk & np.uint64(0xFFFFFFFF)).astype(np.int32)   # вес — длина строки, она меньше MAX_HTML_CHARS
+        bits = np.unpackbits(mix64(chunk).astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+        prefix = np.cumsum(bits * w[:, None], axis=0, dtype=np.int32)
+        lo, hi = np.searchsorted(edges, (first, first + len(chunk)))
+        local = edges[lo:hi] - first        # сколько строк куска до границы
+        votes[lo:hi] = total + np.where(local[:, None] > 0, prefix[np.maximum(local - 1, 0)], 0)
+        cum_w = np.cumsum(w, dtype=np.int64)
+        weights[lo:hi] = total_weight + np.where(local > 0, cum_w[np.maximum(local - 1, 0)], 0)
+        total += prefix[-1]
+        total_weight += int(cum_w[-1])
+    votes[-1] = total                       # последняя граница — конец строк
+    weights[-1] = total_weight
+
+    start, end = inverse[0::2], inverse[1::2]
+    bits = (votes[end] - votes[start]) * 2 > (weights[end] - weights[start])[:, None]
+    for i, fp in zip(rows, np.packbits(bits, axis=1, bitorder="little").view("<i8")[:, 0].tolist()):
+        fingerprints[i] = fp
+    return fingerprints
+
+
+def collect_features(root) -> tuple[list, dict[int, list[int]], array, dict[int, tuple[int, int]]]:
+    """
+    Один обход дерева: заголовки в порядке документа и для каждого тега
+    суммы признаков по его потомкам (сам тег не учитывается — как в find_all).
+    Текст считается как get_text(separator=" ", strip=True): сумма длин
+    непустых строк + пробелы между ними. Ещё — признаки строк текста (piece_key)
+    в порядке учёта и (от, до) строк для тегов, которые могут стать блоком
+    (BLOCK_TAGS и родители заголовков, см. find_block_element).
+    """
+    from bs4 import Tag
+
+    headings = []
+    desc: dict[int, list[int]] = {}
+    pieces = array("Q")
+    spans: dict[int, tuple[int, int]] = {}
+    heading_parents = set()
+    # Стек: (тег, None или — когда потомки уже обработаны — номер его первой строки в pieces)
+    stack = [(root, None)]
+    while stack:
+        tag, start = stack.pop()
+        if start is None:
+            if tag.name in HEADING_TAGS:
+                headings.append(tag)
+                heading_parents.add(id(tag.parent))
+            stack.append((tag, len(pieces)))
+            stack.extend((child, None) for child in reversed(tag.contents) if isinstance(child, Tag))
+            continue
+
+        acc = [0] * N_FEATURES
+        for child in tag.contents:
+            if isinstance(child, Tag):
+                sub = desc[id(child)]
+                for i in range(N_FEATURES):
+                    acc[i] += sub[i]
+                # Сам дочерний тег
+                feature = FEATURE_BY_TAG.get(child.name)
+                if feature is not None:
+                    acc[feature] += 1
+                elif child.name == "a":
+                    # <a> с текстом короче 60 символов = a.get_text(strip=True)
+                    if 0 < sub[F_TEXT_LEN] < 60:
+                        acc[F_LINKS_CTA] += 1
+                elif child.name == "script" and child.get("type") == "application/ld+json":
+                    if is_faq_schema(child.string):
+                        acc[F_FAQ] += 1
+            elif type(child) in Tag.MAIN_CONTENT_STRING_TYPES:
+                stripped = child.strip()
+                if stripped:
+                    acc[F_TEXT_LEN] += len(stripped)
+                    acc[F_TEXT_PARTS] += 1
+                    pieces.append(piece_key(stripped))
+        desc[id(tag)] = acc
+        if tag.name in BLOCK_TAGS or id(tag) in heading_parents:
+            spans[id(tag)] = (start, len(pieces))
+    return headings, desc, pieces, spans
+
+
+def find_block_element(heading, parent_of, name_of):
+    """Ближайший родительский section/div/article (не выше 8 уровней)"""
+    current = parent_of(heading)
+    for _ in range(8):
+        if current is None or name_of(current) in ("body", "html", "[document]"):
+            return parent_of(heading)
+        if name_of(current) in BLOCK_TAGS:
+            return current
+        current = parent_of(current)
+    return parent_of(heading)
+
+
+XML_DECLARATION = re.compile(r"<\?xml[^>]*\?>")
+
+
+def strip_xml_declaration(html: str) -> str:
+    """
+    XHTML без начального <?xml ... encoding="..."?>: lxml не разбирает str с
+    объявлением кодировки (ValueError), а текст уже декодирован
+    """
+    m = XML_DECLARATION.match(html)
+    return html[m.end():] if m else html
+
+
+LONE_SURROGATES = re.compile("[\ud800-\udfff]")
+
+
+def replace_surrogates(html: str) -> str:
+    """Одиночные суррогаты (битые символы после декодирования) → U+FFFD: в UTF-8 их не закодировать"""
+    return LONE_SURROGATES.sub("\ufffd", html)
+
+
+def html_document(html: str):
+    """
+    Дерево lxml.html документа; ParserError — пустой документ.
+    На одиночном суррогате lxml молча обрывает документ (фатальная
+    ERR_INVALID_ENCODING в журнале парсера) — тогда разбор повторяется с U+FFFD.
+    """
+    import lxml.html
+    from lxml import etree
+
+    html = strip_xml_declaration(html)
+    # Обычный etree-парсер (без поиска классов HtmlElement на каждый узел);
+    # парсеры lxml нельзя делить между потоками, поэтому новый на вызов
+    parser = etree.HTMLParser()
+    doc = lxml.html.document_fromstring(html, parser=parser)
+    if any(e.type == etree.ErrorTypes.ERR_INVALID_ENCODING for e in parser.error_log.filter_from_fatals()):
+        doc = lxml.html.document_fromstring(replace_surrogates(html), parser=etree.HTMLParser())
+    return doc
+
+
+def parse_blocks_bs4(html: str, mode: str) -> list[tuple[str, int, int, list[int], int]]:
+    """BeautifulSoup: (заголовок, уровень, длина текста блока, признаки блока, SimHash его текста)"""
+    from bs4 import BeautifulSoup, Tag
+
+    html = strip_xml_declaration(html)   # иначе XMLParsedAsHTMLWarning
+    try:
+        soup = BeautifulSoup(html, "lxml")
+    except UnicodeEncodeError:   # одиночные суррогаты
+        soup = BeautifulSoup(replace_surrogates(html), "lxml")
+
+    # Убираем мусор
+    for tag in soup(JUNK_TAGS):
+        tag.decompose()
+
+    body = soup.find("body") or soup
+
+    if mode == "inner":
+        for rem in body.find_all(INNER_JUNK_TAGS):
+            rem.decompose()
+
+    headings, features, pieces, spans = collect_features(body)
+    raw = []
+    block_spans = []
+    seen_ids = set()
+
+    for heading in headings:
+        heading_text = heading.get_text(strip=True)
+        if not heading_text or len(heading_text) < 2:
+            continue
+
+        block_el = find_block_element(heading, lambda el: el.parent, lambda el: el.name)
+
+        el_id = id(block_el)
+        if el_id in seen_ids:
+            continue
+        seen_ids.add(el_id)
+
+        f = features[el_id]
+        if block_el.interesting_string_types == Tag.MAIN_CONTENT_STRING_TYPES:
+            text_len = f[F_TEXT_LEN] + max(f[F_TEXT_PARTS] - 1, 0)
+        else:
+            # template/rt/rp: у get_text свой набор типов строк
+            text_len = len(block_el.get_text(separator=" ", strip=True))
+
+        raw.append((heading_text, int(heading.name[1]), text_len, f))
+        block_spans.append(spans[el_id] if text_len >= SIMHASH_MIN_TEXT else None)
+
+    return [(*r, fingerprint) for r, fingerprint in zip(raw, text_simhashes(pieces, block_spans))]
+
+
+# Строки внутри этих тегов BeautifulSoup не считает текстом страницы
+NON_CONTENT_TEXT_TAGS = frozenset(("template", "rt", "rp", "script", "style"))
+
+
+@functools.cache
+def content_text_xpath(mode: str) -> "etree.XPath":
+    """Текстовые узлы вне template/rt/rp и вырезанных в режиме тегов; XPath компилируется один раз"""
+    from lxml import etree
+
+    tags = sorted(NON_CONTENT_TEXT_TAGS | set(JUNK_TAGS + INNER_JUNK_TAGS if mode == "inner" else JUNK_TAGS))
+    return etree.XPath(".//text()[not(" + " or ".join(f"ancestor::{t}" for t in tags) + ")]")
+
+
+def collect_features_lxml(root, junk_tags: frozenset) -> tuple[list, dict, array, dict]:
+    """
+    collect_features для дерева lxml: обход iterwalk (на C), признаки
+    считаются в событии end по дочерним узлам, включая хвосты комментариев.
+    Теги из junk_tags не удаляются из дерева (drop_tree склеил бы соседние
+    строки), а пропускаются целиком — учитывается только их хвост.
+    """
+    from lxml import etree
+
+    headings = []
+    desc: dict = {}
+    pieces = array("Q")
+    spans: dict = {}
+    heading_parents = set()
+    starts: list[int] = []   # номер первой строки в pieces для открытых элементов
+    skip_text = 0   # глубина внутри template/rt/rp
+    walker = etree.iterwalk(root, events=("start", "end"))
+    for event, el in walker:
+        tag = el.tag
+        if tag in junk_tags:
+            if event == "start":
+                walker.skip_subtree()
+            continue
+        if event == "start":
+            starts.append(len(pieces))
+            if tag in HEADING_TAGS:
+                headings.append(el)
+                heading_parents.add(el.getparent())
+            if tag in NON_CONTENT_TEXT_TAGS:
+                skip_text += 1
+            continue
+
+        acc = [0] * N_FEATURES
+        if not skip_text:
+            stripped = (el.text or "").strip()
+            if stripped:
+                acc[F_TEXT_LEN] += len(stripped)
+                acc[F_TEXT_PARTS] += 1
+                pieces.append(piece_key(stripped))
+        for child in el:
+            child_tag = child.tag
+            if isinstance(child_tag, str) and child_tag not in junk_tags:
+                sub = desc[child]
+                acc = [a + b for a, b in zip(acc, sub)]
+                feature = FEATURE_BY_TAG.get(child_tag)
+                if feature is not None:
+                    acc[feature] += 1
+                elif child_tag == "a":
+                    if 0 < sub[F_TEXT_LEN] < 60:
+                        acc[F_LINKS_CTA] += 1
+                elif child_tag == "script" and child.get("type") == "application/ld+json":
+                    if is_faq_schema(child.text):
+                        acc[F_FAQ] += 1
+            if not skip_text:
+                stripped = (child.tail or "").strip()
+                if stripped:
+                    acc[F_TEXT_LEN] += len(stripped)
+                    acc[F_TEXT_PARTS] += 1
+                    pieces.append(piece_key(stripped))
+        desc[el] = acc
+        start = starts.pop()
+        if tag in BLOCK_TAGS or el in heading_parents:
+            spans[el] = (start, len(pieces))
+        if tag in NON_CONTENT_TEXT_TAGS:
+            skip_text -= 1
+    return headings, desc, pieces, spans
+
+
+def parse_blocks_lxml(html: str, mode: str) -> list[tuple[str, int, int, list[int], int]]:
+    """lxml.html напрямую: то же, что parse_blocks_bs4, без дерева BeautifulSoup"""
+    from lxml import etree
+
+    try:
+        doc = html_document(html)
+    except etree.ParserError:   # пустой документ
+        return []
+
+    body = doc.find(".//body")
+    if body is None:
+        body = doc
+
+    # Мусор пропускается при обходе, см. collect_features_lxml
+    junk_tags = frozenset(JUNK_TAGS + INNER_JUNK_TAGS if mode == "inner" else JUNK_TAGS)
+    headings, features, pieces, spans = collect_features_lxml(body, junk_tags)
+    content_text = content_text_xpath("inner" if mode == "inner" else "main")
+    raw = []
+    block_spans = []
+    seen = set()
+
+    for heading in headings:
+        heading_text = "".join(t.strip() for t in content_text(heading))
+        if len(heading_text) < 2:
+            continue
+
+        block_el = find_block_element(heading, lambda el: el.getparent(), lambda el: el.tag)
+
+        if block_el in seen:
+            continue
+        seen.add(block_el)
+
+        f = features[block_el]
+        text_len = f[F_TEXT_LEN] + max(f[F_TEXT_PARTS] - 1, 0)
+        raw.append((heading_text, int(heading.tag[1]), text_len, f))
+        block_spans.append(spans[block_el] if text_len >= SIMHASH_MIN_TEXT else None)
+
+    del features, spans   # признаки всех элементов больше не нужны — память под SimHash
+    return [(*r, fingerprint) for r, fingerprint in zip(raw, text_simhashes(pieces, block_spans))]
+
+
+STREAM_CHUNK_CHARS = 64 * 1024   # символов HTML на один feed() потокового разбора
+
+
+def parse_blocks_stream(html: str, mode: str) -> list[tuple[str, int, int, list[int], int]]:
+    """
+    То же, что parse_blocks_lxml, но без дерева всего документа в памяти:
+    HTMLPullParser получает HTML кусками, признаки элемента считаются в его
+    событии end, после чего учтённые дочерние узлы удаляются из дерева.
+    В памяти остаются путь от body до текущего узла и его ещё не учтённые
+    соседи; поддеревья заголовков не удаляются до их конца — из них берётся текст.
+    Признаки строк текста (piece_key) копятся в общем массиве: строки элемента —
+    те, что учтены между его началом и концом, по ним считается SimHash блока.
+    """
+    from lxml import etree
+
+    junk_tags = frozenset(JUNK_TAGS + INNER_JUNK_TAGS if mode == "inner" else JUNK_TAGS)
+    content_text = content_text_xpath("inner" if mode == "inner" else "main")
+    parser = etree.HTMLPullParser(events=("start", "end"))
+
+    # Открытый элемент → [признаки, текст не считается (template/rt/rp/...), учтено детей,
+    # номер первой его строки в pieces]
+    open_state: dict = {}
+    pieces = array("Q")        # признаки учтённых строк текста в порядке учёта
+    done: dict = {}            # закрытый, но ещё не учтённый родителем элемент → признаки
+    headings: list[list] = []  # [текст, уровень, номер блока] в порядке начала заголовков
+    open_headings: dict = {}   # открытый заголовок → индекс в headings
+    blocks: dict = {}          # открытый блок заголовка → номер блока
+    block_features: list = []  # номер блока → (признаки, от, до его строк в pieces) после его конца
+    in_body = False
+    body_done = False          # второй <body> (libxml2 оставляет его отдельным) другие движки не читают
+    junk_depth = 0
+
+    def consume(parent, upto: int):
+        """Учитывает в признаках parent его детей до upto и удаляет их из дерева"""
+        acc, skip_text, start, _ = open_state[parent]
+        for child in parent[start:upto]:
+            child_tag = child.tag
+            if isinstance(child_tag, str) and child_tag not in junk_tags:
+                sub = done.pop(child)
+                for i in range(N_FEATURES):
+                    acc[i] += sub[i]
+                feature = FEATURE_BY_TAG.get(child_tag)
+                if feature is not None:
+                    acc[feature] += 1
+                elif child_tag == "a":
+                    if 0 < sub[F_TEXT_LEN] < 60:
+                        acc[F_LINKS_CTA] += 1
+                elif child_tag == "script" and child.get("type") == "application/ld+json":
+                    if is_faq_schema(child.text):
+                        acc[F_FAQ] += 1
+            if not skip_text:
+                stripped = (child.tail or "").strip()
+                if stripped:
+                    acc[F_TEXT_LEN] += len(stripped)
+                    acc[F_TEXT_PARTS] += 1
+                    pieces.append(piece_key(stripped))
+        if open_headings:
+            open_state[parent][2] = upto      # внутри заголовка дерево нужно целиком
+        else:
+            del parent[start:upto]
+
+    def handle(event: str, el):
+        nonlocal in_body, body_done, junk_depth
+        tag = el.tag
+        if not in_body:
+            if event == "start" and tag == "body" and not body_done:
+                in_body = True
+                open_state[el] = [[0] * N_FEATURES, False, 0, len(pieces)]
+            return
+        if junk_depth:
+            junk_depth += 1 if event == "start" else -1
+            if not junk_depth:
+                del el[:]
+                el.text = None
+            return
+        if event == "start":
+            if tag in junk_tags:
+                junk_depth = 1
+                return
+            parent = el.getparent()
+            skip_text = open_state[parent][1] or tag in NON_CONTENT_TEXT_TAGS
+            open_state[el] = [[0] * N_FEATURES, skip_text, 0, len(pieces)]
+            if tag in HEADING_TAGS:
+                block_el = find_block_element(el, lambda e: e.getparent(), lambda e: e.tag)
+                if block_el not in blocks:
+                    blocks[block_el] = len(block_features)
+                    block_features.append(None)
+                open_headings[el] = len(headings)
+                headings.append([None, int(tag[1]), blocks[block_el]])
+            return
+
+        if tag in junk_tags:
+            return
+        if el in open_headings:
+            headings[open_headings.pop(el)][0] = "".join(t.strip() for t in content_text(el))
+        acc, skip_text, _, text_start = open_state[el]
+        if not skip_text:
+            stripped = (el.text or "").strip()
+            if stripped:
+                acc[F_TEXT_LEN] += len(stripped)
+                acc[F_TEXT_PARTS] += 1
+                pieces.append(piece_key(stripped))
+        consume(el, len(el))
+        del open_state[el]
+        if el in blocks:
+            block_features[blocks.pop(el)] = (acc, text_start, len(pieces))
+        if tag == "body":
+            in_body = False
+            body_done = True
+            return
+        done[el] = acc
+        # Предыдущие соседи закрыты вместе с хвостами — их можно учесть и удалить
+        parent = el.getparent()
+        consume(parent, parent.index(el, open_state[parent][2]))
+
+    try:
+        for start in range(0, len(html), STREAM_CHUNK_CHARS):
+            chunk = html[start:start + STREAM_CHUNK_CHARS]
+            try:
+                parser.feed(chunk)
+            except UnicodeEncodeError:   # одиночные суррогаты: кусок не попал в парсер целиком
+                parser.feed(replace_surrogates(chunk))
+            for event, el in parser.read_events():
+                handle(event, el)
+        parser.close()
+        for event, el in parser.read_events():
+            handle(event, el)
+    except (etree.ParserError, etree.XMLSyntaxError, ValueError):
+        return []
+
+    raw = []
+    block_spans = []
+    seen = set()
+    for heading_text, level, block_no in headings:
+        if heading_text is None or len(heading_text) < 2 or block_no in seen:
+            continue
+        seen.add(block_no)
+        if block_features[block_no] is None:
+            continue
+        f, text_start, text_end = block_features[block_no]
+        text_len = f[F_TEXT_LEN] + max(f[F_TEXT_PARTS] - 1, 0)
+        raw.append((heading_text, level, text_len, f))
+        block_spans.append((text_start, text_end) if text_len >= SIMHASH_MIN_TEXT else None)
+    return [(*r, fingerprint) for r, fingerprint in zip(raw, text_simhashes(pieces, block_spans))]
+
+
+PARSE_ENGINES = {
+    "bs4": parse_blocks_bs4,
+    "lxml": parse_blocks_lxml,
+    "stream": parse_blocks_stream,
+}
+
+
+def block_dicts(raw: list[tuple[str, int, int, list[int], int]]) -> list[dict]:
+    """Результат движка парсинга → словари блоков (без группы)"""
+    blocks = []
+    for heading_text, level, text_len, f, fingerprint in raw:
+        blocks.append({
+            "heading": heading_text,
+            "level": level,
+            "text_len": text_len,
+            "buttons": f[F_BUTTONS] + f[F_LINKS_CTA],   # <button> + <a> с текстом
+            "has_form": bool(f[F_FORMS]),
+            "has_list": bool(f[F_LISTS]),
+            "has_iframe": bool(f[F_IFRAMES]),
+            "has_video": bool(f[F_VIDEOS]),
+            "has_table": bool(f[F_TABLES]),
+            "images": f[F_IMAGES],
+            "has_faq_schema": bool(f[F_FAQ]),
+            "simhash": fingerprint,
+        })
+    return blocks
+
+
+def group_blocks(blocks: list[dict]) -> list[dict]:
+    """Проставляет семантическую группу всем блокам (на месте)"""
+    for b, group in zip(blocks, assign_groups([b["heading"] for b in blocks])):
+        b["group"] = group
+    return blocks
+
+
+def extract_blocks(html: str, mode: str, engine: str = "bs4") -> list[dict]:
+    """
+    Возвращает список блоков с метаданными.
+    mode: 'main' | 'inner'
+    engine: 'bs4' | 'lxml' | 'stream' — результат одинаковый (tests/test_parity.py), lxml в разы быстрее
+    """
+    return group_blocks(block_dicts(PARSE_ENGINES[engine](html, mode)))
+
+
+def extract_blocks_timed(
+    html: str, mode: str, engine: str = "bs4", measure_mem: bool = False,
+) -> tuple[list[dict], float, float, int | None]:
+    """
+    extract_blocks + время разбора и группировки в секундах и прирост пикового
+    RSS при разборе (measure_mem, иначе None)
+    """
+    t0 = time.perf_counter()
+    if measure_mem:
+        with PeakRss() as mem:
+            blocks = block_dicts(PARSE_ENGINES[engine](html, mode))
+        peak = mem.peak
+    else:
+        blocks, peak = block_dicts(PARSE_ENGINES[engine](html, mode)), None
+    t1 = time.perf_counter()
+    group_blocks(blocks)
+    return blocks, t1 - t0, time.perf_counter() - t1, peak
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ОГРАНИЧЕНИЕ ПАМЯТИ ПРИ РАЗБОРЕ (обрезка, потоковый разбор, замер RSS)
+# ═══════════════════════════════════════════════════════════════════════════════
+MAX_HTML_CHARS = 10 * 1024 * 1024    # длиннее — страница обрезается перед разбором
+STREAM_MIN_CHARS = 1024 * 1024       # длиннее — разбор потоковый при любом движке и замер RSS
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def truncate_html(html: str, max_chars: int = MAX_HTML_CHARS) -> tuple[str, bool]:
+    """Первые max_chars символов, по границе тега (незакрытые теги lxml закроет сам)"""
+    if len(html) <= max_chars:
+        return html, False
+    cut = html.rfind("<", 0, max_chars)
+    return html[:cut if cut > 0 else max_chars], True
+
+
+def rss_bytes() -> int | None:
+    """Текущий RSS процесса по /proc (Linux); None — недоступно"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakRss:
+    """
+    Прирост пикового RSS за время блока with: фоновый поток раз в interval
+    читает RSS. peak — байты сверх RSS на входе, None — RSS недоступен.
+    Замер на весь процесс: параллельная загрузка тоже в него попадает, поэтому
+    PageParser меряет только страницы от STREAM_MIN_CHARS — они почти всегда
+    уходят в пул, где процесс разбирает одну страницу.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.start = self.top = self.peak = None
+
+    def __enter__(self):
+        self.start = self.top = rss_bytes()
+        if self.start is not None:
+            self.stop = threading.Event()
+            self.thread = threading.Thread(target=self._sample, name="rss", daemon=True)
+            self.thread.start()
+        return self
+
+    def _sample(self):
+        while not self.stop.wait(self.interval):
+            self.top = max(self.top, rss_bytes() or 0)
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            self.stop.set()
+            self.thread.join()
+            self.peak = max(self.top, rss_bytes() or 0) - self.start
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ПАМЯТЬ РАЗОБРАННЫХ БЛОКОВ (HTML + режим → блоки, группы — по версии словаря)
+# ═══════════════════════════════════════════════════════════════════════════════
+MEMO_MAX_BLOCKS = 200_000   # блоков во всех записях (~100 МБ словарей)
+
+
+def synonym_fingerprint(groups: dict[str, list[str]]) -> str:
+    """Версия словаря синонимов: меняется при любой правке SYNONYM_GROUPS"""
+    return hashlib.sha1(json.dumps(groups, ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:12]
+
+
+SYNONYM_FINGERPRINT = synonym_fingerprint(SYNONYM_GROUPS)
+
+
+class BlockMemo:
+    """
+    LRU-память разобранных страниц: (sha1 HTML, режим) → блоки без группы
+    и списки групп по версиям словаря. Общая для сессий (см. default_block_memo
+    в app.py), поэтому только хранит данные: группирует вызывающий код — у объекта
+    из st.cache_resource после правки engine.py остаётся код старой версии модуля.
+    """
+
+    def __init__(self, max_blocks: int = MEMO_MAX_BLOCKS):
+        self.max_blocks = max_blocks
+        self.entries: OrderedDict[tuple[str, str], dict] = OrderedDict()
+        self.n_blocks = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(html: str, mode: str) -> tuple[str, str]:
+        return hashlib.sha1(html.encode("utf-8", "surrogatepass")).hexdigest(), mode
+
+    def get(self, key: tuple[str, str], fingerprint: str) -> tuple[list[dict], list[str] | None] | None:
+        """(блоки без группы, группы для этой версии словаря или None) либо None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["raw"], entry["groups"].get(fingerprint)
+
+    def put(self, key: tuple[str, str], fingerprint: str, blocks: list[dict]):
+        raw = [{k: v for k, v in b.items() if k != "group"} for b in blocks]
+        entry = {"raw": raw, "groups": {fingerprint: [b["group"] for b in blocks]}}
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.n_blocks -= len(old["raw"])
+            self.entries[key] = entry
+            self.n_blocks += len(raw)
+            while self.n_blocks > self.max_blocks and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.n_blocks -= len(evicted["raw"])
+
+    def put_groups(self, key: tuple[str, str], fingerprint: str, groups: list[str]):
+        """Группы по новой версии словаря; старые версии больше не нужны"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry["groups"] = {fingerprint: groups}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ПАРАЛЛЕЛЬНЫЙ ПАРСИНГ (пул процессов)
+# ═══════════════════════════════════════════════════════════════════════════════
+PARSE_POOL_MIN_BYTES = 1024 * 1024   # меньше суммарно — парсим в текущем процессе
+PARSE_POOL_PAGE_BYTES = 256 * 1024   # при разборе по мере загрузки — меньше разбираем сразу
+
+
+class PageParser:
+    """
+    Разбор страниц по мере поступления. submit() сразу возвращает то, что
+    готово без пула (страницы из памяти блоков и мелкие), крупные страницы
+    уходят в ProcessPoolExecutor — их результаты забираются poll() и drain().
+    Если пул упал (нехватка памяти, ошибка сериализации), страницы
+    дорабатываются в текущем процессе. Страницы длиннее max_chars обрезаются,
+    длиннее STREAM_MIN_CHARS — разбираются потоково (parse_blocks_stream), и
+    только для них замеряется прирост RSS.
+    Страница с тем же HTML, что уже разбирается в пуле, ждёт тот же результат.
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        engine: str = "lxml",
+        workers: int | None = None,
+        stats: "RunStats | None" = None,
+        memo: BlockMemo | None = None,
+        pool_min_bytes: int = PARSE_POOL_PAGE_BYTES,
+        max_chars: int = MAX_HTML_CHARS,
+    ):
+        self.mode = mode
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = stats
+        self.memo = memo
+        self.pool_min_bytes = pool_min_bytes
+        self.max_chars = max_chars
+        self.truncated: set[str] = set()
+        self.pool: concurrent.futures.ProcessPoolExecutor | None = None
+        self.pending: dict[concurrent.futures.Future, tuple[str, str]] = {}
+        self.keys: dict[str, tuple[str, str]] = {}
+        self.waiting: dict[tuple[str, str], list[str]] = {}   # ключ HTML в пуле → ещё страницы с ним
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def _done(self, url: str, result: tuple[list[dict], float, float, int | None]) -> tuple[str, list[dict]]:
+        blocks, parse_s, group_s, mem = result
+        if self.memo is not None:
+            self.memo.put(self.keys[url], SYNONYM_FINGERPRINT, blocks)
+        if self.stats is not None:
+            self.stats.record_parse(url, parse_s, group_s, blocks, mem=mem, truncated=url in self.truncated)
+        return url, blocks
+
+    def _task(self, html: str) -> tuple[str, str, str, bool]:
+        """Аргументы extract_blocks_timed для страницы"""
+        large = len(html) >= STREAM_MIN_CHARS
+        return html, self.mode, "stream" if large else self.engine, large
+
+    def _from_memo(self, url: str, html: str) -> list[dict] | None:
+        """Блоки уже разобранной страницы; при смене словаря — только перегруппировка"""
+        key = self.keys[url] = self.memo.key(html, self.mode)
+        hit = self.memo.get(key, SYNONYM_FINGERPRINT)
+        if hit is None:
+            return None
+        t0 = time.perf_counter()
+        raw, groups = hit
+        if groups is None:
+            groups = assign_groups([b["heading"] for b in raw])
+            self.memo.put_groups(key, SYNONYM_FINGERPRINT, groups)
+        blocks = [{**b, "group": g} for b, g in zip(raw, groups)]
+        if self.stats is not None:
+            self.stats.record_parse(url, 0.0, time.perf_counter() - t0, blocks, memo=True)
+        return blocks
+
+    def submit(self, url: str, html: str) -> list[tuple[str, list[dict]]]:
+        """Принимает страницу; возвращает (url, blocks), если она разобрана сразу"""
+        html, truncated = truncate_html(html, self.max_chars)
+        if truncated:
+            self.truncated.add(url)
+        if self.memo is not None:
+            blocks = self._from_memo(url, html)
+            if blocks is not None:
+                return [(url, blocks)]
+        if self.workers > 1 and len(html) >= self.pool_min_bytes:
+            key = self.keys[url] = self.keys.get(url) or BlockMemo.key(html, self.mode)
+            if key in self.waiting:
+                self.waiting[key].append(url)
+                return []
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+            try:
+                fut = self.pool.submit(extract_blocks_timed, *self._task(html))
+            except concurrent.futures.process.BrokenProcessPool:
+                self.workers = 1
+            else:
+                self.pending[fut] = (url, html)
+                self.waiting[key] = []
+                return []
+        return [self._done(url, extract_blocks_timed(*self._task(html)))]
+
+    def _collect(self, fut: concurrent.futures.Future) -> list[tuple[str, list[dict]]]:
+        url, html = self.pending.pop(fut)
+        try:
+            result = fut.result()
+        except concurrent.futures.process.BrokenProcessPool:
+            self.workers = 1
+            result = extract_blocks_timed(*self._task(html))
+        ready = [self._done(url, result)]
+        blocks = ready[0][1]
+        for other in self.waiting.pop(self.keys[url]):
+            if self.stats is not None:
+                self.stats.record_parse(other, 0.0, 0.0, blocks, memo=True, truncated=other in self.truncated)
+            ready.append((other, [dict(b) for b in blocks]))
+        return ready
+
+    def poll(self) -> list[tuple[str, list[dict]]]:
+        """Готовые результаты пула, без ожидания"""
+        return [item for fut in [f for f in self.pending if f.done()] for item in self._collect(fut)]
+
+    def drain(self):
+        """Дожидается всех страниц из пула, отдаёт (url, blocks) по мере готовности"""
+        for fut in concurrent.futures.as_completed(list(self.pending)):
+            yield from self._collect(fut)
+
+
+def parse_pages(
+    pages: dict[str, str],
+    mode: str,
+    engine: str = "lxml",
+    workers: int | None = None,
+    stats: "RunStats | None" = None,
+    memo: BlockMemo | None = None,
+    max_chars: int = MAX_HTML_CHARS,
+):
+    """
+    Разбирает пачку страниц {url: html} и отдаёт (url, blocks) по мере готовности.
+    Парсинг — чистая работа CPU под GIL, поэтому крупные пачки уходят
+    в ProcessPoolExecutor; мелкие и одиночные страницы — в текущем процессе.
+    memo: уже разобранные страницы отдаются сразу (при смене словаря —
+    только с перегруппировкой), новые — запоминаются.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(pages))
+    if sum(len(html) for html in pages.values()) < PARSE_POOL_MIN_BYTES:
+        workers = 1
+    with PageParser(mode, engine, workers, stats, memo, pool_min_bytes=0, max_chars=max_chars) as parser:
+        for url, html in pages.items():
+            yield from parser.submit(url, html)
+        yield from parser.drain()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ОБХОД РАЗДЕЛА САЙТА (sitemap.xml или ссылки, ограниченная очередь)
+# ═══════════════════════════════════════════════════════════════════════════════
+CRAWL_MAX_PAGES = 30                  # страниц на сайт по умолчанию
+CRAWL_MAX_DEPTH = 2                   # переходов по ссылкам от стартовой страницы
+SITEMAP_MAX_FILES = 20                # файлов sitemap на сайт (с вложенными из индексов)
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024  # предел sitemap по протоколу, в том числе после gunzip
+
+ROBOTS_SITEMAP_RE = re.compile(r"^\s*sitemap\s*:\s*(\S+)", re.I | re.M)
+TRACKING_PARAM_RE = re.compile(r"^(utm_\w+|gclid|yclid|ysclid|fbclid|_openstat)$", re.I)
+NON_PAGE_EXT_RE = re.compile(
+    r"\.(jpe?g|png|gif|webp|svg|ico|bmp|pdf|docx?|xlsx?|pptx?|rtf|zip|rar|7z|gz|"
+    r"mp[34]|avi|mov|webm|css|js|json|xml|txt)$",
+    re.I,
+)
+
+
+def normalize_url(url: str, base: str | None = None) -> str | None:
+    """
+    URL для обхода в одном виде: абсолютный, схема и хост в нижнем регистре,
+    без порта по умолчанию, #фрагмента и меток utm_* и т.п., параметры
+    отсортированы. None — не http(s) или не страница (картинка, PDF, архив).
+    """
+    try:
+        parts = urlsplit(urljoin(base, url.strip()) if base else url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.rstrip(".")
+    if ":" in host:
+        host = f"[{host}]"
+    if port and port != {"http": 80, "https": 443}[scheme]:
+        host = f"{host}:{port}"
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    if NON_PAGE_EXT_RE.search(path):
+        return None
+    query = urlencode(sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAM_RE.match(k)
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def canonical_url(url: str) -> str:
+    """
+    Ключ страницы для сравнения адресов: normalize_url без схемы, www.
+    и конечного «/» — http://x.ru, https://x.ru/ и https://www.x.ru — одна страница
+    """
+    parts = urlsplit(normalize_url(url) or url.strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    path = parts.path.rstrip("/")
+    return f"{host}{path}?{parts.query}" if parts.query else f"{host}{path}"
+
+
+def dedupe_urls(urls: list[str], exclude: list[str] = ()) -> tuple[list[str], list[str]]:
+    """
+    Адреса без повторов с точностью до canonical_url, в исходном порядке и написании
+    первого вхождения; exclude — адреса, которые тоже считаются повтором
+    (анализируемая страница в списке конкурентов) → (уникальные, убранные повторы)
+    """
+    seen = {canonical_url(url) for url in exclude}
+    unique, repeated = [], []
+    for url in urls:
+        key = canonical_url(url)
+        if key in seen:
+            repeated.append(url)
+        else:
+            seen.add(key)
+            unique.append(url)
+    return unique, repeated
+
+
+def in_section(url: str, root: str) -> bool:
+    """
+    url на том же сайте, что root (www. не важен), и внутри его раздела по пути;
+    раздел страницы-файла (/uslugi/index.html) — её папка
+    """
+    u, r = urlsplit(url), urlsplit(root)
+    if u.netloc.removeprefix("www.") != r.netloc.removeprefix("www."):
+        return False
+    prefix = r.path.rstrip("/")
+    if "." in prefix.rsplit("/", 1)[-1]:
+        prefix = prefix.rsplit("/", 1)[0]
+    return u.path == prefix or u.path.startswith(prefix + "/")
+
+
+def page_links(html: str, base: str) -> list[str]:
+    """Ссылки <a href> страницы, нормализованные и без повторов (с учётом <base href>)"""
+    from lxml import etree
+
+    try:
+        doc = html_document(html)
+    except etree.ParserError:   # пустой документ
+        return []
+    base_href = doc.xpath("//base/@href")
+    if base_href:
+        base = urljoin(base, base_href[0].strip())
+    links = (normalize_url(href, base) for href in doc.xpath("//a/@href"))
+    return list(dict.fromkeys(link for link in links if link))
+
+
+def sitemap_locs(data: bytes) -> tuple[list[str], list[str]]:
+    """sitemap.xml (можно .gz) → (адреса страниц, вложенные sitemap из индекса)"""
+    from lxml import etree
+
+    if data[:2] == b"\x1f\x8b":
+        # Не GzipFile.read(n): тот сразу выделяет буфер на все n байт
+        try:
+            data = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS).decompress(data, SITEMAP_MAX_BYTES)
+        except zlib.error:
+            return [], []
+    parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True)
+    try:
+        root = etree.fromstring(data, parser)
+    except etree.XMLSyntaxError:
+        return [], []
+    if root is None:
+        return [], []
+    locs = [el.text.strip() for el in root.iter("{*}loc") if el.text and el.text.strip()]
+    if etree.QName(root).localname == "sitemapindex":
+        return [], locs
+    return locs, []
+
+
+async def sitemap_pages(
+    client: "ScrapingBeeClient",
+    root: str,
+    limit: int = CRAWL_MAX_PAGES,
+    timeout: int = 30,
+    concurrency: int = 5,
+) -> list[str]:
+    """
+    Страницы раздела root по sitemap: файлы из robots.txt (Sitemap:) и /sitemap.xml,
+    индексы обходятся вширь — не больше SITEMAP_MAX_FILES файлов и limit страниц.
+    Sitemap и robots.txt загружаются напрямую, без ScrapingBee, и не дальше
+    SITEMAP_MAX_BYTES — хвост огромного файла не скачивается.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def get(url: str) -> bytes | None:
+        async with sem:
+            data, _ = await client.get_direct_bytes(url, SITEMAP_MAX_BYTES, timeout)
+        return data
+
+    robots = await get(urljoin(root, "/robots.txt"))
+    level = [m.group(1) for m in ROBOTS_SITEMAP_RE.finditer(robots.decode("utf-8", "replace"))] if robots else []
+    level.append(urljoin(root, "/sitemap.xml"))
+
+    seen_files: set[str] = set()
+    pages: dict[str, str] = {}   # canonical_url → первое написание
+    while level and len(pages) < limit:
+        level = [u for u in dict.fromkeys(level) if u not in seen_files][:SITEMAP_MAX_FILES - len(seen_files)]
+        seen_files.update(level)
+        nested = []
+        for data in await asyncio.gather(*(get(u) for u in level)):
+            if data is None:
+                continue
+            locs, children = sitemap_locs(data)
+            nested += children
+            for loc in locs:
+                url = normalize_url(loc)
+                if url and in_section(url, root):
+                    pages.setdefault(canonical_url(url), url)
+        level = nested
+    return list(pages.values())[:limit]
+
+
+def crawl_site(
+    root: str,
+    api_key: str,
+    mode: str = "main",
+    max_pages: int = CRAWL_MAX_PAGES,
+    max_depth: int = CRAWL_MAX_DEPTH,
+    use_sitemap: bool = True,
+    engine: str = "lxml",
+    workers: int = 1,
+    timeout: int = 30,
+    concurrency: int = 5,
+    cache: HtmlCache | None = None,
+    force_refresh: bool = False,
+    stats: "RunStats | None" = None,
+    client: "ScrapingBeeClient | None" = None,
+    strategy: str = "auto",
+    profiles: "RenderProfiles | None" = None,
+    memo: BlockMemo | None = None,
+    on_page=None,
+    max_chars: int = MAX_HTML_CHARS,
+) -> tuple[dict[str, list[dict]], dict[str, str]]:
+    """
+    Обход раздела сайта: страницы раздела из sitemap.xml (если есть и use_sitemap),
+    иначе — ссылки в пределах раздела вширь от root, не глубже max_depth переходов.
+    Всего не больше max_pages страниц; загрузка — fetch_all (тот же параллелизм,
+    кэш и JS-рендер по необходимости), разбор — по мере загрузки.
+    on_page(url, blocks, err) — в потоке вызывающего, по мере готовности.
+    Возвращает (url → blocks в порядке обнаружения, url → ошибка).
+    """
+    client = client or default_scrapingbee_client()
+    root = normalize_url(root) or root
+    from_sitemap = []
+    if use_sitemap:
+        from_sitemap = client.submit(sitemap_pages(client, root, max_pages, timeout, concurrency)).result()
+    if from_sitemap:
+        frontier = from_sitemap
+        max_depth = 0
+    else:
+        frontier = [root]
+    if stats is not None:
+        stats.counters["crawl_sitemap" if from_sitemap else "crawl_links"] += 1
+
+    seen = list(frontier)   # порядок обнаружения
+    results: dict[str, list[dict]] = {}
+    errors: dict[str, str] = {}
+    final_urls: dict[str, str] = {}   # ссылки страницы — относительно адреса после редиректов
+
+    def ready(url: str, blocks: list[dict], err: str | None = None):
+        results[url] = blocks
+        if err:
+            errors[url] = err
+        if on_page:
+            on_page(url, blocks, err)
+
+    with PageParser(mode, engine, workers, stats, memo, max_chars=max_chars) as parser:
+        for depth in range(max_depth + 1):
+            links: list[str] = []
+
+            def on_fetched(url: str, html: str | None, err: str | None):
+                if err:
+                    ready(url, [], err)
+                    return
+                if depth < max_depth:
+                    links.extend(page_links(html, final_urls.get(url, url)))
+                for ready_url, blocks in parser.submit(url, html):
+                    ready(ready_url, blocks)
+
+            def on_idle():
+                for ready_url, blocks in parser.poll():
+                    ready(ready_url, blocks)
+
+            fetch_all(frontier, api_key, timeout, concurrency, on_done=on_fetched, on_idle=on_idle,
+                      cache=cache, force_refresh=force_refresh, stats=stats, client=client,
+                      strategy=strategy, profiles=profiles, keep_html=False, final_urls=final_urls)
+
+            # Следующий уровень — только новые страницы раздела и только в пределах бюджета;
+            # http/https, www. и конечный «/» не делают страницу новой
+            known = {canonical_url(url) for url in seen}
+            frontier = []
+            for link in links:
+                if len(seen) >= max_pages:
+                    break
+                key = canonical_url(link)
+                if key not in known and in_section(link, root):
+                    known.add(key)
+                    seen.append(link)
+                    frontier.append(link)
+            if not frontier:
+                break
+
+        for ready_url, blocks in parser.drain():
+            ready(ready_url, blocks)
+
+    return {url: results[url] for url in seen if url in results}, errors
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  МЕТРИКИ ЗАПУСКА
+# ═══════════════════════════════════════════════════════════════════════════════
+METRIC_SOURCES = {"session": "прошлый запуск", "cache": "кэш", "direct": "напрямую", "scrapingbee": "ScrapingBee",
+                  "shared": "общая загрузка"}
+STAGE_LABELS = {"crawl": "Обход разделов", "fetch": "Загрузка", "parse": "Разбор", "fuzzy": "Похожие заголовки", "export": "Excel",
+                "history": "История"}
+TOTAL_LABELS = {
+    "pages": "Страниц", "bytes": "Загружено, байт", "blocks": "Блоков",
+    "parse_s": "Разбор (сумма по страницам), сек", "group_s": "Группировка (сумма), сек",
+    "parse_mem_max": "Пик памяти разбора крупной страницы, байт", "parse_truncated": "Обрезано страниц",
+    "fetch_session": "Из прошлого запуска", "fetch_cache": "Из кэша", "fetch_direct": "Напрямую, без рендера", "fetch_scrapingbee": "Через ScrapingBee",
+    "fetch_escalated": "Переведено на JS-рендер", "fetch_errors": "Ошибок загрузки",
+    "fetch_retries": "Повторных запросов", "parse_memo": "Разобрано ранее (из памяти)",
+    "credits": "Кредитов ScrapingBee", "fetch_shared": "Из общей загрузки (тот же адрес)",
+    "saved_requests": "Сэкономлено запросов", "saved_credits": "Сэкономлено кредитов ScrapingBee",
+    "crawl_sitemap": "Разделов по sitemap.xml", "crawl_links": "Разделов по ссылкам",
+    **{f"render_{name}": f"Профиль рендера «{name}»" for name in RENDER_PROFILES},
+}
+
+
+class RunStats:
+    """
+    Метрики одного запуска: по страницам (загрузка, разбор, блоки)
+    и по стадиям (время всей стадии), плюс счётчики кэша.
+    """
+
+    PAGE_FIELDS = (
+        "source", "escalated", "profile", "fetch_s", "attempts", "credits", "bytes", "html_hash",
+        "parse_s", "group_s", "parse_mem", "truncated", "blocks", "groups", "error",
+    )
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.pages: dict[str, dict] = {}
+        self.stages: dict[str, float] = {}
+        self.counters: dict[str, int] = defaultdict(int)
+
+    def page(self, url: str) -> dict:
+        if url not in self.pages:
+            self.pages[url] = dict.fromkeys(self.PAGE_FIELDS)
+        return self.pages[url]
+
+    def record_fetch(
+        self, url: str, seconds: float, html: str | None, err: str | None, source: str,
+        attempts: int = 1, escalated: str | None = None, profile: str | None = None, credits: int = 0,
+    ):
+        """
+        escalated — почему прямая загрузка не подошла и понадобился JS-рендер;
+        profile — профиль рендера ScrapingBee; credits — потрачено кредитов ScrapingBee
+        """
+        data = html.encode("utf-8", "surrogatepass") if html is not None else None
+        p = self.page(url)
+        p.update(source=source, escalated=escalated, profile=profile, fetch_s=seconds, error=err, attempts=attempts,
+                 credits=credits,
+                 bytes=len(data) if data is not None else 0,
+                 html_hash=hashlib.sha1(data).hexdigest() if data is not None else None)
+        self.counters[f"fetch_{source}"] += 1
+        if escalated:
+            self.counters["fetch_escalated"] += 1
+        if profile:
+            self.counters[f"render_{profile}"] += 1
+        if attempts > 1:
+            self.counters["fetch_retries"] += attempts - 1
+        if err:
+            self.counters["fetch_errors"] += 1
+
+    def record_shared(
+        self, url: str, seconds: float, html: str | None, err: str | None, requests: int, credits: int,
+    ):
+        """
+        Страница из чужой загрузки — того же адреса в другом написании или такой же
+        загрузки, уже шедшей в клиенте; requests и credits — её цена, то есть экономия
+        """
+        self.record_fetch(url, seconds, html, err, "shared", attempts=0)
+        self.counters["saved_requests"] += requests
+        self.counters["saved_credits"] += credits
+
+    def record_reused(self, url: str, page: dict):
+        """Страница из прошлого запуска в этой сессии — без загрузки и разбора"""
+        self.pages[url] = {
+            **dict.fromkeys(self.PAGE_FIELDS), **page,
+            "source": "session", "fetch_s": 0.0, "attempts": 0, "credits": 0, "parse_s": 0.0, "group_s": 0.0,
+        }
+        self.counters["fetch_session"] += 1
+
+    def record_parse(
+        self, url: str, parse_s: float, group_s: float, blocks: list[dict], memo: bool = False,
+        mem: int | None = None, truncated: bool = False,
+    ):
+        """
+        memo — блоки взяты из BlockMemo без разбора HTML; mem — прирост пикового
+        RSS при разборе, байт; truncated — HTML обрезан до MAX_HTML_CHARS
+        """
+        if memo:
+            self.counters["parse_memo"] += 1
+        if truncated:
+            self.counters["parse_truncated"] += 1
+        self.page(url).update(
+            parse_s=parse_s, group_s=group_s, parse_mem=mem, truncated=truncated,
+            blocks=len(blocks), groups=len(set(b["group"] for b in blocks)),
+        )
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Замер стадии; повторные замеры одной стадии складываются"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - t0
+
+    def totals(self) -> dict[str, float | int]:
+        pages = self.pages.values()
+        return {
+            "pages": len(self.pages),
+            "bytes": sum(p["bytes"] or 0 for p in pages),
+            "credits": sum(p["credits"] or 0 for p in pages),
+            "blocks": sum(p["blocks"] or 0 for p in pages),
+            "parse_s": sum(p["parse_s"] or 0 for p in pages),
+            "group_s": sum(p["group_s"] or 0 for p in pages),
+            "parse_mem_max": max((p["parse_mem"] or 0 for p in pages), default=0),
+            **self.counters,
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "stages": self.stages,
+            "totals": self.totals(),
+            "pages": self.pages,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Текстовый формат Prometheus (для node_exporter textfile collector)"""
+        def esc(v: str) -> str:
+            return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        lines = []
+
+        def metric(name: str, help_: str, samples: list[tuple[dict, float]]):
+            lines.append(f"# HELP kndr_{name} {help_}")
+            lines.append(f"# TYPE kndr_{name} gauge")
+            for labels, value in samples:
+                lbl = ",".join(f'{k}="{esc(str(v))}"' for k, v in labels.items())
+                lines.append(f"kndr_{name}{{{lbl}}} {value}" if lbl else f"kndr_{name} {value}")
+
+        metric("run_started_timestamp_seconds", "Время начала запуска", [({}, self.started_at)])
+        metric("stage_seconds", "Длительность стадии", [({"stage": k}, v) for k, v in self.stages.items()])
+        metric("run_total", "Итоги запуска", [({"metric": k}, v) for k, v in self.totals().items()])
+        for field, help_ in (
+            ("fetch_s", "Загрузка страницы, сек"),
+            ("bytes", "Размер HTML, байт"),
+            ("parse_s", "Разбор HTML, сек"),
+            ("group_s", "Группировка заголовков, сек"),
+            ("parse_mem", "Прирост пикового RSS при разборе крупной страницы, байт"),
+            ("blocks", "Найдено блоков"),
+        ):
+            samples = [
+                ({"url": url, "source": p["source"] or ""}, p[field])
+                for url, p in self.pages.items() if p[field] is not None
+            ]
+            metric(f"page_{field}", help_, samples)
+        return "\n".join(lines) + "\n"
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  СВОДКА
+# ═══════════════════════════════════════════════════════════════════════════════
+# (минимальная частота у конкурентов, рекомендация, заливка в Excel)
+RECOMMENDATIONS = (
+    (3, "🔴 Обязательно", "required"),
+    (2, "🟡 Желательно", "wish"),
+    (0, "⚪ По желанию", "optional"),
+)
+RECOMMENDATION_FILLS = {rec: fill for _, rec, fill in RECOMMENDATIONS}
+
+# Столбцы таблицы блоков и их типы (компактные: int8/int32, bool)
+BLOCK_DTYPES = {
+    "heading": "object", "level": "int8", "text_len": "int32", "buttons": "int32",
+    "has_form": "bool", "has_list": "bool", "has_iframe": "bool", "has_video": "bool",
+    "has_table": "bool", "images": "int32", "has_faq_schema": "bool", "simhash": "int64",
+    "group": "object",
+}
+
+
+def recommendation(freq: int) -> str:
+    """Рекомендация по частоте блока у конкурентов"""
+    return next(rec for min_freq, rec, _ in RECOMMENDATIONS if freq >= min_freq)
+
+
+def recommendations(freq: "pd.Series") -> "pd.Series":
+    """recommendation() для целого столбца частот"""
+    import numpy as np
+    import pandas as pd
+
+    return pd.Series(
+        np.select([freq >= min_freq for min_freq, _, _ in RECOMMENDATIONS],
+                  [rec for _, rec, _ in RECOMMENDATIONS], default=RECOMMENDATIONS[-1][1]),
+        index=freq.index, dtype="object",
+    )
+
+
+def blocks_frame(all_results: dict[str, list[dict]]) -> "pd.DataFrame":
+    """
+    Блоки всех сайтов одной таблицей, по столбцу на поле блока.
+    site и group — категориальные: сайты в порядке all_results, группы —
+    сначала из словаря (в его порядке), затем прочие в порядке появления.
+    """
+    import numpy as np
+    import pandas as pd
+
+    sites = list(all_results)
+    rows = [b for url in sites for b in all_results[url]]
+    frame = pd.DataFrame({
+        col: pd.Series([b[col] for b in rows], dtype=dtype)
+        for col, dtype in BLOCK_DTYPES.items()
+    })
+    frame.insert(0, "site", pd.Categorical.from_codes(
+        np.repeat(np.arange(len(sites)), [len(all_results[url]) for url in sites]).astype("int32"),
+        categories=pd.Index(sites, dtype="object"),
+    ))
+    seen = pd.unique(frame["group"])
+    in_dict = set(seen) & SYNONYM_GROUPS.keys()
+    order = [g for g in SYNONYM_GROUPS if g in in_dict] + [g for g in seen if g not in SYNONYM_GROUPS]
+    frame["group"] = pd.Categorical(frame["group"], categories=pd.Index(order, dtype="object"))
+    return frame
+
+
+def presence_matrix(frame: "pd.DataFrame", urls: list[str]) -> "pd.DataFrame":
+    """Группа × сайт → первый заголовок группы на сайте (None — группы нет); группы в порядке категорий"""
+    import numpy as np
+    import pandas as pd
+
+    groups, sites = frame["group"].cat, frame["site"].cat
+    n_sites = len(sites.categories)
+    cell = groups.codes.to_numpy().astype("int64") * n_sites + sites.codes.to_numpy()
+    _, first = np.unique(cell, return_index=True)   # первая строка каждой пары (группа, сайт)
+    matrix = np.full(len(groups.categories) * n_sites, None, dtype="object")
+    matrix[cell[first]] = frame["heading"].to_numpy()[first]
+    return pd.DataFrame(
+        matrix.reshape(len(groups.categories), n_sites),
+        index=groups.categories, columns=sites.categories, dtype="object",
+    ).reindex(columns=urls)
+
+
+SUMMARY_COLUMNS = ("buttons", "has_form", "has_list", "images", "text_len", "has_faq_schema")
+
+
+def site_summary(frame: "pd.DataFrame", urls: list[str]) -> "pd.DataFrame":
+    """Сводка по сайтам: блоки, CTA, формы, списки, изображения, объём текста, FAQ-схемы"""
+    import numpy as np
+    import pandas as pd
+
+    codes = frame["site"].cat.codes.to_numpy()
+    n_sites = len(frame["site"].cat.categories)
+    summary = pd.DataFrame(
+        {"blocks": np.bincount(codes, minlength=n_sites)}
+        | {col: np.bincount(codes, weights=frame[col].to_numpy(), minlength=n_sites).astype("int64")
+           for col in SUMMARY_COLUMNS},
+        index=frame["site"].cat.categories,
+    )
+    return summary.reindex(urls, fill_value=0)
+
+
+def site_labels(urls: list[str]) -> dict[str, str]:
+    """Короткие подписи сайтов: домен, а для нескольких страниц одного домена — домен + путь"""
+    netlocs = Counter(urlparse(u).netloc for u in dict.fromkeys(urls))
+    return {
+        u: urlparse(u).netloc + (urlparse(u).path if netlocs[urlparse(u).netloc] > 1 else "") or u
+        for u in urls
+    }
+
+
+def missing_groups(
+    target_url: str,
+    competitor_urls: list[str],
+    all_results: dict[str, list[dict]],
+    frame: "pd.DataFrame | None" = None,
+) -> Counter:
+    """
+    Группы блоков конкурентов, которых нет у анализируемого сайта → число блоков.
+    frame — готовый blocks_frame(all_results), если он уже есть.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if frame is None:
+        frame = blocks_frame(all_results)
+    target_groups = frame.loc[frame["site"] == target_url, "group"].unique()
+    # Вес строки — сколько раз её сайт указан среди конкурентов (обычно 0 или 1)
+    times_listed = Counter(competitor_urls)
+    site_weight = np.array([times_listed[url] for url in frame["site"].cat.categories], dtype="int64")
+    weight = site_weight[frame["site"].cat.codes.to_numpy()] if len(frame) else np.zeros(0, dtype="int64")
+    mask = (weight > 0) & ~frame["group"].isin(target_groups).to_numpy()
+    counts = pd.Series(weight[mask], index=frame["group"].to_numpy()[mask]).groupby(level=0, sort=False).sum()
+    return Counter(counts.to_dict())
+
+
+def section_blocks(pages: dict[str, list[dict]]) -> list[dict]:
+    """Блоки всех страниц раздела одним списком — раздел сравнивается как одна страница"""
+    return [b for blocks in pages.values() for b in blocks]
+
+
+def group_page_counts(sections: dict[str, dict[str, list[dict]]]) -> "pd.DataFrame":
+    """Группа × раздел → на скольких страницах раздела встречается группа"""
+    import numpy as np
+    import pandas as pd
+
+    pages = {url: blocks for section in sections.values() for url, blocks in section.items()}
+    frame = blocks_frame(pages)
+    has = np.zeros((len(pages), len(frame["group"].cat.categories)), dtype="int32")
+    has[frame["site"].cat.codes.to_numpy(), frame["group"].cat.codes.to_numpy()] = 1
+    row = {url: i for i, url in enumerate(pages)}
+    return pd.DataFrame(
+        {root: has[[row[url] for url in section]].sum(axis=0) for root, section in sections.items()},
+        index=frame["group"].cat.categories,
+    )
+
+
+def missing_section_groups(
+    target_url: str,
+    competitor_urls: list[str],
+    sections: dict[str, dict[str, list[dict]]],
+) -> Counter:
+    """Группы, которых нет ни на одной странице раздела анализируемого сайта → в скольких разделах конкурентов есть"""
+    counts = group_page_counts(sections)
+    freq = (counts.reindex(columns=competitor_urls, fill_value=0) > 0).sum(axis=1)
+    absent = counts[target_url] == 0 if target_url in counts else True
+    return Counter(freq[absent & (freq > 0)].to_dict())
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ПОЧТИ-ДУБЛИ БЛОКОВ И САЙТОВ (SimHash + LSH)
+# ═══════════════════════════════════════════════════════════════════════════════
+# Конкуренты на одном шаблоне/CMS дают почти одинаковые блоки: такие сайты
+# в группе считаются за один, иначе шаблон накручивает «Частоту».
+SIMHASH_BANDS = 4            # LSH: 64 бита отпечатка → 4 полосы по 16 бит
+SIMHASH_MAX_DISTANCE = 3     # почти-дубли: отпечатки различаются не больше чем в 3 битах
+DUPLICATE_SITE_SHARE = 0.5   # сайты похожи: почти-дубли — не меньше половины сравниваемых блоков одного из них
+
+
+def hamming64(a: "np.ndarray", b: "np.ndarray") -> "np.ndarray":
+    """Число различающихся бит в парах 64-битных отпечатков"""
+    import numpy as np
+
+    diff = np.ascontiguousarray(a ^ b, dtype="<i8").view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(diff, axis=1).sum(axis=1)
+
+
+def simhash_pairs(fingerprints: "np.ndarray", max_distance: int = SIMHASH_MAX_DISTANCE) -> "tuple[np.ndarray, np.ndarray]":
+    """
+    Пары (a, b), a < b, отпечатков на расстоянии Хэмминга не больше max_distance.
+    Отпечатки, различающиеся меньше чем в SIMHASH_BANDS битах, совпадают хотя бы
+    в одной полосе, поэтому кандидаты — только пары внутри корзин полос (как пары
+    внутри признака в sparse_similarities): почти линейно вместо всех пар.
+    Одинаковые отпечатки лучше свести заранее (np.unique) — иначе корзина растёт квадратично.
+    """
+    import numpy as np
+
+    if max_distance >= SIMHASH_BANDS:
+        raise ValueError(f"max_distance должен быть меньше числа полос ({SIMHASH_BANDS})")
+    n = len(fingerprints)
+    bits = np.ascontiguousarray(fingerprints, dtype="<i8").view("<u8")
+    width = 64 // SIMHASH_BANDS
+    candidates = []
+    for band in range(SIMHASH_BANDS):
+        value = (bits >> np.uint64(band * width)) & np.uint64((1 << width) - 1)
+        order = np.argsort(value, kind="stable")
+        value = value[order]
+        n_pairs = np.searchsorted(value, value, side="right") - np.arange(n) - 1
+        left = np.repeat(np.arange(n), n_pairs)
+        offset = np.arange(len(left)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+        a, b = order[left], order[left + 1 + offset]
+        candidates.append(np.minimum(a, b) * n + np.maximum(a, b))
+    pairs = np.unique(np.concatenate(candidates))
+    a, b = pairs // max(n, 1), pairs % max(n, 1)
+    close = hamming64(fingerprints[a], fingerprints[b]) <= max_distance
+    return a[close], b[close]
+
+
+def near_duplicate_clusters(frame: "pd.DataFrame") -> "np.ndarray":
+    """
+    Кластер почти-дублей для каждой строки blocks_frame: блоки с одной меткой
+    связаны цепочкой отпечатков на расстоянии не больше SIMHASH_MAX_DISTANCE;
+    -1 — блок короче SIMHASH_MIN_TEXT и не сравнивается.
+    """
+    import numpy as np
+
+    labels = np.full(len(frame), -1, dtype="int64")
+    rows = np.flatnonzero((frame["text_len"].to_numpy() >= SIMHASH_MIN_TEXT) & (frame["simhash"].to_numpy() != 0))
+    values, inverse = np.unique(frame["simhash"].to_numpy()[rows], return_inverse=True)
+    labels[rows] = connected_components(len(values), *simhash_pairs(values))[inverse]
+    return labels
+
+
+def block_copies(frame: "pd.DataFrame", clusters: "np.ndarray") -> "np.ndarray":
+    """Для каждой строки frame — первый (по порядку сайтов) другой сайт с почти таким же блоком, иначе None"""
+    import numpy as np
+
+    sites = frame["site"].cat.categories.to_numpy(dtype="object")
+    own = frame["site"].cat.codes.to_numpy().astype("int64")
+    copies = np.full(len(frame), None, dtype="object")
+    rows = np.flatnonzero(clusters >= 0)
+    if not len(rows):
+        return copies
+    # Уникальные пары (кластер, сайт) по возрастанию: первый и второй сайт каждого кластера
+    n_sites = len(sites)
+    pairs = np.unique(clusters[rows] * n_sites + own[rows])
+    cluster, site = pairs // n_sites, pairs % n_sites
+    starts = np.flatnonzero(np.r_[True, cluster[1:] != cluster[:-1]])
+    first = site[starts]
+    nxt = np.minimum(starts + 1, len(pairs) - 1)
+    second = np.where(cluster[nxt] == cluster[starts], site[nxt], -1)
+    second[nxt == starts] = -1
+    run = np.searchsorted(cluster[starts], clusters[rows])
+    other = np.where(first[run] != own[rows], first[run], second[run])
+    found = other >= 0
+    copies[rows[found]] = sites[other[found]]
+    return copies
+
+
+def duplicate_cells(frame: "pd.DataFrame", clusters: "np.ndarray", competitor_urls: list[str]) -> "pd.DataFrame":
+    """
+    Группа × конкурент (столбцы — как в presence_matrix) → конкурент раньше по списку,
+    чьи блоки этой группы почти совпадают с блоками этого (тот же шаблон), иначе None.
+    Сайты связываются через общие кластеры блоков, поэтому цепочка копий — одна.
+    """
+    import numpy as np
+    import pandas as pd
+
+    groups = frame["group"].cat.categories
+    site_codes = {url: i for i, url in enumerate(frame["site"].cat.categories)}
+    n_sites = len(site_codes)
+    cells = np.full((len(groups), len(competitor_urls)), None, dtype="object")
+    competitors = [site_codes[url] for url in dict.fromkeys(competitor_urls) if url in site_codes]
+    rows = np.flatnonzero((clusters >= 0) & np.isin(frame["site"].cat.codes.to_numpy(), competitors))
+    if len(rows):
+        # Граф «ячейка (группа, сайт) — кластер»: ячейки одной компоненты — копии друг друга
+        cell = frame["group"].cat.codes.to_numpy()[rows].astype("int64") * n_sites + frame["site"].cat.codes.to_numpy()[rows]
+        cell_ids, cell_of_row = np.unique(cell, return_inverse=True)
+        cluster_ids, cluster_of_row = np.unique(clusters[rows], return_inverse=True)
+        labels = connected_components(len(cell_ids) + len(cluster_ids), cell_of_row, len(cell_ids) + cluster_of_row)
+        component = dict(zip(cell_ids.tolist(), labels[:len(cell_ids)].tolist()))
+        for gi in range(len(groups)):
+            owner: dict[int, str] = {}
+            for k, url in enumerate(competitor_urls):
+                comp = component.get(gi * n_sites + site_codes.get(url, -n_sites))
+                if comp is not None and owner.setdefault(comp, url) != url:
+                    cells[gi, k] = owner[comp]
+    return pd.DataFrame(cells, index=groups, columns=competitor_urls, dtype="object")
+
+
+def similar_sites(frame: "pd.DataFrame", clusters: "np.ndarray", share: float = DUPLICATE_SITE_SHARE) -> dict[str, list[str]]:
+    """
+    Сайт → сайты на том же шаблоне: почти-дубли составляют не меньше share
+    сравниваемых блоков (не короче SIMHASH_MIN_TEXT) одного из двух сайтов
+    """
+    import numpy as np
+
+    sites = list(frame["site"].cat.categories)
+    codes = frame["site"].cat.codes.to_numpy()
+    rows = np.flatnonzero(clusters >= 0)
+    if not len(rows):
+        return {url: [] for url in sites}
+    cluster_ids, cluster_of_row = np.unique(clusters[rows], return_inverse=True)
+    counts = np.zeros((len(sites), len(cluster_ids)), dtype="int64")
+    np.add.at(counts, (codes[rows], cluster_of_row), 1)
+    # shared[s, t] — блоков сайта s с почти-дублем на сайте t
+    shared = counts @ (counts > 0).T.astype("int64")
+    total = counts.sum(axis=1)
+    part = shared / np.maximum(total, 1)[:, None]
+    close = (np.maximum(part, part.T) >= share) & ~np.eye(len(sites), dtype=bool)
+    return {url: [sites[t] for t in np.flatnonzero(close[s])] for s, url in enumerate(sites)}
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  EXCEL
+# ═══════════════════════════════════════════════════════════════════════════════
+# ─── Стили ────────────────────────────────────────────────────────────────────
+# Общие объекты стилей создаются один раз на процесс, при первом отчёте; на их
+# основе в каждой книге регистрируются именованные стили, и ячейки ссылаются
+# на них по имени вместо копий Border/PatternFill.
+@functools.cache
+def excel_style_parts() -> tuple[dict, dict, dict, "Border"]:
+    """(заливки, шрифты, выравнивания, рамка) для именованных стилей"""
+    from openpyxl.styles import PatternFill, Font, Alignment, Border, Side
+
+    fills = {
+        "header":   PatternFill("solid", fgColor="1F3864"),   # тёмно-синий заголовок
+        "target":   PatternFill("solid", fgColor="D9EAD3"),   # зелёный — анализируемый есть
+        "missing":  PatternFill("solid", fgColor="FCE4D6"),   # красный — блок отсутствует
+        "required": PatternFill("solid", fgColor="C6EFCE"),   # обязательно
+        "wish":     PatternFill("solid", fgColor="FFEB9C"),   # желательно
+        "optional": PatternFill("solid", fgColor="F2F2F2"),   # по желанию
+        "alt":      PatternFill("solid", fgColor="EBF3FB"),   # чередование строк (конкуренты)
+        "white":    PatternFill("solid", fgColor="FFFFFF"),
+    }
+    fonts = {
+        "header": Font(bold=True, color="FFFFFF", size=10),
+        "bold":   Font(bold=True, size=10),
+        "normal": Font(size=10),
+    }
+    alignments = {
+        "center": Alignment(horizontal="center", vertical="center", wrap_text=True),
+        "left":   Alignment(horizontal="left",   vertical="center", wrap_text=True),
+    }
+    side = Side(style="thin", color="D0D0D0")
+    return fills, fonts, alignments, Border(left=side, right=side, top=side, bottom=side)
+
+
+class ExcelStyles:
+    """Именованные стили книги: (шрифт, заливка, выравнивание) → имя, регистрация при первом использовании"""
+
+    def __init__(self, wb):
+        self.wb = wb
+        self.names: dict[tuple[str, str, str], str] = {}
+
+    def __call__(self, font: str, fill: str, align: str) -> str:
+        key = (font, fill, align)
+        name = self.names.get(key)
+        if name is None:
+            from openpyxl.styles import NamedStyle
+
+            fills, fonts, alignments, border = excel_style_parts()
+            name = f"kndr {font} {fill} {align}"
+            self.wb.add_named_style(NamedStyle(
+                name=name,
+                font=fonts[font],
+                fill=fills[fill],
+                alignment=alignments[align],
+                border=border,
+            ))
+            self.names[key] = name
+        return name
+
+
+def make_excel(
+    target_url: str,
+    competitor_urls: list[str],
+    all_results: dict[str, list[dict]],
+    stats: RunStats | None = None,
+    sections: dict[str, dict[str, list[dict]]] | None = None,
+    templates: bool = False,
+) -> bytes:
+    """
+    sections — при обходе разделов: сайт → {страница → блоки}; all_results
+    тогда — блоки разделов целиком (section_blocks), добавляется лист частот.
+    templates — отмечать почти-дубли блоков у конкурентов (общий шаблон): «≈»
+    на листе сравнения, колонки о копиях и частота, где копия шаблона не
+    считается отдельным конкурентом; без него частота — по всем конкурентам.
+    """
+    import numpy as np
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.utils import get_column_letter
+
+    all_urls = competitor_urls + [target_url]
+    short = site_labels(all_urls)
+
+    # Все блоки — одной таблицей; сравнение и сводка считаются группировками по ней
+    frame = blocks_frame(all_results)
+    presence = presence_matrix(frame, all_urls)
+    freq = presence.iloc[:, :len(competitor_urls)].notna().sum(axis=1)
+    template_cols: list[str] = []
+    if templates:
+        # Конкуренты с почти одинаковыми блоками группы (один шаблон) считаются за один сайт
+        clusters = near_duplicate_clusters(frame)
+        copies = duplicate_cells(frame, clusters, competitor_urls)
+        freq = freq - copies.notna().sum(axis=1)
+        template_cols = ["Копии шаблона"]
+
+    # write_only: строки пишутся потоком и не держатся в памяти
+    wb = openpyxl.Workbook(write_only=True)
+    style = ExcelStyles(wb)
+
+    def new_sheet(title: str, headers: list, widths: list[int], freeze: str):
+        ws = wb.create_sheet(title)
+        # Ширины, высота и закрепление задаются до первой строки
+        for i, w in enumerate(widths, 1):
+            ws.column_dimensions[get_column_letter(i)].width = w
+        ws.row_dimensions[1].height = 32
+        ws.freeze_panes = freeze
+        header_style = style("header", "header", "center")
+        ws.append([styled(ws, h, header_style) for h in headers])
+        return ws
+
+    def styled(ws, value, style_name: str) -> WriteOnlyCell:
+        c = WriteOnlyCell(ws, value=value)
+        c.style = style_name
+        return c
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    #  ЛИСТ 1 — Сравнение блоков
+    # ═══════════════════════════════════════════════════════════════════════════
+    comp_names = [short[u] for u in competitor_urls]
+    freq_col = "Частота (без копий шаблона)" if templates else "Частота"
+    cols = ["Блок"] + comp_names + [f"★ {short[target_url]}"] + [freq_col, "Рекомендация"] + template_cols
+    ws1 = new_sheet(
+        "Сравнение блоков", cols,
+        [28] + [24] * len(competitor_urls) + [26, 14 if templates else 10, 18] + [30] * len(template_cols),
+        "B2",
+    )
+    ws1.sheet_view.showGridLines = True
+
+    no_copies = (None,) * len(competitor_urls)
+    copy_rows = copies.itertuples(index=False, name=None) if templates else (no_copies for _ in presence.index)
+    rows1 = zip(presence.index, presence.itertuples(index=False, name=None), copy_rows, freq, recommendations(freq))
+    for ri, (group, headings, copy_of, group_freq, rec) in enumerate(rows1, 2):
+        row_bg = "alt" if ri % 2 == 0 else "white"
+        row = [styled(ws1, group, style("bold", row_bg, "left"))]
+
+        comp_style = style("normal", row_bg, "left")
+        for heading, original in zip(headings[:-1], copy_of):
+            if original is not None:
+                # Почти-дубль блока конкурента выше по списку — в частоте не учитывается
+                row.append(styled(ws1, f"≈  {heading[:45]}", style("normal", "optional", "left")))
+            else:
+                row.append(styled(ws1, f"✓  {heading[:45]}" if isinstance(heading, str) else "—", comp_style))
+
+        if isinstance(headings[-1], str):
+            row.append(styled(ws1, f"✓  {headings[-1][:45]}", style("normal", "target", "left")))
+        else:
+            row.append(styled(ws1, "Отсутствует ✗", style("normal", "missing", "left")))
+
+        row.append(styled(ws1, int(group_freq), style("normal", row_bg, "center")))
+        row.append(styled(ws1, rec, style("bold", RECOMMENDATION_FILLS[rec], "center")))
+        if templates:
+            row.append(styled(ws1, ", ".join(
+                f"{short[url]} ≈ {short[original]}" for url, original in zip(competitor_urls, copy_of)
+                if original is not None
+            ), comp_style))
+
+        ws1.append(row)
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    #  ЛИСТ 2 — Все заголовки
+    # ═══════════════════════════════════════════════════════════════════════════
+    h2_cols = ["Сайт", "Уровень", "Заголовок", "Группа", "Длина текста",
+               "CTA-кнопки", "Форма", "Список", "Изображения", "FAQ-схема"] + (["Почти-дубль на"] if templates else [])
+    ws2 = new_sheet("Заголовки H1–H6", h2_cols, [28, 9, 48, 26, 14, 12, 8, 8, 13, 12, 24], "A2")
+    h2_center = (False, True, False, False, True, True, False, True, True, True, False)
+
+    copies_by_site: dict[str, np.ndarray] = {}
+    if templates:
+        # Строки frame идут по сайтам в порядке all_results
+        block_copy = block_copies(frame, clusters)
+        offsets = np.cumsum([0] + [len(blocks) for blocks in all_results.values()])
+        copies_by_site = {url: block_copy[start:end] for url, start, end in zip(all_results, offsets, offsets[1:])}
+
+    ri2 = 2
+    for url in all_urls:
+        is_tgt = url == target_url
+        font = "bold" if is_tgt else "normal"
+        site_copies = copies_by_site.get(url, []) if templates else [None] * len(all_results.get(url, []))
+        for b, copy_site in zip(all_results.get(url, []), site_copies):
+            row_bg = "alt" if is_tgt or ri2 % 2 == 0 else "white"
+            left, center = style(font, row_bg, "left"), style(font, row_bg, "center")
+            row = [
+                short[url],
+                f"H{b['level']}",
+                b["heading"],
+                b["group"],
+                b["text_len"],
+                b["buttons"],
+                "Да" if b["has_form"] else "Нет",
+                "Да" if b["has_list"] else "Нет",
+                b["images"],
+                "Да" if b["has_faq_schema"] else "Нет",
+            ]
+            if templates:
+                row.append(short.get(copy_site, copy_site) or "")
+            ws2.append([
+                styled(ws2, val, center if is_center else left)
+                for val, is_center in zip(row, h2_center)
+            ])
+            ri2 += 1
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    #  ЛИСТ 3 — Сводная статистика
+    # ═══════════════════════════════════════════════════════════════════════════
+    s_cols = ["Сайт", "Роль", "Блоков найдено", "CTA-кнопок", "Форм",
+              "Списков", "Изображений", "Объём текста (симв.)", "FAQ-схем"]
+    ws3 = new_sheet("Сводная статистика", s_cols + (["Похожие сайты (шаблон)"] if templates else []),
+                    [30, 18, 16, 14, 10, 10, 14, 22, 13, 30], "A2")
+
+    summary = site_summary(frame, all_urls)
+    similar = similar_sites(frame, clusters) if templates else {}
+    for ri3, (url, totals) in enumerate(zip(all_urls, summary.itertuples(index=False, name=None)), 2):
+        is_tgt = url == target_url
+        role = "★ Анализируемый" if is_tgt else "Конкурент"
+        row = [short[url], role, *(int(v) for v in totals)]
+        if templates:
+            row.append(", ".join(short.get(u, u) for u in similar.get(url, [])))
+        fill = "target" if is_tgt else ("alt" if ri3 % 2 == 0 else "white")
+        font = "bold" if is_tgt else "normal"
+        ws3.append([
+            styled(ws3, val, style(font, fill, "center" if 2 < ci <= len(s_cols) else "left"))
+            for ci, val in enumerate(row, 1)
+        ])
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    #  ЛИСТ 3а — Доля страниц раздела с группой (при обходе разделов)
+    # ═══════════════════════════════════════════════════════════════════════════
+    if sections is not None:
+        counts = group_page_counts(sections).reindex(index=presence.index, columns=all_urls, fill_value=0)
+        n_pages = [len(sections.get(url, {})) for url in all_urls]
+        p_cols = (["Блок"] + [f"{short[u]} ({n} стр.)" for u, n in zip(competitor_urls, n_pages)]
+                  + [f"★ {short[target_url]} ({n_pages[-1]} стр.)"])
+        ws_p = new_sheet("Доля страниц", p_cols, [28] + [18] * len(all_urls), "B2")
+        for ri, (group, row_counts) in enumerate(zip(counts.index, counts.itertuples(index=False, name=None)), 2):
+            row_bg = "alt" if ri % 2 == 0 else "white"
+            row = [styled(ws_p, group, style("bold", row_bg, "left"))]
+            for ci, (count, n) in enumerate(zip(row_counts, n_pages)):
+                fill = "target" if ci == len(competitor_urls) else row_bg
+                text = f"{count * 100 // n}% ({count}/{n})" if n and count else "—"
+                row.append(styled(ws_p, text, style("normal", fill, "center")))
+            ws_p.append(row)
+
+    # ═══════════════════════════════════════════════════════════════════════════
+    #  ЛИСТ 4 — Метрики запуска (если переданы)
+    # ═══════════════════════════════════════════════════════════════════════════
+    if stats is not None:
+        m_cols = ["Сайт", "Источник", "Почему рендер", "Профиль", "Загрузка, сек", "Попыток", "Кредитов",
+                  "Размер, КБ", "Разбор, сек", "Память разбора крупной стр., МБ", "Группировка, сек", "Блоков", "Групп", "Ошибка"]
+        ws4 = new_sheet("Метрики", m_cols, [30, 16, 22, 10, 14, 10, 10, 12, 12, 18, 16, 10, 10, 40], "A2")
+
+        def num(v, digits=3):
+            return round(v, digits) if v is not None else "—"
+
+        metric_urls, target_pages = all_urls, {target_url}
+        if sections is not None:
+            metric_urls = list(dict.fromkeys(page for url in all_urls for page in sections.get(url, {})))
+            target_pages = set(sections.get(target_url, {}))
+        for ri4, url in enumerate(metric_urls, 2):
+            p = stats.pages.get(url) or dict.fromkeys(RunStats.PAGE_FIELDS)
+            row = [
+                url if sections is not None else short[url],
+                METRIC_SOURCES.get(p["source"], p["source"] or "—"),
+                p["escalated"] or "",
+                p["profile"] or "",
+                num(p["fetch_s"]),
+                p["attempts"] if p["attempts"] is not None else "—",
+                p["credits"] if p["credits"] is not None else "—",
+                num(p["bytes"] / 1024 if p["bytes"] is not None else None, 1),
+                num(p["parse_s"]),
+                num(p["parse_mem"] / 1024 / 1024 if p["parse_mem"] is not None else None, 1),
+                num(p["group_s"]),
+                p["blocks"] if p["blocks"] is not None else "—",
+                p["groups"] if p["groups"] is not None else "—",
+                p["error"] or ("обрезана" if p["truncated"] else ""),
+            ]
+            is_tgt = url in target_pages
+            fill = "target" if is_tgt else ("alt" if ri4 % 2 == 0 else "white")
+            font = "bold" if is_tgt else "normal"
+            ws4.append([
+                styled(ws4, val, style(font, fill, "left" if ci in (1, 2, 3, 14) else "center"))
+                for ci, val in enumerate(row, 1)
+            ])
+
+        ws4.append([])
+        header_style = style("header", "header", "center")
+        ws4.append([styled(ws4, "Стадия / показатель", header_style), styled(ws4, "Значение", header_style)])
+        summary = [(STAGE_LABELS.get(k, k) + ", сек", round(v, 3)) for k, v in stats.stages.items()]
+        summary += [(TOTAL_LABELS.get(k, k), round(v, 3) if isinstance(v, float) else v)
+                    for k, v in stats.totals().items()]
+        for name, val in summary:
+            ws4.append([styled(ws4, name, style("normal", "white", "left")),
+                        styled(ws4, val, style("normal", "white", "center"))])
+
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    return buf.read()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ВЫГРУЗКИ: JSON, CSV, PARQUET (и Excel) — по требованию
+# ═══════════════════════════════════════════════════════════════════════════════
+# Формат → (подпись, расширение файла, MIME)
+EXPORT_FORMATS = {
+    "xlsx": ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "json": ("JSON", "json", "application/json"),
+    "csv": ("CSV", "csv.zip", "application/zip"),
+    "parquet": ("Parquet", "parquet.zip", "application/zip"),
+}
+
+
+def blocks_table(
+    target_url: str,
+    all_results: dict[str, list[dict]],
+    sections: dict[str, dict[str, list[dict]]] | None = None,
+) -> "pd.DataFrame":
+    """Все блоки построчно: сайт, страница (при обходе разделов — своя у каждого блока), позиция и поля блока"""
+    import pandas as pd
+
+    if sections is None:
+        sections = {url: {url: blocks} for url, blocks in all_results.items()}
+    rows = [
+        (site, page, pos, b)
+        for site, pages in sections.items()
+        for page, blocks in pages.items()
+        for pos, b in enumerate(blocks)
+    ]
+    table = pd.DataFrame({
+        "site": pd.Series([r[0] for r in rows], dtype="object"),
+        "page": pd.Series([r[1] for r in rows], dtype="object"),
+        "position": pd.Series([r[2] for r in rows], dtype="int32"),
+    } | {
+        col: pd.Series([r[3][col] for r in rows], dtype=dtype)
+        for col, dtype in BLOCK_DTYPES.items()
+    })
+    table.insert(1, "is_target", table["site"] == target_url)
+    return table
+
+
+def comparison_table(
+    frame: "pd.DataFrame",
+    target_url: str,
+    competitor_urls: list[str],
+    sections: dict[str, dict[str, list[dict]]] | None = None,
+    clusters: "np.ndarray | None" = None,
+) -> "pd.DataFrame":
+    """
+    Сравнение в длинном виде — строка на пару (группа, сайт): число блоков группы,
+    первый заголовок, частота у конкурентов и рекомендация, как на листе
+    «Сравнение блоков»; при обходе разделов — ещё число страниц раздела с группой.
+    С clusters (near_duplicate_clusters(frame)) — ещё конкурент, чьи блоки группы
+    этот сайт почти повторяет, и число таких копий; рекомендация тогда — по
+    частоте без копий шаблона, как на листе с templates.
+    """
+    import numpy as np
+    import pandas as pd
+
+    sites = list(dict.fromkeys(competitor_urls + [target_url]))
+    presence = presence_matrix(frame, competitor_urls + [target_url])
+    freq = presence.iloc[:, :len(competitor_urls)].notna().sum(axis=1)
+    headings = presence.loc[:, ~presence.columns.duplicated()].reindex(columns=sites)
+    copies = duplicate_cells(frame, clusters, competitor_urls) if clusters is not None else None
+    n_copies = copies.notna().sum(axis=1) if copies is not None else 0
+
+    groups = frame["group"].cat.categories
+    n_sites = len(frame["site"].cat.categories)
+    cell = frame["group"].cat.codes.to_numpy().astype("int64") * n_sites + frame["site"].cat.codes.to_numpy()
+    blocks = pd.DataFrame(
+        np.bincount(cell, minlength=len(groups) * n_sites).reshape(len(groups), n_sites),
+        index=groups, columns=frame["site"].cat.categories,
+    ).reindex(columns=sites, fill_value=0)
+
+    n = len(sites)
+    table = pd.DataFrame({
+        "group": np.repeat(groups.to_numpy(dtype="object"), n),
+        "site": np.tile(np.array(sites, dtype="object"), len(groups)),
+        "is_target": np.tile(np.array([url == target_url for url in sites]), len(groups)),
+        "blocks": blocks.to_numpy().ravel().astype("int32"),
+        "heading": headings.to_numpy().ravel(),
+        "competitor_freq": np.repeat(freq.to_numpy().astype("int32"), n),
+        "recommendation": np.repeat(recommendations(freq - n_copies).to_numpy(), n),
+    })
+    if copies is not None:
+        copy_of = copies.loc[:, ~copies.columns.duplicated()].reindex(columns=sites).astype("object")
+        table.insert(5, "duplicate_of", copy_of.where(copy_of.notna(), None).to_numpy().ravel())
+        table.insert(7, "competitor_copies", np.repeat(n_copies.to_numpy().astype("int32"), n))
+    if sections is not None:
+        pages = group_page_counts(sections).reindex(index=groups, columns=sites, fill_value=0)
+        table["pages"] = pages.to_numpy().ravel().astype("int32")
+        table["pages_total"] = np.tile(np.array([len(sections.get(url, {})) for url in sites], dtype="int32"), len(groups))
+    return table
+
+
+def summary_table(
+    frame: "pd.DataFrame",
+    target_url: str,
+    competitor_urls: list[str],
+    stats: "RunStats | None" = None,
+    sections: dict[str, dict[str, list[dict]]] | None = None,
+    clusters: "np.ndarray | None" = None,
+) -> "pd.DataFrame":
+    """
+    Сводка по сайтам (как лист «Сводка») плюс число групп, страниц раздела и
+    ошибка загрузки; с clusters — ещё сайты на похожем шаблоне (через «; »)
+    """
+    sites = list(dict.fromkeys(competitor_urls + [target_url]))
+    table = site_summary(frame, sites).rename_axis("site").reset_index()
+    table.insert(1, "is_target", table["site"] == target_url)
+    groups = frame.groupby("site", observed=False)["group"].nunique().reindex(sites, fill_value=0)
+    table.insert(3, "groups", groups.to_numpy().astype("int32"))
+    if clusters is not None:
+        similar = similar_sites(frame, clusters)
+        table["similar_sites"] = ["; ".join(similar.get(url, [])) for url in sites]
+    if sections is not None:
+        table["pages"] = [len(sections.get(url, {})) for url in sites]
+    elif stats is not None:
+        table["error"] = [(stats.pages.get(url) or {}).get("error") for url in sites]
+    return table
+
+
+def export_tables(
+    target_url: str,
+    competitor_urls: list[str],
+    all_results: dict[str, list[dict]],
+    stats: "RunStats | None" = None,
+    sections: dict[str, dict[str, list[dict]]] | None = None,
+    templates: bool = False,
+) -> dict[str, "pd.DataFrame"]:
+    """Таблицы для JSON/CSV/Parquet: blocks, comparison, summary; templates — как у make_excel"""
+    frame = blocks_frame(all_results)
+    clusters = near_duplicate_clusters(frame) if templates else None
+    return {
+        "blocks": blocks_table(target_url, all_results, sections),
+        "comparison": comparison_table(frame, target_url, competitor_urls, sections, clusters),
+        "summary": summary_table(frame, target_url, competitor_urls, stats, sections, clusters),
+    }
+
+
+def export_bytes(tables: dict[str, "pd.DataFrame"], fmt: str) -> bytes:
+    """Таблицы → файл: JSON — один документ {таблица: [строки]}, CSV и Parquet — zip с файлом на таблицу"""
+    if fmt == "json":
+        return ("{" + ", ".join(
+            f"{json.dumps(name)}: {table.to_json(orient='records', force_ascii=False)}"
+            for name, table in tables.items()
+        ) + "}").encode("utf-8")
+    if fmt not in ("csv", "parquet"):
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, table in tables.items():
+            if fmt == "csv":
+                # utf-8-sig — чтобы Excel открыл кириллицу без мастера импорта
+                zf.writestr(f"{name}.csv", table.to_csv(index=False).encode("utf-8-sig"))
+            else:
+                # Parquet уже сжат — в архив без повторного сжатия
+                zf.writestr(f"{name}.parquet", table.to_parquet(index=False), compress_type=zipfile.ZIP_STORED)
+    return buf.getvalue()
+
+
+class ReportExports:
+    """
+    Выгрузки одного отчёта: файл каждого формата собирается при первом запросе
+    (в интерфейсе — по кнопке «Подготовить») и запоминается; таблицы для
+    JSON, CSV и Parquet считаются один раз на все три. Запросы из разных
+    потоков (сессии Streamlit, пул batch.py) идут по очереди.
+    """
+
+    def __init__(
+        self,
+        target_url: str,
+        competitor_urls: list[str],
+        all_results: dict[str, list[dict]],
+        stats: "RunStats | None" = None,
+        sections: dict[str, dict[str, list[dict]]] | None = None,
+        templates: bool = False,
+    ):
+        self.args = (target_url, competitor_urls, all_results, stats, sections, templates)
+        self.files: dict[str, bytes] = {}
+        self.seconds: dict[str, float] = {}
+        self._tables: dict[str, "pd.DataFrame"] | None = None
+        self._lock = threading.RLock()
+
+    def tables(self) -> dict[str, "pd.DataFrame"]:
+        with self._lock:
+            if self._tables is None:
+                self._tables = export_tables(*self.args)
+            return self._tables
+
+    def get(self, fmt: str) -> bytes:
+        """Файл выгрузки в формате fmt (ключ EXPORT_FORMATS)"""
+        with self._lock:
+            if fmt not in self.files:
+                t0 = time.perf_counter()
+                self.files[fmt] = make_excel(*self.args) if fmt == "xlsx" else export_bytes(self.tables(), fmt)
+                self.seconds[fmt] = time.perf_counter() - t0
+            return self.files[fmt]
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#  ИСТОРИЯ ЗАПУСКОВ (SQLite) И ИЗМЕНЕНИЯ МЕЖДУ НИМИ
+# ═══════════════════════════════════════════════════════════════════════════════
+SNAPSHOTS_PATH = CACHE_DIR.parent / "snapshots.sqlite3"
+SNAPSHOT_BLOCK_FIELDS = tuple(BLOCK_DTYPES)   # порядок столбцов таблицы blocks
+SNAPSHOT_TEXT_CHANGE = 0.2                    # текст группы изменился больше чем на 20% — «изменилась»
+
+CHANGE_LABELS = {
+    "added": "🟢 Появилась",
+    "removed": "🔴 Пропала",
+    "changed": "🟡 Изменилась",
+    "page_added": "➕ Новая страница",
+    "page_removed": "➖ Страницы нет",
+    "error": "⚠️ Не загрузилась",
+}
+
+SNAPSHOT_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    created_at  REAL NOT NULL,
+    target      TEXT NOT NULL,
+    competitors TEXT NOT NULL,     -- JSON-список
+    mode        TEXT NOT NULL,
+    params      TEXT NOT NULL,     -- JSON: стратегия, отпечаток словаря и т.п.
+    run_key     TEXT               -- задание пакетного запуска: повторная запись заменяет запуск
+);
+CREATE TABLE IF NOT EXISTS pages (
+    run_id     INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    url        TEXT NOT NULL,
+    site       TEXT NOT NULL,      -- URL из ввода; при обходе разделов — начало раздела
+    html_hash  TEXT,
+    error      TEXT,
+    PRIMARY KEY (run_id, url)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pages_by_url ON pages (url, run_id);
+CREATE TABLE IF NOT EXISTS blocks (
+    run_id  INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    url     TEXT NOT NULL,
+    pos     INTEGER NOT NULL,
+    {", ".join(f'"{col}" {"TEXT" if dtype == "object" else "INTEGER"} NOT NULL' for col, dtype in BLOCK_DTYPES.items())},
+    PRIMARY KEY (run_id, url, pos)
+) WITHOUT ROWID;
+"""
+
+
+class SnapshotStore:
+    """
+    Снимки запусков в SQLite: блоки каждой страницы (заголовок, уровень, группа,
+    признаки) и хэш её HTML. Изменения между двумя запусками считаются прямо
+    по базе, без повторной загрузки. Соединение — на вызов: объект можно
+    держать между перезапусками скрипта и звать из разных потоков.
+    """
+
+    def __init__(self, path: Path = SNAPSHOTS_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SNAPSHOT_SCHEMA)
+            # Поля блоков, появившиеся позже (simhash): в старых записях — пустые
+            existing = {r["name"] for r in db.execute("PRAGMA table_info(blocks)")}
+            for col, dtype in BLOCK_DTYPES.items():
+                if col not in existing:
+                    kind, default = ("TEXT", "''") if dtype == "object" else ("INTEGER", "0")
+                    db.execute(f'ALTER TABLE blocks ADD COLUMN "{col}" {kind} NOT NULL DEFAULT {default}')
+            if "run_key" not in {r["name"] for r in db.execute("PRAGMA table_info(runs)")}:
+                db.execute("ALTER TABLE runs ADD COLUMN run_key TEXT")
+            db.execute("CREATE UNIQUE INDEX IF NOT EXISTS runs_by_key ON runs (run_key)")
+
+    @contextlib.contextmanager
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA foreign_keys=ON")
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def save_run(
+        self,
+        target: str,
+        competitors: list[str],
+        mode: str,
+        results: dict[str, list[dict]],
+        stats: "RunStats | None" = None,
+        params: dict | None = None,
+        sections: dict[str, dict[str, list[dict]]] | None = None,
+        run_key: str | None = None,
+    ) -> int:
+        """
+        Записывает запуск → его id. results — url → блоки (с итоговыми группами);
+        при обходе разделов — sections (начало раздела → {страница → блоки}).
+        Хэш HTML и ошибка берутся из stats. run_key — задание пакетного запуска:
+        запуск с тем же ключом заменяется (повтор задания при продолжении пакета).
+        """
+        if sections is None:
+            sections = {url: {url: blocks} for url, blocks in results.items()}
+        pages = {page: (site, blocks) for site, section in sections.items() for page, blocks in section.items()}
+        info = stats.pages if stats is not None else {}
+        with self.connect() as db:
+            if run_key is not None:
+                db.execute("DELETE FROM runs WHERE run_key = ?", (run_key,))   # страницы и блоки — каскадом
+            run_id = db.execute(
+                "INSERT INTO runs (created_at, target, competitors, mode, params, run_key) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), target, json.dumps(competitors, ensure_ascii=False), mode,
+                 json.dumps(params or {}, ensure_ascii=False, sort_keys=True), run_key),
+            ).lastrowid
+            db.executemany(
+                "INSERT INTO pages (run_id, url, site, html_hash, error) VALUES (?, ?, ?, ?, ?)",
+                [(run_id, url, site, (info.get(url) or {}).get("html_hash"), (info.get(url) or {}).get("error"))
+                 for url, (site, _) in pages.items()],
+            )
+            columns = ", ".join(f'"{col}"' for col in SNAPSHOT_BLOCK_FIELDS)
+            db.executemany(
+                f"INSERT INTO blocks (run_id, url, pos, {columns}) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(SNAPSHOT_BLOCK_FIELDS))})",
+                [(run_id, url, pos, *(b[col] for col in SNAPSHOT_BLOCK_FIELDS))
+                 for url, (_, blocks) in pages.items() for pos, b in enumerate(blocks)],
+            )
+        return run_id
+
+    def runs(self, url: str | None = None, limit: int = 100) -> list[dict]:
+        """Последние запуски (новые первыми); url — только те, где была эта страница"""
+        query = "SELECT r.*, (SELECT COUNT(*) FROM pages p WHERE p.run_id = r.id) AS n_pages FROM runs r"
+        args: tuple = ()
+        if url is not None:
+            query += " WHERE r.id IN (SELECT run_id FROM pages WHERE url = ?)"
+            args = (url,)
+        with self.connect() as db:
+            rows = db.execute(query + " ORDER BY r.id DESC LIMIT ?", (*args, limit)).fetchall()
+        return [
+            {**dict(r), "competitors": json.loads(r["competitors"]), "params": json.loads(r["params"])}
+            for r in rows
+        ]
+
+    def pages(self, run_id: int) -> dict[str, dict]:
+        """url → {site, html_hash, error} страниц запуска"""
+        with self.connect() as db:
+            rows = db.execute("SELECT url, site, html_hash, error FROM pages WHERE run_id = ?", (run_id,))
+            return {r["url"]: dict(r) for r in rows}
+
+    def blocks(self, run_id: int, url: str) -> list[dict]:
+        """Блоки страницы в запуске — в том же виде, что отдаёт extract_blocks"""
+        columns = ", ".join(f'"{col}"' for col in SNAPSHOT_BLOCK_FIELDS)
+        with self.connect() as db:
+            rows = db.execute(
+                f"SELECT {columns} FROM blocks WHERE run_id = ? AND url = ? ORDER BY pos", (run_id, url),
+            ).fetchall()
+        return [
+            {col: bool(v) if BLOCK_DTYPES[col] == "bool" else v for col, v in zip(SNAPSHOT_BLOCK_FIELDS, r)}
+            for r in rows
+        ]
+
+    def group_stats(self, run_id: int, urls: list[str]) -> "pd.DataFrame":
+        """
+        Сводка групп страниц запуска: (url, group) → блоки, текст, CTA, формы,
+        списки, картинки и список заголовков в порядке блоков на странице
+        """
+        import pandas as pd
+
+        # Порядок строк для json_group_array задаёт подзапрос: у GROUP_CONCAT он не
+        # определён, а заголовок с переводом строки разбил бы склейку через char(10)
+        with self.connect() as db:
+            rows = db.execute("""
+                SELECT url, "group", COUNT(*) AS blocks, SUM(text_len) AS text_len,
+                       SUM(buttons) AS buttons, MAX(has_form) AS has_form, MAX(has_list) AS has_list,
+                       SUM(images) AS images, json_group_array(heading) AS headings
+                FROM (SELECT * FROM blocks WHERE run_id = ? AND url IN (SELECT value FROM json_each(?))
+                      ORDER BY url, "group", pos)
+                GROUP BY url, "group"
+            """, (run_id, json.dumps(urls))).fetchall()
+        columns = ["url", "group", "blocks", "text_len", "buttons", "has_form", "has_list", "images", "headings"]
+        frame = pd.DataFrame([tuple(r) for r in rows], columns=columns, dtype="object")
+        frame["headings"] = [json.loads(h) for h in frame["headings"]]
+        return frame.set_index(["url", "group"])
+
+    def diff(self, old_run: int, new_run: int, urls: list[str] | None = None) -> "pd.DataFrame":
+        """
+        Изменения групп блоков между двумя запусками по страницам (всем общим
+        или только urls): появились, пропали, изменились (число блоков,
+        заголовки, CTA, формы, списки, картинки, объём текста больше чем на
+        SNAPSHOT_TEXT_CHANGE), плюс новые, пропавшие и не загрузившиеся страницы.
+        Страницы с тем же HTML при том же словаре и режиме не сравниваются.
+        """
+        import pandas as pd
+
+        old_pages, new_pages = self.pages(old_run), self.pages(new_run)
+        with self.connect() as db:
+            setups = db.execute("SELECT DISTINCT mode, params FROM runs WHERE id IN (?, ?)", (old_run, new_run)).fetchall()
+        same_setup = len(setups) == 1
+        if urls is None:
+            urls = list(dict.fromkeys([*new_pages, *old_pages]))
+
+        rows = []
+        compare = []
+        for url in urls:
+            old, new = old_pages.get(url), new_pages.get(url)
+            site = (new or old or {}).get("site", url)
+            if old is None and new is None:
+                continue
+            if old is None or new is None:
+                rows.append({"site": site, "url": url, "group": None, "change": "page_added" if old is None else "page_removed"})
+            elif old["error"] or new["error"]:
+                rows.append({"site": site, "url": url, "group": None, "change": "error",
+                             "details": new["error"] or old["error"]})
+            elif not (same_setup and old["html_hash"] and old["html_hash"] == new["html_hash"]):
+                compare.append(url)
+
+        if compare:
+            before, after = self.group_stats(old_run, compare), self.group_stats(new_run, compare)
+            for key in before.index.union(after.index, sort=False):
+                url, group = key
+                site = new_pages[url]["site"]
+                if key not in before.index:
+                    a = after.loc[key]
+                    rows.append({"site": site, "url": url, "group": group, "change": "added",
+                                 "new_blocks": a["blocks"], "new_heading": a["headings"][0]})
+                elif key not in after.index:
+                    b = before.loc[key]
+                    rows.append({"site": site, "url": url, "group": group, "change": "removed",
+                                 "old_blocks": b["blocks"], "old_heading": b["headings"][0]})
+                else:
+                    details = group_changes(before.loc[key], after.loc[key])
+                    if details:
+                        rows.append({
+                            "site": site, "url": url, "group": group, "change": "changed",
+                            "old_blocks": before.loc[key, "blocks"], "new_blocks": after.loc[key, "blocks"],
+                            "old_heading": before.loc[key, "headings"][0],
+                            "new_heading": after.loc[key, "headings"][0],
+                            "details": details,
+                        })
+
+        columns = ["site", "url", "group", "change", "old_blocks", "new_blocks", "old_heading", "new_heading", "details"]
+        return pd.DataFrame(rows, columns=columns, dtype="object")
+
+
+def group_changes(before: "pd.Series", after: "pd.Series") -> str:
+    """Что поменялось в группе между снимками — текстом; пусто, если ничего существенного"""
+    changes = []
+    if before["blocks"] != after["blocks"]:
+        changes.append(f"блоков {before['blocks']}→{after['blocks']}")
+    old_headings, new_headings = set(before["headings"]), set(after["headings"])
+    if old_headings != new_headings:
+        added, removed = sorted(new_headings - old_headings), sorted(old_headings - new_headings)
+        if added:
+            changes.append("новые заголовки: " + "; ".join(f"«{h}»" for h in added[:3]))
+        if removed:
+            changes.append("убраны: " + "; ".join(f"«{h}»" for h in removed[:3]))
+    for col, label in (("buttons", "CTA"), ("images", "изображений")):
+        if before[col] != after[col]:
+            changes.append(f"{label} {before[col]}→{after[col]}")
+    if before["has_form"] != after["has_form"]:
+        changes.append("форма появилась" if after["has_form"] else "форма пропала")
+    if before["has_list"] != after["has_list"]:
+        changes.append("список появился" if after["has_list"] else "список пропал")
+    if abs(after["text_len"] - before["text_len"]) > SNAPSHOT_TEXT_CHANGE * max(before["text_len"], 1):
+        changes.append(f"текст {before['text_len']}→{after['text_len']} симв.")
+    return ", ".join(changes)
@@ -0,0 +1,72 @@
+"""
+КНДР-парсер — история запусков: список сохранённых запусков и изменения между ними
+
+    python history.py list                       # последние запуски
+    python history.py list --url https://site.ru # только с этой страницей
+    python history.py diff 12 15                 # что изменилось между запусками 12 и 15
+    python history.py diff 12 15 --url https://competitor.ru --csv changes.csv
+
+Запуски пишут app.py (галочка «Сохранять историю запусков») и batch.py.
+Изменения считаются по базе, страницы заново не загружаются.
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from engine import CHANGE_LABELS, SNAPSHOTS_PATH, SnapshotStore
+
+
+def cmd_list(store: SnapshotStore, args) -> int:
+    for r in store.runs(args.url, args.limit):
+        started = time.strftime("%Y-%m-%d %H:%M", time.localtime(r["created_at"]))
+        print(f"{r['id']:>6}  {started}  {r['mode']:<5}  страниц: {r['n_pages']:<4}  {r['target']}")
+    return 0
+
+
+def cmd_diff(store: SnapshotStore, args) -> int:
+    diff = store.diff(args.old, args.new, args.url or None)
+    if args.csv:
+        diff.to_csv(args.csv, index=False)
+    if diff.empty:
+        print("Изменений нет")
+        return 0
+    for row in diff.itertuples(index=False):
+        line = f"{CHANGE_LABELS[row.change]:<20} {row.url}"
+        if row.group is not None:
+            line += f"  [{row.group}]"
+        if isinstance(row.details, str):
+            line += f"  {row.details}"
+        print(line)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="История запусков КНДР-парсера")
+    p.add_argument("--db", default=str(SNAPSHOTS_PATH), help="база истории (SQLite)")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    p_list = sub.add_parser("list", help="сохранённые запуски, новые первыми")
+    p_list.add_argument("--url", help="только запуски с этой страницей")
+    p_list.add_argument("--limit", type=int, default=30)
+
+    p_diff = sub.add_parser("diff", help="изменения групп блоков между двумя запусками")
+    p_diff.add_argument("old", type=int, help="id прошлого запуска")
+    p_diff.add_argument("new", type=int, help="id нового запуска")
+    p_diff.add_argument("--url", action="append", help="только эти страницы (можно несколько раз)")
+    p_diff.add_argument("--csv", help="записать изменения в CSV")
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    if not Path(args.db).exists():
+        print(f"❌ Нет базы истории: {args.db}", file=sys.stderr)
+        return 2
+    store = SnapshotStore(Path(args.db))
+    return cmd_list(store, args) if args.command == "list" else cmd_diff(store, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Чтение файла заданий пакетного запуска (batch.py)
+
+    python -m pytest tests
+
+Строка с ошибкой пропускается с номером строки, остальные задания читаются.
+"""
+
+import json
+
+from batch import read_jobs
+
+TARGET = "https://target.ru/"
+COMPETITORS = ["https://a.ru/", "https://b.ru/"]
+
+
+def test_jsonl_skips_bad_rows(tmp_path):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text("\n".join([
+        json.dumps({"id": "first", "target": TARGET, "competitors": COMPETITORS}),
+        "{оборванная строка",
+        "",
+        json.dumps(["не", "объект"]),
+        json.dumps({"target": TARGET, "competitors": COMPETITORS, "mode": "full"}),
+        json.dumps({"id": "last", "target": TARGET, "competitors": COMPETITORS[:1], "mode": "inner"}),
+    ]) + "\n", encoding="utf-8")
+    jobs, problems = read_jobs(path)
+    assert [j["id"] for j in jobs] == ["first", "last"]
+    assert [p.split(":")[0] for p in problems] == ["строка 2", "строка 4", "строка 5"]
+
+
+def test_csv_reports_file_line_numbers(tmp_path):
+    path = tmp_path / "jobs.csv"
+    path.write_text(
+        "id,target,competitors,mode\n"
+        f"one,{TARGET},\"{COMPETITORS[0]}\n{COMPETITORS[1]}\",main\n"   # запись на двух строках файла
+        f"two,ftp://target.ru/,{COMPETITORS[0]},main\n"
+        f"three,{TARGET},{COMPETITORS[1]},inner\n",
+        encoding="utf-8",
+    )
+    jobs, problems = read_jobs(path)
+    assert [j["id"] for j in jobs] == ["one", "three"]
+    assert jobs[0]["competitors"] == COMPETITORS
+    assert [p.split(":")[0] for p in problems] == ["строка 4"]
@@ -0,0 +1,54 @@
+"""
+Обход раздела на локальном статическом сайте (benchmarks/static_site.py)
+
+    python -m pytest tests
+
+Начало раздела /uslugi отвечает редиректом на /uslugi/: ссылки главной
+раздела относительные (p1/), и верны они только от адреса после редиректа.
+"""
+
+import pytest
+
+from engine import ScrapingBeeClient, crawl_site
+from benchmarks import static_site
+
+PAGES, FANOUT = 13, 3
+
+
+@pytest.fixture
+def client():
+    client = ScrapingBeeClient()
+    yield client
+    client.close()
+
+
+@pytest.fixture(params=[False, True], ids=["links", "sitemap"])
+def site(request):
+    srv = static_site.serve(pages=PAGES, fanout=FANOUT, sitemap=request.param)
+    yield srv
+    srv.shutdown()
+
+
+def section_paths(pages: dict, base: str) -> set[str]:
+    return {url.removeprefix(base).rstrip("/") + "/" for url in pages}
+
+
+def test_redirected_section_root(site, client):
+    pages, errors = crawl_site(site.root, "", client=client, max_pages=100)
+    base = site.root.removesuffix("/uslugi")
+    assert errors == {}
+    assert section_paths(pages, base) == {static_site.page_path(i) for i in range(PAGES)}
+    assert all(blocks for blocks in pages.values())
+
+
+def test_links_depth_and_page_limit(client):
+    srv = static_site.serve(pages=PAGES, fanout=FANOUT)
+    try:
+        base = srv.root.removesuffix("/uslugi")
+        pages, _ = crawl_site(srv.root, "", client=client, max_depth=1, use_sitemap=False)
+        # Главная раздела и её дочерние страницы — ссылки p1/…p3/ от адреса после редиректа
+        assert section_paths(pages, base) == {static_site.page_path(i) for i in range(FANOUT + 1)}
+        pages, _ = crawl_site(srv.root, "", client=client, max_pages=5, use_sitemap=False)
+        assert len(pages) == 5
+    finally:
+        srv.shutdown()
@@ -0,0 +1,61 @@
+"""
+История запусков в SQLite (SnapshotStore)
+
+    python -m pytest tests
+
+Заголовки группы — в порядке блоков на странице (в том числе с переводом
+строки); запуск с тем же run_key заменяет прежний.
+"""
+
+import sqlite3
+
+from engine import BLOCK_DTYPES, SnapshotStore
+
+URL = "https://site.ru/"
+
+
+def block(heading: str, group: str, text_len: int = 100) -> dict:
+    b = {col: False if dtype == "bool" else 0 for col, dtype in BLOCK_DTYPES.items()}
+    return {**b, "heading": heading, "group": group, "text_len": text_len, "level": 2}
+
+
+def test_group_headings_in_page_order(tmp_path):
+    store = SnapshotStore(tmp_path / "s.sqlite3")
+    headings = ["Я — последний по алфавиту", "Услуги\nи цены", "А — первый по алфавиту"]
+    run = store.save_run(URL, [], "main", {URL: [block(h, "Услуги") for h in headings]})
+    stats = store.group_stats(run, [URL])
+    assert stats.loc[(URL, "Услуги"), "headings"] == headings
+
+
+def test_diff_heading_with_newline(tmp_path):
+    store = SnapshotStore(tmp_path / "s.sqlite3")
+    old = store.save_run(URL, [], "main", {URL: [block("Услуги\nи цены", "Услуги")]})
+    new = store.save_run(URL, [], "main", {URL: [block("Услуги\nи цены", "Услуги"), block("Отзывы", "Отзывы")]})
+    diff = store.diff(old, new)
+    assert diff[["group", "change", "new_heading"]].values.tolist() == [["Отзывы", "added", "Отзывы"]]
+    diff = store.diff(new, old)
+    assert diff[["group", "change", "old_heading"]].values.tolist() == [["Отзывы", "removed", "Отзывы"]]
+
+
+def test_run_key_replaces_run(tmp_path):
+    store = SnapshotStore(tmp_path / "s.sqlite3")
+    first = store.save_run(URL, [], "main", {URL: [block("Услуги", "Услуги")]}, run_key="batch/job")
+    other = store.save_run(URL, [], "main", {URL: [block("Услуги", "Услуги")]}, run_key="batch/other")
+    again = store.save_run(URL, [], "main", {URL: [block("Отзывы", "Отзывы")]}, run_key="batch/job")
+    assert {r["id"] for r in store.runs()} == {other, again}
+    assert first not in {r["id"] for r in store.runs()}
+    assert [b["heading"] for b in store.blocks(again, URL)] == ["Отзывы"]
+    with sqlite3.connect(store.path) as db:
+        assert db.execute("SELECT COUNT(*) FROM blocks WHERE run_id = ?", (first,)).fetchone()[0] == 0
+
+
+def test_old_database_gets_run_key(tmp_path):
+    path = tmp_path / "s.sqlite3"
+    with sqlite3.connect(path) as db:
+        db.execute("CREATE TABLE runs (id INTEGER PRIMARY KEY, created_at REAL NOT NULL, target TEXT NOT NULL, "
+                   "competitors TEXT NOT NULL, mode TEXT NOT NULL, params TEXT NOT NULL)")
+    store = SnapshotStore(path)
+    store.save_run(URL, [], "main", {URL: [block("Услуги", "Услуги")]}, run_key="batch/job")
+    run = store.save_run(URL, [], "main", {URL: []}, run_key="batch/job")
+    assert [r["id"] for r in store.runs()] == [run]
+    assert store.blocks(run, URL) == []
@@ -0,0 +1,69 @@
+"""
+Движки парсинга дают те же блоки, что BeautifulSoup
+
+    python -m pytest tests
+
+Страницы из benchmarks/fixtures/ и крайние случаи: пустой и битый HTML,
+второй <body>, XHTML с объявлением кодировки, одиночные суррогаты.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from engine import PARSE_ENGINES, extract_blocks
+
+FIXTURES_DIR = Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures"
+
+SECTION = "<section><h2>{}</h2><p>Текст блока про {} и ещё немного слов.</p><a href='#'>Заказать</a></section>"
+
+EDGE_CASES = {
+    "empty": "",
+    "whitespace": "  \n\t ",
+    "comment_only": "<!-- ничего -->",
+    "text_only": "Просто текст без разметки",
+    "no_body": "<h2>Услуги</h2><p>Фрагмент без html и body</p>",
+    "empty_body": "<html><head><title>Пусто</title></head><body></body></html>",
+    "second_body": (
+        "<html><body>" + SECTION.format("Услуги", "услуги") + "</body>"
+        "<body>" + SECTION.format("Отзывы", "отзывы") + "</body></html>"
+    ),
+    "body_after_close": (
+        "<html><body>" + SECTION.format("Цены", "цены") + "</body></html>"
+        + SECTION.format("Контакты", "контакты")
+    ),
+    "lone_surrogate": "<html><body>" + SECTION.format("Гарантия \ud800", "гарантию") + "</body></html>",
+    "surrogate_in_text": "<html><body>" + SECTION.format("Доставка", "доставку \udfff") + "</body></html>",
+    "xhtml_declaration": (
+        '<?xml version="1.0" encoding="utf-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml"><body>'
+        + SECTION.format("Этапы работы", "этапы") + "</body></html>"
+    ),
+    "unclosed_tags": "<body><div><h2>Команда<p>Люди<div><h3>FAQ</h3><ul><li>Вопрос",
+    "junk_headings": (
+        "<body><nav><h2>Меню</h2></nav><script>var h = '<h2>x</h2>'</script>"
+        + SECTION.format("О компании", "компанию") + "<footer><h3>Подвал</h3></footer></body>"
+    ),
+    "nested_headings": (
+        "<body><article><h1>Главный</h1><div><h2>Вложенный</h2><p>текст</p></div>"
+        "<h2>Сосед</h2></article></body>"
+    ),
+}
+
+PAGES = {path.stem: path.read_text(encoding="utf-8") for path in sorted(FIXTURES_DIR.glob("*.html"))}
+PAGES.update(EDGE_CASES)
+
+ENGINES = [e for e in PARSE_ENGINES if e != "bs4"]
+
+
+@pytest.mark.parametrize("mode", ["main", "inner"])
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("page", list(PAGES))
+def test_engine_matches_bs4(page, engine, mode):
+    html = PAGES[page]
+    assert extract_blocks(html, mode, engine=engine) == extract_blocks(html, mode, "bs4")
+
+
+def test_fixtures_have_blocks():
+    # Иначе сравнение пустых списков ничего не проверяет
+    for name in (p.stem for p in FIXTURES_DIR.glob("*.html")):
+        assert extract_blocks(PAGES[name], "main", "bs4"), name